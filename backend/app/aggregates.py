@@ -0,0 +1,181 @@
+import argparse
+import calendar
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, delete, or_, select
+from sqlalchemy.orm import Session
+
+from . import crud, models_db, schemas
+
+# 彙總的欄位 (與 DailyRecord 同名)
+SUM_FIELDS = ["calories_consumed", "protein_g", "fat_g", "carbs_g", "calories_burned_exercise"]
+# 重建時每次從 cursor 取出的筆數
+REBUILD_CHUNK_SIZE = 1000
+
+Period = models_db.PeriodEnum
+
+
+def bucket_start(period: Period, d: date) -> date:
+    """d 所在區間的第一天 (週一或每月一日)"""
+    if period == Period.week:
+        return d - timedelta(days=d.weekday())
+    return d.replace(day=1)
+
+def bucket_end(period: Period, start: date) -> date:
+    if period == Period.week:
+        return start + timedelta(days=6)
+    return start.replace(day=calendar.monthrange(start.year, start.month)[1])
+
+
+def _accumulate(totals: dict, user_id: int, row, buckets: set | None = None):
+    """把一天的紀錄加進所屬的週／月總和；buckets 指定時只累計其中的區間"""
+    for period in Period:
+        key = (period, bucket_start(period, row.record_date))
+        if buckets is not None and key not in buckets:
+            continue
+        acc = totals.get(key)
+        if acc is None:
+            acc = totals[key] = {"user_id": user_id, "period": period, "period_start": key[1], "days": 0,
+                                 **{f: 0 for f in SUM_FIELDS}}
+        acc["days"] += 1
+        for f in SUM_FIELDS:
+            acc[f] += getattr(row, f) or 0
+
+def _upsert(db: Session, values: list[dict]):
+    if not values:
+        return
+    now = datetime.utcnow()
+    stmt = crud.dialect_insert(db, models_db.NutritionAggregate).values([{**v, "updated_at": now} for v in values])
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["user_id", "period", "period_start"],
+        set_={c: stmt.excluded[c] for c in ["days", *SUM_FIELDS, "updated_at"]},
+    ))
+
+
+# --- 寫入時的增量更新 ---
+def refresh(db: Session, user_id: int, dates) -> int:
+    """
+    重新計算這些日期所在的週／月區間 (不 commit，與呼叫端的寫入在同一個交易)。
+    以一次範圍查詢取出受影響區間的紀錄、一次 upsert 寫回，語句數與寫入筆數無關。
+    回傳更新的區間數。
+    """
+    buckets = {(period, bucket_start(period, d)) for d in set(dates) for period in Period}
+    if not buckets:
+        return 0
+    span_start = min(start for _, start in buckets)
+    span_end = max(bucket_end(period, start) for period, start in buckets)
+
+    rows = (
+        db.query(models_db.DailyRecord.record_date, *[getattr(models_db.DailyRecord, f) for f in SUM_FIELDS])
+        .filter(models_db.DailyRecord.user_id == user_id,
+                models_db.DailyRecord.record_date >= span_start,
+                models_db.DailyRecord.record_date <= span_end)
+        .all()
+    )
+    totals: dict = {}
+    for row in rows:
+        _accumulate(totals, user_id, row, buckets)
+    _upsert(db, list(totals.values()))
+    # 紀錄被刪除後，區間內可能已沒有任何一天
+    emptied = buckets - totals.keys()
+    if emptied:
+        A = models_db.NutritionAggregate
+        db.execute(delete(A).where(A.user_id == user_id, or_(
+            *(and_(A.period == period, A.period_start == start) for period, start in emptied))))
+    return len(totals)
+
+
+# --- 重建 (既有資料或修正資料後使用) ---
+def rebuild(db: Session, user_id: int | None = None) -> int:
+    """
+    由 daily_records 重新計算全部 (或單一使用者) 的彙總並提交，回傳寫入的區間數。
+    依 (user_id, record_date) 順序串流讀取，記憶體中只保留一位使用者的區間。
+    """
+    delete_q = db.query(models_db.NutritionAggregate)
+    stmt = select(models_db.DailyRecord.user_id, models_db.DailyRecord.record_date,
+                  *[getattr(models_db.DailyRecord, f) for f in SUM_FIELDS])
+    if user_id is not None:
+        delete_q = delete_q.filter(models_db.NutritionAggregate.user_id == user_id)
+        stmt = stmt.where(models_db.DailyRecord.user_id == user_id)
+    delete_q.delete(synchronize_session=False)
+    stmt = stmt.order_by(models_db.DailyRecord.user_id, models_db.DailyRecord.record_date)
+
+    written = 0
+    current_user, totals = None, {}
+    for partition in db.execute(stmt.execution_options(yield_per=REBUILD_CHUNK_SIZE)).partitions():
+        for row in partition:
+            if row.user_id != current_user:
+                _upsert(db, list(totals.values()))
+                written += len(totals)
+                current_user, totals = row.user_id, {}
+            _accumulate(totals, row.user_id, row)
+    _upsert(db, list(totals.values()))
+    written += len(totals)
+    db.commit()
+    return written
+
+
+# --- 讀取 ---
+def get_trend(db: Session, profile: schemas.UserProfile, period: Period, start: date | None = None,
+              end: date | None = None, limit: int = 12) -> schemas.NutritionTrend:
+    """
+    直接讀取預先彙總的區間 (查詢量與區間數成正比，與天數無關)。
+    未指定 start 時回傳 end (預設今天) 之前最近的 limit 個區間。
+    """
+    end = end or date.today()
+    q = db.query(models_db.NutritionAggregate).filter(
+        models_db.NutritionAggregate.user_id == profile.user.id,
+        models_db.NutritionAggregate.period == period,
+    )
+    if start:
+        q = q.filter(models_db.NutritionAggregate.period_start >= bucket_start(period, start))
+    q = q.filter(models_db.NutritionAggregate.period_start <= end)
+    rows = q.order_by(models_db.NutritionAggregate.period_start.desc()).limit(limit).all()
+    rows.reverse()
+
+    recommended = profile.recommended_daily_calories
+    buckets = []
+    for r in rows:
+        # 每日熱量平衡 = 攝取 - 建議 + 運動消耗，區間加總即為下式
+        balance = r.calories_consumed - r.days * recommended + r.calories_burned_exercise
+        buckets.append(schemas.TrendBucket(
+            period_start=r.period_start,
+            period_end=bucket_end(period, r.period_start),
+            days=r.days,
+            total_calories_consumed=r.calories_consumed,
+            total_protein_g=round(r.protein_g, 2),
+            total_fat_g=round(r.fat_g, 2),
+            total_carbs_g=round(r.carbs_g, 2),
+            total_calories_burned_exercise=r.calories_burned_exercise,
+            total_calorie_balance=round(balance, 2),
+            avg_calories_consumed=round(r.calories_consumed / r.days, 2),
+            avg_protein_g=round(r.protein_g / r.days, 2),
+            avg_fat_g=round(r.fat_g / r.days, 2),
+            avg_carbs_g=round(r.carbs_g / r.days, 2),
+            avg_calories_burned_exercise=round(r.calories_burned_exercise / r.days, 2),
+            avg_calorie_balance=round(balance / r.days, 2),
+        ))
+    return schemas.NutritionTrend(user_id=profile.user.id, period=period, recommended_daily_calories=recommended, buckets=buckets)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="維護每週／每月營養彙總表")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cmd = sub.add_parser("rebuild", help="由 daily_records 重新計算彙總")
+    cmd.add_argument("--user-id", type=int, default=None, help="只重建指定使用者")
+    args = parser.parse_args(argv)
+
+    from .database import SessionLocal, engine
+    from . import migrations
+
+    migrations.upgrade(engine)
+    db = SessionLocal()
+    try:
+        written = rebuild(db, user_id=args.user_id)
+    finally:
+        db.close()
+    print(f"Rebuilt {written} aggregate buckets")
+
+
+if __name__ == "__main__":
+    main()
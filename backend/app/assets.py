@@ -0,0 +1,140 @@
+"""
+前端靜態檔 (STATIC_DIR)：第一次請求時整個目錄讀入記憶體並預先壓縮 (gzip；有安裝 brotli 套件時另產生 br)，
+之後依 Accept-Encoding 直接回傳壓縮好的內容，不必每個請求重新讀檔或壓縮。
+index.html 內的 /static/... 參照會加上內容雜湊 (?v=...)：帶有目前雜湊的請求以 STATIC_MAX_AGE_SECONDS 的
+immutable 快取回應，index.html 本身與不帶雜湊的請求則是 no-cache + ETag，前端更新後瀏覽器立即拿到新版。
+檔案有變動時 (依 mtime，每秒最多檢查一次) 會重新載入，開發時修改前端不必重啟。
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+from typing import NamedTuple
+
+from fastapi import Request, Response
+
+from .settings import STATIC_DIR, STATIC_MAX_AGE_SECONDS
+
+# 小於此大小的檔案不壓縮
+MIN_COMPRESS_BYTES = 512
+# 多久檢查一次檔案是否變動 (秒)
+RELOAD_CHECK_SECONDS = 1.0
+# HTML 中會加上版本參數的參照
+_STATIC_REF = re.compile(r'((?:src|href)=")/static/([^"?#]+)(")')
+
+
+class Asset(NamedTuple):
+    media_type: str
+    version: str               # 內容雜湊前 12 碼，同時是 ETag
+    bodies: dict[str, bytes]   # {"br" / "gzip" / "identity": 內容}
+
+
+def _compress(data: bytes) -> dict[str, bytes]:
+    bodies = {"identity": data}
+    if len(data) < MIN_COMPRESS_BYTES:
+        return bodies
+    bodies["gzip"] = gzip.compress(data, compresslevel=9, mtime=0)
+    try:
+        import brotli  # 選用相依套件
+    except ImportError:
+        pass
+    else:
+        bodies["br"] = brotli.compress(data, quality=11)
+    # 壓縮後沒有變小就不提供
+    return {enc: body for enc, body in bodies.items() if enc == "identity" or len(body) < len(data)}
+
+def _asset(path: str, data: bytes) -> Asset:
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if media_type.startswith("text/") or media_type in ("application/javascript", "application/json"):
+        media_type += "; charset=utf-8"
+    return Asset(media_type, hashlib.sha256(data).hexdigest()[:12], _compress(data))
+
+def _files(directory: str) -> dict[str, str]:
+    """{相對路徑 (以 / 分隔): 絕對路徑}，略過隱藏檔"""
+    files = {}
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in names:
+            if not name.startswith("."):
+                full = os.path.join(root, name)
+                files[os.path.relpath(full, directory).replace(os.sep, "/")] = full
+    return files
+
+def load(directory: str) -> dict[str, Asset]:
+    """讀入目錄下所有檔案；HTML 裡指向 /static/ 的參照先加上該檔的版本參數再計算 HTML 本身的雜湊"""
+    raw = {}
+    for path, full in _files(directory).items():
+        with open(full, "rb") as f:
+            raw[path] = f.read()
+    assets = {path: _asset(path, data) for path, data in raw.items() if not path.endswith(".html")}
+
+    def versioned(match: re.Match) -> str:
+        asset = assets.get(match.group(2))
+        suffix = f"?v={asset.version}" if asset else ""
+        return f"{match.group(1)}/static/{match.group(2)}{suffix}{match.group(3)}"
+
+    for path, data in raw.items():
+        if path.endswith(".html"):
+            html = _STATIC_REF.sub(versioned, data.decode("utf-8"))
+            assets[path] = _asset(path, html.encode("utf-8"))
+    return assets
+
+
+_lock = threading.Lock()
+_assets: dict[str, Asset] | None = None
+_signature: tuple | None = None
+_next_check = 0.0
+
+
+def _signature_of(directory: str) -> tuple:
+    return tuple(sorted((path, os.stat(full).st_mtime_ns) for path, full in _files(directory).items()))
+
+def assets() -> dict[str, Asset]:
+    global _assets, _signature, _next_check
+    if _assets is not None and time.monotonic() < _next_check:
+        return _assets
+    with _lock:
+        if _assets is None or time.monotonic() >= _next_check:
+            signature = _signature_of(STATIC_DIR)
+            if signature != _signature:
+                _assets, _signature = load(STATIC_DIR), signature
+            _next_check = time.monotonic() + RELOAD_CHECK_SECONDS
+    return _assets
+
+def _accepted(header: str) -> set[str]:
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                pass
+        accepted.add(name.strip().lower())
+    return accepted
+
+def response(request: Request, path: str) -> Response | None:
+    """回傳靜態檔的回應；檔案不存在時回傳 None"""
+    asset = assets().get(path)
+    if asset is None:
+        return None
+    accepted = _accepted(request.headers.get("accept-encoding", ""))
+    encoding = next((enc for enc in ("br", "gzip") if enc in asset.bodies and enc in accepted), "identity")
+
+    etag = f'"{asset.version}"' if encoding == "identity" else f'"{asset.version}-{encoding}"'
+    if request.query_params.get("v") == asset.version:
+        cache_control = f"public, max-age={STATIC_MAX_AGE_SECONDS}, immutable"
+    else:
+        cache_control = "no-cache"
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+
+    if etag in (tag.strip() for tag in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(asset.bodies[encoding], media_type=asset.media_type, headers=headers)
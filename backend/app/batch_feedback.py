@@ -0,0 +1,218 @@
+"""
+批次產生 LLM 建議 (適合排程在離峰時段執行)：
+
+    python -m app.batch_feedback run [--since 2025-01-01] [--user-id 3] [--batch-size 10] [--parallel 4]
+
+找出 llm_feedback 為空或已過期 (llm_feedback_key 與目前輸入不符) 的每日紀錄，
+相同輸入只產生一次、先查共用快取，其餘每 batch_size 筆合併成一次 LLM 請求，
+以有限的並行數送出，完成一批就以批次 upsert / UPDATE 寫回。
+"""
+import argparse
+import json
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+from typing import Iterator, NamedTuple
+
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.orm import Session
+
+from . import crud, feedback_cache, models_db, services
+from .llm_client import LLMError
+from .settings import LLM_BATCH_PARALLELISM, LLM_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+# 掃描紀錄時每次從 cursor 取出的筆數；快取查詢的 IN 清單大小
+SCAN_CHUNK_SIZE = 1000
+
+_JSON_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+class StaleRecord(NamedTuple):
+    record_id: int
+    user_id: int
+    key: str            # 目前輸入的雜湊
+    stored_key: str     # 掃描時紀錄上的 llm_feedback_key ("" 代表沒有)
+    inputs: dict
+
+
+def find_stale_records(db: Session, user_id: int | None = None, since: date | None = None) -> Iterator[StaleRecord]:
+    """
+    依 (user_id, record_date) 串流讀取紀錄與使用者欄位 (單一 JOIN 查詢)，在 Python 端計算輸入雜湊，
+    回傳沒有建議或建議已過期的紀錄。BMR 與建議熱量每位使用者只算一次。
+    """
+    R, U = models_db.DailyRecord, models_db.User
+    stmt = (
+        select(R.id, R.user_id, R.llm_feedback_key, R.llm_feedback.is_not(None).label("has_feedback"),
+               R.calories_consumed, R.protein_g, R.fat_g, R.carbs_g, R.calories_burned_exercise,
+               U.age, U.gender, U.height_cm, U.weight_kg, U.goal, U.tdee_estimate, U.tdee_confidence)
+        .join(U, U.id == R.user_id)
+        .order_by(R.user_id, R.record_date)
+    )
+    if user_id is not None:
+        stmt = stmt.where(R.user_id == user_id)
+    if since is not None:
+        stmt = stmt.where(R.record_date >= since)
+
+    current_user, bmr, recommended = None, 0.0, 0.0
+    for partition in db.execute(stmt.execution_options(yield_per=SCAN_CHUNK_SIZE)).partitions():
+        for row in partition:
+            if row.user_id != current_user:
+                current_user = row.user_id
+                bmr, _, recommended = services.daily_targets(row)
+            inputs = services.record_feedback_inputs(row, row, bmr, recommended)
+            key = services.inputs_key(inputs)
+            if not row.has_feedback or row.llm_feedback_key != key:
+                yield StaleRecord(row.id, row.user_id, key, row.llm_feedback_key or "", inputs)
+
+
+def parse_batch_response(text: str, item_ids: list[str]) -> dict[str, str]:
+    """解析批次回應 [{"id", "feedback"}, ...]；格式不符或缺漏的項目不會出現在結果中"""
+    try:
+        items = json.loads(_JSON_FENCE.sub("", text.strip()))
+    except ValueError:
+        return {}
+    if isinstance(items, dict):
+        items = items.get("items", [])
+    wanted = set(item_ids)
+    results = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        item_id, feedback = str(item.get("id")), item.get("feedback")
+        if item_id in wanted and isinstance(feedback, str) and feedback.strip():
+            results[item_id] = feedback.strip()
+    return results
+
+
+def generate_batch(batch: list[tuple[str, dict]]) -> tuple[dict[str, str], int]:
+    """
+    為一批 (key, inputs) 產生建議，回傳 ({key: feedback}, LLM 呼叫次數)。
+    批次回應中缺漏或無法解析的項目改以單筆提示補產生；LLM 失敗時拋出 LLMError。
+    """
+    results: dict[str, str] = {}
+    calls = 0
+    missing = batch
+    if len(batch) > 1:
+        items = {str(i): inputs for i, (_, inputs) in enumerate(batch, 1)}
+        text = services.get_llm().generate(services.build_batch_feedback_prompt(items),
+                                     generation_config={"response_mime_type": "application/json"})
+        calls += 1
+        parsed = parse_batch_response(text, list(items))
+        for i, (key, _) in enumerate(batch, 1):
+            if str(i) in parsed:
+                results[key] = parsed[str(i)]
+        missing = [(key, inputs) for key, inputs in batch if key not in results]
+        if missing:
+            logger.warning("Batch response missing %d of %d items, retrying them one by one", len(missing), len(batch))
+
+    for key, inputs in missing:
+        results[key] = services.get_llm().generate(services.build_feedback_prompt(inputs))
+        calls += 1
+    return {key: feedback.replace("\n", "<br>") for key, feedback in results.items()}, calls
+
+
+def write_feedback(db: Session, feedback: dict[str, str], records_by_key: dict[str, list[StaleRecord]]) -> int:
+    """
+    在同一交易內批次寫入快取與紀錄並遞增資料版本，回傳更新的紀錄數。
+    只更新掃描後未被改寫建議的紀錄 (llm_feedback_key 仍是掃描時的值)，不覆蓋線上流程較新的結果。
+    """
+    if not feedback:
+        return 0
+    feedback_cache.store_many(db, feedback)
+    params = [
+        {"rid": r.record_id, "stored_key": r.stored_key, "feedback": text, "key": key}
+        for key, text in feedback.items() for r in records_by_key[key]
+    ]
+    table = models_db.DailyRecord.__table__
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam("rid"), func.coalesce(table.c.llm_feedback_key, "") == bindparam("stored_key"))
+        .values(llm_feedback=bindparam("feedback"), llm_feedback_key=bindparam("key"))
+    )
+    updated = db.execute(stmt, params).rowcount
+    crud.bump_data_version(db, sorted({r.user_id for key in feedback for r in records_by_key[key]}))
+    db.commit()
+    return updated
+
+
+def run(db: Session, user_id: int | None = None, since: date | None = None, batch_size: int = LLM_BATCH_SIZE,
+        parallel: int = LLM_BATCH_PARALLELISM, limit: int | None = None) -> dict:
+    """執行一次批次產生，回傳統計"""
+    started = time.perf_counter()
+    stats = {"stale_records": 0, "unique_inputs": 0, "cache_hits": 0, "generated": 0, "failed": 0,
+             "llm_calls": 0, "records_updated": 0}
+
+    records_by_key: dict[str, list[StaleRecord]] = {}
+    for record in find_stale_records(db, user_id=user_id, since=since):
+        if limit is not None and stats["stale_records"] >= limit:
+            break
+        stats["stale_records"] += 1
+        records_by_key.setdefault(record.key, []).append(record)
+    db.commit()  # 結束掃描用的讀取交易
+    stats["unique_inputs"] = len(records_by_key)
+
+    # 相同輸入可能已有快取 (其他使用者或其他日期)，直接寫回
+    keys = list(records_by_key)
+    cached_keys = set()
+    for i in range(0, len(keys), SCAN_CHUNK_SIZE):
+        cached = feedback_cache.lookup_many(db, keys[i:i + SCAN_CHUNK_SIZE])
+        cached_keys.update(cached)
+        stats["cache_hits"] += len(cached)
+        stats["records_updated"] += write_feedback(db, cached, records_by_key)
+
+    pending = [(key, records[0].inputs) for key, records in records_by_key.items() if key not in cached_keys]
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), max(1, batch_size))]
+    if batches and not services.llm_available():
+        raise LLMError("LLM 服務未配置或 API 金鑰遺失")
+
+    # 並行呼叫 LLM，完成一批就在主執行緒寫回 (session 不跨執行緒共用)
+    with ThreadPoolExecutor(max_workers=max(1, parallel), thread_name_prefix="llm-batch") as pool:
+        futures = {pool.submit(generate_batch, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                feedback, calls = future.result()
+            except LLMError as e:
+                # 這一批留待下次執行；斷路器打開後其餘批次會很快失敗，不會持續打上游
+                logger.warning("Batch of %d items failed: %s", len(batch), e)
+                stats["failed"] += len(batch)
+                continue
+            stats["llm_calls"] += calls
+            stats["generated"] += len(feedback)
+            stats["records_updated"] += write_feedback(db, feedback, records_by_key)
+
+    stats["elapsed_s"] = round(time.perf_counter() - started, 3)
+    return stats
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="批次產生缺少或過期的 LLM 建議")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cmd = sub.add_parser("run", help="找出缺少或過期的建議並批次產生")
+    cmd.add_argument("--user-id", type=int, default=None, help="只處理指定使用者")
+    cmd.add_argument("--since", type=date.fromisoformat, default=None, help="只處理此日期 (含) 之後的紀錄")
+    cmd.add_argument("--batch-size", type=int, default=LLM_BATCH_SIZE, help="每次 LLM 請求包含的紀錄數")
+    cmd.add_argument("--parallel", type=int, default=LLM_BATCH_PARALLELISM, help="同時進行的 LLM 請求數")
+    cmd.add_argument("--limit", type=int, default=None, help="最多處理的紀錄數")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from .database import SessionLocal, engine
+    from . import migrations
+
+    migrations.upgrade(engine)
+    db = SessionLocal()
+    try:
+        stats = run(db, user_id=args.user_id, since=args.since, batch_size=args.batch_size,
+                    parallel=args.parallel, limit=args.limit)
+    finally:
+        db.close()
+    print(json.dumps(stats, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import codecs
+import csv
+import io
+import json
+from datetime import date
+from typing import AsyncIterator, Iterator
+
+from sqlalchemy import select
+
+from . import models_db
+from .database import SessionLocal
+
+# 匯入／匯出的欄位 (與 DailyRecordCreate 相同)
+RECORD_FIELDS = ["record_date", "calories_consumed", "protein_g", "fat_g", "carbs_g", "calories_burned_exercise"]
+# 每批 upsert 的筆數，以及匯出時每次從 cursor 取出的筆數
+BULK_CHUNK_SIZE = 500
+
+CONTENT_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def detect_format(content_type: str | None) -> str | None:
+    content_type = (content_type or "").split(";", 1)[0].strip().lower()
+    for fmt, mime in CONTENT_TYPES.items():
+        if content_type == mime:
+            return fmt
+    if content_type in ("application/jsonl", "application/jsonlines"):
+        return "ndjson"
+    return None
+
+
+# --- 匯入：串流解析 ---
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """把上傳的位元組串流切成文字行，不把整個檔案讀進記憶體"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+async def iter_records(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    """
+    逐行解析 CSV (第一行為欄位名稱) 或 NDJSON，產生 (行號, 欄位 dict, 錯誤訊息)。
+    空白行略過；CSV 的空欄位視為未提供 (交由 schema 預設值處理)。
+    """
+    header = None
+    line_no = 0
+    async for line in iter_lines(chunks):
+        line_no += 1
+        if not line.strip():
+            continue
+        if fmt == "ndjson":
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_no, None, f"Invalid JSON: {e.msg}"
+                continue
+            if not isinstance(data, dict):
+                yield line_no, None, "Each line must be a JSON object"
+                continue
+            yield line_no, data, None
+            continue
+
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [v.strip() for v in values]
+            missing = [f for f in RECORD_FIELDS if f not in header and f != "calories_burned_exercise"]
+            if missing:
+                yield line_no, None, f"CSV header is missing columns: {', '.join(missing)}"
+                return
+            continue
+        if len(values) != len(header):
+            yield line_no, None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        yield line_no, {k: v for k, v in zip(header, values) if v.strip() != ""}, None
+
+
+# --- 匯出：server-side cursor 串流 ---
+def _format_csv(rows: list) -> str:
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator="\n").writerows(
+        (r.record_date.isoformat(), r.calories_consumed, r.protein_g, r.fat_g, r.carbs_g, r.calories_burned_exercise or 0)
+        for r in rows
+    )
+    return buf.getvalue()
+
+def _format_ndjson(rows: list) -> str:
+    return "".join(
+        json.dumps({
+            "record_date": r.record_date.isoformat(),
+            "calories_consumed": r.calories_consumed,
+            "protein_g": r.protein_g,
+            "fat_g": r.fat_g,
+            "carbs_g": r.carbs_g,
+            "calories_burned_exercise": r.calories_burned_exercise or 0,
+        }) + "\n"
+        for r in rows
+    )
+
+def export_records(user_id: int, fmt: str, start: date | None = None, end: date | None = None) -> Iterator[str]:
+    """
+    依日期遞增輸出使用者的紀錄。以 yield_per 分批從 cursor 取資料
+    (PostgreSQL 會使用具名 server-side cursor)，記憶體用量與歷史長度無關。
+    使用獨立 session，因為回應串流期間請求的 session 可能已關閉。
+    """
+    columns = [getattr(models_db.DailyRecord, f) for f in RECORD_FIELDS]
+    stmt = select(*columns).where(models_db.DailyRecord.user_id == user_id)
+    if start:
+        stmt = stmt.where(models_db.DailyRecord.record_date >= start)
+    if end:
+        stmt = stmt.where(models_db.DailyRecord.record_date <= end)
+    stmt = stmt.order_by(models_db.DailyRecord.record_date).execution_options(yield_per=BULK_CHUNK_SIZE)
+
+    format_rows = _format_csv if fmt == "csv" else _format_ndjson
+    if fmt == "csv":
+        yield ",".join(RECORD_FIELDS) + "\n"
+
+    db = SessionLocal()
+    try:
+        for partition in db.execute(stmt).partitions():
+            yield format_rows(partition)
+    finally:
+        db.close()
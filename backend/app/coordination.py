@@ -0,0 +1,329 @@
+"""
+多 worker／多主機部署時的共用協調層：跨行程租約 (lock)、快取失效通知與 LLM 工作佇列。
+    COORDINATION_BACKEND=database (預設)：使用應用程式本身的資料庫，單機多 worker 共用一個 SQLite 檔即可運作
+    COORDINATION_BACKEND=redis：改用 Redis (COORDINATION_REDIS_URL)，工作佇列由所有 worker 共同消化，適合多主機
+後端在第一次使用時才建立；失效通知由 start() 啟動的背景執行緒接收並轉給 subscribe() 登記的 callback。
+只有單一行程 (database 後端且 WEB_CONCURRENCY=1) 時不發送也不接收通知；命令列工具 (例如匯入、TDEE 重算) 與
+多 worker 的 API 同時執行時，請在 .env 設定 WEB_CONCURRENCY，讓它們也發出失效通知。
+"""
+import atexit
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable
+
+from sqlalchemy import insert
+
+from . import crud, models_db
+from .database import SessionLocal
+from .settings import COORDINATION_BACKEND, COORDINATION_POLL_SECONDS, COORDINATION_REDIS_URL, WEB_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# 本行程的識別：租約持有者，以及略過自己發出的通知
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# 通知保留多久 (落後超過這個時間的 worker 只能靠快取 TTL 收斂)
+EVENT_RETENTION = timedelta(minutes=10)
+# 結束時等待待送通知寫出的上限 (秒)
+FLUSH_TIMEOUT = 5.0
+
+
+class DatabaseBackend:
+    """
+    租約：llm_leases 資料列 (條件式 upsert)；通知：coordination_events 資料表，各行程依 id 遞增輪詢；
+    工作佇列：行程內佇列，工作本身存在 llm_jobs，其他行程的遺留工作由 jobs 的定期掃描接手。
+    """
+    name = "database"
+    blocking = False
+
+    def __init__(self):
+        self._jobs: "queue.Queue[int]" = queue.Queue()
+        self._last_event_id: int | None = None
+        self._next_prune = 0.0
+
+    # --- 租約 ---
+    def acquire_lease(self, key: str, owner: str, ttl: int) -> bool:
+        """key 不存在或原租約已過期時取得成功"""
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            stmt = crud.dialect_insert(db, models_db.LLMLease).values(
+                key=key, owner=owner, expires_at=now + timedelta(seconds=ttl))
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["key"],
+                set_={"owner": stmt.excluded.owner, "expires_at": stmt.excluded.expires_at},
+                where=models_db.LLMLease.expires_at < now,
+            )
+            acquired = db.execute(stmt).rowcount == 1
+            db.commit()
+            return acquired
+        finally:
+            db.close()
+
+    def renew_lease(self, key: str, owner: str, ttl: int) -> bool:
+        """延長自己持有的租約；租約已過期並被其他持有者取得時回傳 False"""
+        db = SessionLocal()
+        try:
+            renewed = db.query(models_db.LLMLease).filter(
+                models_db.LLMLease.key == key, models_db.LLMLease.owner == owner
+            ).update({"expires_at": datetime.utcnow() + timedelta(seconds=ttl)}, synchronize_session=False)
+            db.commit()
+            return renewed == 1
+        finally:
+            db.close()
+
+    def release_lease(self, key: str, owner: str):
+        db = SessionLocal()
+        try:
+            db.query(models_db.LLMLease).filter(models_db.LLMLease.key == key, models_db.LLMLease.owner == owner).delete()
+            db.commit()
+        finally:
+            db.close()
+
+    # --- 通知 ---
+    def publish(self, channel: str, keys: list[str]):
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            db.execute(insert(models_db.CoordinationEvent), [
+                {"channel": channel, "key": key, "origin": OWNER, "created_at": now} for key in keys
+            ])
+            db.commit()
+        finally:
+            db.close()
+
+    def receive(self, timeout: float) -> list[tuple[str, str]]:
+        """取回上次之後其他行程發出的通知 [(channel, key)]；第一次呼叫只記下目前的位置"""
+        E = models_db.CoordinationEvent
+        db = SessionLocal()
+        try:
+            if self._last_event_id is None:
+                self._last_event_id = db.query(E.id).order_by(E.id.desc()).limit(1).scalar() or 0
+                return []
+            # PostgreSQL 的序號可能不依提交順序出現，極少數通知因此錯過時由快取 TTL 收斂
+            rows = (
+                db.query(E.id, E.channel, E.key, E.origin)
+                .filter(E.id > self._last_event_id)
+                .order_by(E.id)
+                .all()
+            )
+            if rows:
+                self._last_event_id = rows[-1].id
+            if time.monotonic() >= self._next_prune:
+                self._next_prune = time.monotonic() + EVENT_RETENTION.total_seconds() / 10
+                db.query(E).filter(E.created_at < datetime.utcnow() - EVENT_RETENTION).delete(synchronize_session=False)
+                db.commit()
+            return [(r.channel, r.key) for r in rows if r.origin != OWNER]
+        finally:
+            db.close()
+
+    # --- 工作佇列 ---
+    def push_job(self, job_id: int):
+        self._jobs.put(job_id)
+
+    def pop_job(self, timeout: float) -> int | None:
+        try:
+            return self._jobs.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def job_queue_depth(self) -> int:
+        return self._jobs.qsize()
+
+
+class RedisBackend:
+    """租約：SET NX EX；通知：Redis stream (XADD / XREAD)；工作佇列：所有 worker 共用的 list (LPUSH / BRPOP)"""
+    name = "redis"
+    blocking = True
+
+    # 只刪除自己持有的租約
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+    # 只延長自己持有的租約
+    _RENEW = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('expire', KEYS[1], ARGV[2]) end return 0"
+
+    def __init__(self, url: str, prefix: str = "dailydiet:"):
+        import redis  # 選用相依套件，只有 COORDINATION_BACKEND=redis 時才需要
+
+        self._client = redis.Redis.from_url(url, socket_timeout=COORDINATION_POLL_SECONDS + 5)
+        self._release = self._client.register_script(self._RELEASE)
+        self._renew = self._client.register_script(self._RENEW)
+        self.prefix = prefix
+        self._events = f"{prefix}events"
+        self._jobs = f"{prefix}llm_jobs"
+        self._last_event_id: str | None = None
+
+    def acquire_lease(self, key: str, owner: str, ttl: int) -> bool:
+        return bool(self._client.set(f"{self.prefix}lease:{key}", owner, nx=True, ex=ttl))
+
+    def renew_lease(self, key: str, owner: str, ttl: int) -> bool:
+        return bool(self._renew(keys=[f"{self.prefix}lease:{key}"], args=[owner, ttl]))
+
+    def release_lease(self, key: str, owner: str):
+        self._release(keys=[f"{self.prefix}lease:{key}"], args=[owner])
+
+    def publish(self, channel: str, keys: list[str]):
+        pipe = self._client.pipeline(transaction=False)
+        for key in keys:
+            pipe.xadd(self._events, {"channel": channel, "key": key, "origin": OWNER}, maxlen=10000, approximate=True)
+        pipe.execute()
+
+    def receive(self, timeout: float) -> list[tuple[str, str]]:
+        if self._last_event_id is None:
+            latest = self._client.xrevrange(self._events, count=1)
+            self._last_event_id = latest[0][0] if latest else "0-0"
+        streams = self._client.xread({self._events: self._last_event_id}, block=int(timeout * 1000), count=1000)
+        events = []
+        for _, entries in streams:
+            for entry_id, fields in entries:
+                self._last_event_id = entry_id
+                if fields[b"origin"].decode() != OWNER:
+                    events.append((fields[b"channel"].decode(), fields[b"key"].decode()))
+        return events
+
+    def push_job(self, job_id: int):
+        self._client.lpush(self._jobs, job_id)
+
+    def pop_job(self, timeout: float) -> int | None:
+        item = self._client.brpop(self._jobs, timeout=max(1, round(timeout)))
+        return int(item[1]) if item else None
+
+    def job_queue_depth(self) -> int:
+        return self._client.llen(self._jobs)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_subscribers: dict[str, list[Callable[[str], None]]] = {}
+_listener: threading.Thread | None = None
+_listener_lock = threading.Lock()
+_stop = threading.Event()
+# 待送通知 (channel, keys)；None 代表送完後結束
+_outbox: "queue.Queue[tuple[str, list[str]] | None]" = queue.Queue()
+_publisher: threading.Thread | None = None
+_publisher_lock = threading.Lock()
+
+
+def backend():
+    """目前設定的協調後端 (第一次呼叫時建立)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if COORDINATION_BACKEND == "redis":
+                    _backend = RedisBackend(COORDINATION_REDIS_URL)
+                elif COORDINATION_BACKEND == "database":
+                    _backend = DatabaseBackend()
+                else:
+                    raise ValueError(f"Unknown COORDINATION_BACKEND: {COORDINATION_BACKEND!r}")
+    return _backend
+
+def subscribe(channel: str, callback: Callable[[str], None]):
+    """登記其他行程在 channel 上發出通知時要呼叫的 callback(key)"""
+    _subscribers.setdefault(channel, []).append(callback)
+
+def multi_process() -> bool:
+    """是否可能有其他行程需要通知：redis 後端 (可能多主機) 或 WEB_CONCURRENCY > 1"""
+    return COORDINATION_BACKEND == "redis" or WEB_CONCURRENCY > 1
+
+def publish(channel: str, keys: list[str]):
+    """
+    通知其他行程 (例如某些快取鍵已失效)。只放進待送佇列，由背景執行緒批次寫入後端，
+    呼叫端 (請求的交易或 event loop) 不等待 I/O；失敗時只記錄警告，其他行程的快取最多存活到 TTL。
+    """
+    if not keys or not multi_process():
+        return
+    _start_publisher()
+    _outbox.put((channel, list(keys)))
+
+def _send(batch: dict[str, dict[str, None]]):
+    b = backend()
+    for channel, keys in batch.items():
+        try:
+            b.publish(channel, list(keys))
+        except Exception as e:
+            logger.warning("Publishing %d %s notifications failed: %s", len(keys), channel, e)
+
+def _publish_loop():
+    while True:
+        item = _outbox.get()
+        # 佇列中已累積的通知一次送出，同一 channel 合併成一次寫入 (重複的鍵只送一次)
+        batch: dict[str, dict[str, None]] = {}
+        while item is not None:
+            channel, keys = item
+            batch.setdefault(channel, {}).update(dict.fromkeys(keys))
+            try:
+                item = _outbox.get_nowait()
+            except queue.Empty:
+                break
+        _send(batch)
+        if item is None:
+            return
+
+def _start_publisher():
+    global _publisher
+    if _publisher is not None:
+        return
+    with _publisher_lock:
+        if _publisher is None:
+            _publisher = threading.Thread(target=_publish_loop, name="coordination-publisher", daemon=True)
+            _publisher.start()
+
+def flush(timeout: float = FLUSH_TIMEOUT):
+    """送出所有待送通知並結束背景執行緒 (關閉時呼叫；之後再 publish 會重新啟動)"""
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None:
+            return
+        _outbox.put(None)
+        _publisher.join(timeout)
+        _publisher = None
+
+# 命令列工具不經過 lifespan，結束前也要送出失效通知
+atexit.register(flush)
+
+def _listen():
+    b = backend()
+    while not _stop.is_set():
+        try:
+            events = b.receive(COORDINATION_POLL_SECONDS)
+        except Exception as e:
+            logger.warning("Receiving coordination events failed: %s", e)
+            events = []
+            _stop.wait(COORDINATION_POLL_SECONDS)
+        for channel, key in events:
+            for callback in _subscribers.get(channel, ()):
+                callback(key)
+        if not b.blocking:
+            _stop.wait(COORDINATION_POLL_SECONDS)
+
+def start():
+    """啟動接收通知的背景執行緒 (lifespan 中呼叫)；只有單一行程時不需要"""
+    global _listener
+    if not multi_process():
+        return
+    with _listener_lock:
+        if _listener is not None:
+            return
+        _stop.clear()
+        _listener = threading.Thread(target=_listen, name="coordination-listener", daemon=True)
+        _listener.start()
+
+def stop(timeout: float = 5.0):
+    global _listener
+    flush(timeout)
+    with _listener_lock:
+        if _listener is None:
+            return
+        _stop.set()
+        _listener.join(timeout)
+        _listener = None
+
+def stats() -> dict:
+    return {"backend": COORDINATION_BACKEND, "owner": OWNER, "multi_process": multi_process(),
+            "listening": _listener is not None, "pending_notifications": _outbox.qsize()}
@@ -1,14 +1,51 @@
+from sqlalchemy import Numeric, and_, case, cast, delete, func, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from . import models_db, schemas
-from datetime import date
+from . import aggregates, models_db, pagination, schemas, tdee, user_cache
+from datetime import date, datetime
+
+def dialect_insert(db: Session, model):
+    """依連線的資料庫方言回傳支援 ON CONFLICT 的 INSERT 語句 (SQLite / PostgreSQL)"""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
 
 # --- User CRUD ---
 def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models_db.User).offset(skip).limit(limit).all()
+    """舊的 offset 分頁 (已不建議使用，深頁成本隨 skip 線性成長)"""
+    return db.query(models_db.User).order_by(models_db.User.id).offset(skip).limit(limit).all()
+
+def get_users_page(db: Session, limit: int = 100, cursor: str | None = None) -> pagination.Page:
+    """依 id 遞增的 keyset 分頁 (走主鍵索引)"""
+    return pagination.keyset_page(db.query(models_db.User), [models_db.User.id], descending=False,
+                                  limit=limit, scope="users", cursor=cursor)
 
 def get_user(db: Session, user_id: int) -> models_db.User | None:
     return db.query(models_db.User).filter(models_db.User.id == user_id).first()
 
+def get_data_version(db: Session, user_id: int) -> tuple[int, datetime | None] | None:
+    """使用者資料版本 (條件式 GET 用)；使用者不存在時回傳 None"""
+    row = db.query(models_db.User.data_version, models_db.User.data_updated_at).filter(models_db.User.id == user_id).first()
+    return tuple(row) if row is not None else None
+
+def user_exists(db: Session, user_id: int) -> bool:
+    return db.query(models_db.User.id).filter(models_db.User.id == user_id).first() is not None
+
+def bump_data_version(db: Session, user_ids):
+    """
+    遞增使用者資料版本 (不 commit，與造成變更的寫入在同一交易)。
+    以 ORM UPDATE 執行，session 中已載入的 User 物件會同步拿到新版本。
+    """
+    if isinstance(user_ids, int):
+        user_ids = [user_ids]
+    db.execute(
+        update(models_db.User)
+        .where(models_db.User.id.in_(user_ids))
+        .values(data_version=models_db.User.data_version + 1, data_updated_at=datetime.utcnow())
+    )
+
 def create_user(db: Session, user: schemas.UserCreate) -> models_db.User:
     data = user.model_dump(exclude_unset=True)
     if "nickname" in data and (data["nickname"] is None or not data["nickname"].strip()):
@@ -16,24 +53,26 @@ def create_user(db: Session, user: schemas.UserCreate) -> models_db.User:
 
     db_user = models_db.User(**data)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-
+    # flush 以 INSERT ... RETURNING 取得 id，預設暱稱在同一個交易內補上，只 commit 一次
+    db.flush()
     if not db_user.nickname:
         db_user.nickname = f"User{db_user.id:03d}"
-        db.commit()
-        db.refresh(db_user)
-
+    db.commit()
     return db_user
 
 def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate) -> models_db.User | None:
-    db_user = get_user(db, user_id)
-    if db_user:
-        update_data = user_update.model_dump(exclude_unset=True) # Pydantic v2: user_update.model_dump(exclude_unset=True)
-        for key, value in update_data.items():
-            setattr(db_user, key, value)
-        db.commit()
-        db.refresh(db_user)
+    update_data = user_update.model_dump(exclude_unset=True) # Pydantic v2: user_update.model_dump(exclude_unset=True)
+    # 單一 UPDATE ... RETURNING：不需先 SELECT，也不需 commit 後 refresh
+    stmt = (
+        update(models_db.User)
+        .where(models_db.User.id == user_id)
+        .values(**update_data, data_version=models_db.User.data_version + 1, data_updated_at=datetime.utcnow())
+        .returning(models_db.User)
+        .execution_options(populate_existing=True)
+    )
+    db_user = db.scalars(stmt).first()
+    db.commit()
+    user_cache.invalidate(user_id)
     return db_user
 
 # --- Daily Record CRUD ---
@@ -47,20 +86,245 @@ def create_daily_record(db: Session, daily_record: schemas.DailyRecordCreate, us
 def get_daily_records_by_user(db: Session, user_id: int, skip: int = 0, limit: int = 100) -> list[models_db.DailyRecord]:
     return db.query(models_db.DailyRecord).filter(models_db.DailyRecord.user_id == user_id).order_by(models_db.DailyRecord.record_date.desc()).offset(skip).limit(limit).all()
 
+def get_daily_records_page(db: Session, user_id: int, limit: int = 100, cursor: str | None = None) -> pagination.Page:
+    """
+    依 (record_date, id) 遞減的 keyset 分頁。
+    user_id 固定、record_date 在 ux_daily_user_date (user_id, record_date) 內唯一，每頁都是該索引上的一段範圍掃描。
+    """
+    return pagination.keyset_page(
+        db.query(models_db.DailyRecord).filter(models_db.DailyRecord.user_id == user_id),
+        [models_db.DailyRecord.record_date, models_db.DailyRecord.id], descending=True,
+        limit=limit, scope=f"daily_records:{user_id}", cursor=cursor,
+        parsers=[date.fromisoformat, int], serializers=[date.isoformat, int],
+    )
+
 def get_daily_record_by_date(db: Session, user_id: int, record_date: date) -> models_db.DailyRecord | None:
     return db.query(models_db.DailyRecord).filter(models_db.DailyRecord.user_id == user_id, models_db.DailyRecord.record_date == record_date).first()
 
-def get_or_create_daily_record(db: Session, user_id: int, record_data: schemas.DailyRecordCreate) -> models_db.DailyRecord:
-    db_record = get_daily_record_by_date(db, user_id, record_data.record_date)
-    if db_record:
-        # Update existing record
-        update_data = record_data.model_dump(exclude_unset=True)
-        for key, value in update_data.items():
-            setattr(db_record, key, value)
-        db.commit()
-        db.refresh(db_record)
-        return db_record
-    else:
-        # Create new record
-        return create_daily_record(db, record_data, user_id)
+def get_user_with_record(db: Session, user_id: int, record_date: date) -> tuple[models_db.User, models_db.DailyRecord | None] | None:
+    """單一 LEFT JOIN 查詢同時取得使用者與當日紀錄；使用者不存在時回傳 None"""
+    row = (
+        db.query(models_db.User, models_db.DailyRecord)
+        .outerjoin(models_db.DailyRecord, and_(models_db.DailyRecord.user_id == models_db.User.id,
+                                               models_db.DailyRecord.record_date == record_date))
+        .filter(models_db.User.id == user_id)
+        .first()
+    )
+    return tuple(row) if row is not None else None
+
+def get_filled_dates(db: Session, user_id: int, start: date | None = None, end: date | None = None) -> list[date]:
+    q = db.query(models_db.DailyRecord.record_date).filter_by(user_id=user_id)
+    if start:
+        q = q.filter(models_db.DailyRecord.record_date >= start)
+    if end:
+        q = q.filter(models_db.DailyRecord.record_date <= end)
+
+    # SQLAlchemy 會傳回 list[(date,)]，展平成純 date
+    return [d[0] for d in q.all()]
+
+def get_daily_records_in_range(db: Session, user_id: int, start: date, end: date) -> list[models_db.DailyRecord]:
+    """單一查詢取出期間內的紀錄 (走 ux_daily_user_date 索引)，依日期遞增"""
+    return (
+        db.query(models_db.DailyRecord)
+        .filter(models_db.DailyRecord.user_id == user_id,
+                models_db.DailyRecord.record_date >= start,
+                models_db.DailyRecord.record_date <= end)
+        .order_by(models_db.DailyRecord.record_date)
+        .all()
+    )
+
+def get_or_create_daily_record(db: Session, user_id: int, record_data: schemas.DailyRecordCreate) -> models_db.DailyRecord | None:
+    """
+    以單一 INSERT ... ON CONFLICT (user_id, record_date) DO UPDATE ... RETURNING 新增或更新當日紀錄，
+    並在同一交易內更新週／月彙總。更新時只覆寫請求中有提供的欄位。
+    使用者不存在時由外鍵擋下，回傳 None；其他完整性錯誤照常拋出。
+    """
+    update_data = record_data.model_dump(exclude_unset=True)
+    update_data.pop("record_date", None)
+
+    stmt = dialect_insert(db, models_db.DailyRecord).values(**record_data.model_dump(), user_id=user_id)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "record_date"],
+        set_={key: stmt.excluded[key] for key in update_data},
+    ).returning(models_db.DailyRecord).execution_options(populate_existing=True)
+    try:
+        db_record = db.scalars(stmt).one()
+    except IntegrityError:
+        db.rollback()
+        if user_exists(db, user_id):
+            raise  # 不是外鍵 (使用者不存在) 造成的完整性錯誤，不可當成 404
+        return None
+    # 同一交易內更新該日所在的週／月彙總、TDEE 估計與使用者資料版本
+    aggregates.refresh(db, user_id, [db_record.record_date])
+    tdee_changed = tdee.refresh(db, user_id, [db_record.record_date])
+    bump_data_version(db, user_id)
+    db.commit()
+    if tdee_changed:
+        user_cache.invalidate(user_id)
+    return db_record
+
+# 匯入時以 excluded 值覆寫的欄位 (llm_feedback 不動，過期與否由 llm_feedback_key 判斷)
+_UPSERT_COLUMNS = ["calories_consumed", "protein_g", "fat_g", "carbs_g", "calories_burned_exercise"]
+
+def bulk_upsert_daily_records(db: Session, user_id: int, rows: list[dict]) -> int:
+    """
+    以單一 INSERT ... ON CONFLICT (user_id, record_date) DO UPDATE 寫入一批紀錄、更新受影響的週／月彙總並提交。
+    rows 內不可有重複日期 (PostgreSQL 不允許同一語句更新同一列兩次)。
+    列只含有提供的欄位：依欄位組合分組，每組只覆寫該組提供的欄位，未提供的欄位在既有紀錄上保留原值
+    (新紀錄則採欄位預設值)，與單筆 upsert 的行為一致。
+    """
+    if not rows:
+        return 0
+    groups: dict[frozenset, list[dict]] = {}
+    for row in rows:
+        groups.setdefault(frozenset(row), []).append({**row, "user_id": user_id})
+    for columns, group in groups.items():
+        stmt = dialect_insert(db, models_db.DailyRecord).values(group)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "record_date"],
+            set_={col: stmt.excluded[col] for col in _UPSERT_COLUMNS if col in columns},
+        )
+        db.execute(stmt)
+    dates = [row["record_date"] for row in rows]
+    aggregates.refresh(db, user_id, dates)
+    tdee_changed = tdee.refresh(db, user_id, dates)
+    bump_data_version(db, user_id)
+    db.commit()
+    if tdee_changed:
+        user_cache.invalidate(user_id)
+    return len(rows)
+
+
+# --- Meal Entry CRUD ---
+# 食物紀錄欄位 -> 累加到的 DailyRecord 欄位
+_MEAL_TOTAL_COLUMNS = {"calories": "calories_consumed", "protein_g": "protein_g", "fat_g": "fat_g", "carbs_g": "carbs_g"}
+
+def _add_to_daily_totals(db: Session, user_id: int, record_date: date, entry, sign: int = 1):
+    """
+    以單一 INSERT ... ON CONFLICT DO UPDATE SET 欄位 = 欄位 + excluded.欄位 把食物紀錄累加進當日總量，
+    當日尚無紀錄時直接以這筆的值建立。扣除時不低於 0 (總量可能已被手動覆寫)。
+    """
+    values = {col: getattr(entry, key) * sign for key, col in _MEAL_TOTAL_COLUMNS.items()}
+    stmt = dialect_insert(db, models_db.DailyRecord).values(
+        user_id=user_id, record_date=record_date, **{col: max(v, 0) for col, v in values.items()}
+    )
+    set_ = {}
+    for col, value in values.items():
+        total = getattr(models_db.DailyRecord, col) + value
+        if col != "calories_consumed":
+            total = func.round(cast(total, Numeric), 1)  # 避免多次加減累積浮點誤差
+        set_[col] = case((total < 0, 0), else_=total)
+    db.execute(stmt.on_conflict_do_update(index_elements=["user_id", "record_date"], set_=set_))
+
+def _delete_if_emptied(db: Session, user_id: int, record_date: date) -> bool:
+    """
+    刪除最後一筆食物紀錄後，總量歸零、沒有運動消耗且當天已無食物紀錄的 DailyRecord 一併刪除
+    (連同它的 LLM 工作)；有手動填寫的數值時保留。回傳是否刪除。
+    """
+    R, M = models_db.DailyRecord, models_db.MealEntry
+    remaining = select(M.id).where(M.user_id == user_id, M.record_date == record_date).exists()
+    record_id = db.query(R.id).filter(
+        R.user_id == user_id, R.record_date == record_date, R.calories_consumed == 0, R.protein_g == 0,
+        R.fat_g == 0, R.carbs_g == 0, func.coalesce(R.calories_burned_exercise, 0) == 0, ~remaining,
+    ).scalar()
+    if record_id is None:
+        return False
+    db.query(models_db.LLMJob).filter(models_db.LLMJob.record_id == record_id).delete(synchronize_session=False)
+    db.query(R).filter(R.id == record_id).delete(synchronize_session=False)
+    return True
+
+def add_meal_entry(db: Session, user_id: int, entry: schemas.MealEntryCreate, food: schemas.FoodItem) -> models_db.MealEntry | None:
+    """
+    依份量換算營養值後寫入食物紀錄，並在同一交易內累加當日總量、更新週／月彙總與使用者資料版本。
+    使用者不存在時由外鍵擋下，回傳 None。
+    """
+    factor = entry.grams / 100
+    db_entry = models_db.MealEntry(
+        user_id=user_id, record_date=entry.record_date, meal=entry.meal, food_id=food.id, food_name=food.name,
+        grams=entry.grams, calories=round(food.calories * factor), protein_g=round(food.protein_g * factor, 1),
+        fat_g=round(food.fat_g * factor, 1), carbs_g=round(food.carbs_g * factor, 1),
+    )
+    db.add(db_entry)
+    try:
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+        if user_exists(db, user_id):
+            raise  # 不是外鍵 (使用者不存在) 造成的完整性錯誤，不可當成 404
+        return None
+    _add_to_daily_totals(db, user_id, entry.record_date, db_entry)
+    aggregates.refresh(db, user_id, [entry.record_date])
+    tdee_changed = tdee.refresh(db, user_id, [entry.record_date])
+    bump_data_version(db, user_id)
+    db.commit()
+    if tdee_changed:
+        user_cache.invalidate(user_id)
+    return db_entry
+
+def delete_meal_entry(db: Session, user_id: int, entry_id: int) -> bool:
+    """
+    刪除食物紀錄 (DELETE ... RETURNING 取回營養值) 並從當日總量扣除；扣完變成空紀錄時刪除當日紀錄。
+    同一交易內更新週／月彙總、TDEE 估計與使用者資料版本。找不到時回傳 False。
+    """
+    stmt = (
+        delete(models_db.MealEntry)
+        .where(models_db.MealEntry.id == entry_id, models_db.MealEntry.user_id == user_id)
+        .returning(models_db.MealEntry.record_date, *[getattr(models_db.MealEntry, key) for key in _MEAL_TOTAL_COLUMNS])
+    )
+    row = db.execute(stmt).first()
+    if row is None:
+        db.rollback()
+        return False
+    _add_to_daily_totals(db, user_id, row.record_date, row, sign=-1)
+    _delete_if_emptied(db, user_id, row.record_date)
+    aggregates.refresh(db, user_id, [row.record_date])
+    tdee_changed = tdee.refresh(db, user_id, [row.record_date])
+    bump_data_version(db, user_id)
+    db.commit()
+    if tdee_changed:
+        user_cache.invalidate(user_id)
+    return True
+
+def get_meal_entries(db: Session, user_id: int, record_date: date) -> list[models_db.MealEntry]:
+    return (
+        db.query(models_db.MealEntry)
+        .filter(models_db.MealEntry.user_id == user_id, models_db.MealEntry.record_date == record_date)
+        .order_by(models_db.MealEntry.id)
+        .all()
+    )
+
+
+# --- Weight Log CRUD ---
+def upsert_weight_log(db: Session, user_id: int, log: schemas.WeightLogCreate) -> models_db.WeightLog | None:
+    """
+    以 INSERT ... ON CONFLICT (user_id, log_date) DO UPDATE 寫入當日體重；是最新一筆時同步更新 User.weight_kg (BMR 用)。
+    同一交易內重新擬合 TDEE 並遞增資料版本。使用者不存在時由外鍵擋下，回傳 None。
+    """
+    stmt = dialect_insert(db, models_db.WeightLog).values(user_id=user_id, log_date=log.log_date, weight_kg=log.weight_kg)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "log_date"], set_={"weight_kg": stmt.excluded.weight_kg},
+    ).returning(models_db.WeightLog).execution_options(populate_existing=True)
+    try:
+        db_log = db.scalars(stmt).one()
+    except IntegrityError:
+        db.rollback()
+        if user_exists(db, user_id):
+            raise  # 不是外鍵 (使用者不存在) 造成的完整性錯誤，不可當成 404
+        return None
+    latest = db.query(func.max(models_db.WeightLog.log_date)).filter(models_db.WeightLog.user_id == user_id).scalar()
+    if log.log_date >= latest:
+        db.execute(update(models_db.User).where(models_db.User.id == user_id).values(weight_kg=log.weight_kg))
+    tdee.refresh(db, user_id, [log.log_date])
+    bump_data_version(db, user_id)
+    db.commit()
+    # 體重或 TDEE 估計都可能改變
+    user_cache.invalidate(user_id)
+    return db_log
 
+def get_weight_logs(db: Session, user_id: int, start: date | None = None, end: date | None = None) -> list[models_db.WeightLog]:
+    q = db.query(models_db.WeightLog).filter(models_db.WeightLog.user_id == user_id)
+    if start:
+        q = q.filter(models_db.WeightLog.log_date >= start)
+    if end:
+        q = q.filter(models_db.WeightLog.log_date <= end)
+    return q.order_by(models_db.WeightLog.log_date).all()
@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from . import crud, models_db
+from .cache import TTLCache
+from .settings import LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_SECONDS
+
+
+# 兩層快取：行程內 LRU 在前，DB 資料表 (跨使用者、跨 worker 共用) 在後
+_memory = TTLCache(maxsize=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL_SECONDS)
+_db_hits = 0
+_db_misses = 0
+
+
+def lookup(db: Session, key: str) -> str | None:
+    """依輸入雜湊查詢快取的建議；找不到或已過期回傳 None"""
+    global _db_hits, _db_misses
+    feedback = _memory.get(key)
+    if feedback is not None:
+        return feedback
+
+    cutoff = datetime.utcnow() - timedelta(seconds=LLM_CACHE_TTL_SECONDS)
+    row = (
+        db.query(models_db.LLMFeedbackCache.feedback)
+        .filter(models_db.LLMFeedbackCache.key == key, models_db.LLMFeedbackCache.created_at >= cutoff)
+        .first()
+    )
+    if row is None:
+        _db_misses += 1
+        return None
+    _db_hits += 1
+    _memory.set(key, row[0])
+    return row[0]
+
+def lookup_many(db: Session, keys: list[str]) -> dict[str, str]:
+    """批次查詢多個鍵，記憶體層沒有的以單一 IN 查詢向 DB 取得；回傳 {key: feedback}"""
+    global _db_hits, _db_misses
+    found = {}
+    remaining = set()
+    for key in keys:
+        feedback = _memory.get(key)
+        if feedback is not None:
+            found[key] = feedback
+        else:
+            remaining.add(key)
+    if not remaining:
+        return found
+
+    cutoff = datetime.utcnow() - timedelta(seconds=LLM_CACHE_TTL_SECONDS)
+    rows = (
+        db.query(models_db.LLMFeedbackCache.key, models_db.LLMFeedbackCache.feedback)
+        .filter(models_db.LLMFeedbackCache.key.in_(remaining), models_db.LLMFeedbackCache.created_at >= cutoff)
+        .all()
+    )
+    for key, feedback in rows:
+        found[key] = feedback
+        _memory.set(key, feedback)
+    _db_hits += len(rows)
+    _db_misses += len(remaining) - len(rows)
+    return found
+
+def store(db: Session, key: str, feedback: str):
+    """寫入快取 (不 commit，與呼叫端的交易一起提交)"""
+    _memory.set(key, feedback)
+    stmt = crud.dialect_insert(db, models_db.LLMFeedbackCache).values(
+        key=key, feedback=feedback, created_at=datetime.utcnow()
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["key"],
+        set_={"feedback": stmt.excluded.feedback, "created_at": stmt.excluded.created_at},
+    ))
+
+def store_many(db: Session, entries: dict[str, str]):
+    """以單一 upsert 寫入多筆 {key: feedback} (不 commit)"""
+    if not entries:
+        return
+    now = datetime.utcnow()
+    for key, feedback in entries.items():
+        _memory.set(key, feedback)
+    stmt = crud.dialect_insert(db, models_db.LLMFeedbackCache).values(
+        [{"key": key, "feedback": feedback, "created_at": now} for key, feedback in entries.items()]
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["key"],
+        set_={"feedback": stmt.excluded.feedback, "created_at": stmt.excluded.created_at},
+    ))
+
+def purge_expired(db: Session) -> int:
+    """刪除 DB 中已過期的快取列，回傳刪除筆數"""
+    cutoff = datetime.utcnow() - timedelta(seconds=LLM_CACHE_TTL_SECONDS)
+    deleted = db.query(models_db.LLMFeedbackCache).filter(models_db.LLMFeedbackCache.created_at < cutoff).delete()
+    db.commit()
+    return deleted
+
+# 舊版 get_llm_feedback 失敗時回傳並被當成建議存下的錯誤字串開頭
+LEGACY_ERROR_PREFIXES = (
+    "LLM 服務未配置",
+    "GEMINI_API_KEY 未設定",
+    "LLM API 回應格式不符預期",
+    "無法從 LLM 獲取建議",
+)
+
+def purge_error_feedback(db: Session) -> int:
+    """
+    清掉過去誤存成建議的錯誤訊息：刪除快取列，並讓對應紀錄的 llm_feedback_key 失效以便重新產生。
+    回傳受影響的列數。
+    """
+    def matches(column):
+        return or_(*(column.startswith(prefix) for prefix in LEGACY_ERROR_PREFIXES))
+
+    deleted = db.query(models_db.LLMFeedbackCache).filter(matches(models_db.LLMFeedbackCache.feedback)).delete(synchronize_session=False)
+    affected_users = [
+        user_id for (user_id,) in
+        db.query(models_db.DailyRecord.user_id).filter(matches(models_db.DailyRecord.llm_feedback)).distinct()
+    ]
+    if affected_users:
+        crud.bump_data_version(db, affected_users)
+    reset = (
+        db.query(models_db.DailyRecord)
+        .filter(matches(models_db.DailyRecord.llm_feedback))
+        .update({"llm_feedback": None, "llm_feedback_key": None}, synchronize_session=False)
+    )
+    db.commit()
+    return deleted + reset
+
+def stats() -> dict:
+    memory = _memory.stats()
+    hits = memory["hits"] + _db_hits
+    lookups = memory["hits"] + memory["misses"]
+    return {
+        "memory": memory,
+        "db_hits": _db_hits,
+        "db_misses": _db_misses,
+        "hits": hits,
+        "misses": _db_misses,
+        "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+    }
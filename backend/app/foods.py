@@ -0,0 +1,124 @@
+import bisect
+import csv
+import threading
+from array import array
+
+from . import schemas
+from .settings import FOODS_DATASET
+
+# 搜尋索引的 n-gram 長度上限 (查詢字串較長時以 trigram 交集篩選候選)
+NGRAM = 3
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+def _ngrams(text: str, n: int):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class FoodIndex:
+    """
+    唯讀的食物營養表與搜尋索引。
+    數值欄位以 array 依列存放 (每列只佔幾個 float，不建立逐筆物件)；
+    搜尋用兩個索引：排序過的名稱 (前綴以 bisect 找範圍) 與 1～3-gram 的倒排列表 (中段比對)。
+    """
+
+    def __init__(self, rows: list[dict]):
+        self.ids = array("I")
+        self.serving_g = array("f")
+        self.calories = array("f")
+        self.protein_g = array("f")
+        self.fat_g = array("f")
+        self.carbs_g = array("f")
+        self.names: list[str] = []
+        self.names_en: list[str] = []
+        self._row_of: dict[int, int] = {}
+
+        for row in rows:
+            self._row_of[int(row["id"])] = len(self.ids)
+            self.ids.append(int(row["id"]))
+            self.names.append(row["name"])
+            self.names_en.append(row.get("name_en") or "")
+            self.serving_g.append(float(row.get("serving_g") or 100))
+            self.calories.append(float(row["calories"]))
+            self.protein_g.append(float(row["protein_g"]))
+            self.fat_g.append(float(row["fat_g"]))
+            self.carbs_g.append(float(row["carbs_g"]))
+
+        # 每列可由中文名或英文名搜尋；中段比對用兩者以換行串接 (查詢字串不含換行，不會跨名稱相符)
+        self._text = [f"{normalize(name)}\n{normalize(en)}" for name, en in zip(self.names, self.names_en)]
+        keys = [(normalize(name), i) for i, name in enumerate(self.names)]
+        keys += [(normalize(name), i) for i, name in enumerate(self.names_en) if name]
+        keys.sort()
+        self._prefix_keys = [k for k, _ in keys]
+        self._prefix_rows = array("I", [i for _, i in keys])
+
+        postings: dict[str, set[int]] = {}
+        for key, i in keys:
+            for n in range(1, NGRAM + 1):
+                for gram in _ngrams(key, n):
+                    postings.setdefault(gram, set()).add(i)
+        self._grams = {gram: array("I", sorted(rows_)) for gram, rows_ in postings.items()}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def item(self, row: int) -> schemas.FoodItem:
+        return schemas.FoodItem(
+            id=self.ids[row], name=self.names[row], name_en=self.names_en[row] or None,
+            serving_g=round(self.serving_g[row], 1), calories=round(self.calories[row], 1),
+            protein_g=round(self.protein_g[row], 1), fat_g=round(self.fat_g[row], 1), carbs_g=round(self.carbs_g[row], 1),
+        )
+
+    def get(self, food_id: int) -> schemas.FoodItem | None:
+        row = self._row_of.get(food_id)
+        return self.item(row) if row is not None else None
+
+    def _prefix_matches(self, query: str) -> list[int]:
+        lo = bisect.bisect_left(self._prefix_keys, query)
+        hi = bisect.bisect_left(self._prefix_keys, query + "\U0010ffff", lo)
+        return [self._prefix_rows[k] for k in range(lo, hi)]
+
+    def _contains_matches(self, query: str) -> set[int]:
+        if len(query) <= NGRAM:
+            return set(self._grams.get(query, ()))
+        # 取出所有 trigram 的倒排列表，由最短的開始交集，最後再以實際子字串確認
+        lists = sorted((self._grams.get(g, ()) for g in _ngrams(query, NGRAM)), key=len)
+        candidates = set(lists[0])
+        for posting in lists[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(posting)
+        return {i for i in candidates if query in self._text[i]}
+
+    def search(self, query: str, limit: int = 10) -> list[schemas.FoodItem]:
+        """前綴相符的排前面 (名稱短的優先)，其次是名稱中間含有查詢字串的"""
+        query = normalize(query)
+        if not query:
+            return []
+        ranked: dict[int, None] = {}
+        for i in sorted(set(self._prefix_matches(query)), key=lambda i: (len(self.names[i]), self.ids[i])):
+            ranked[i] = None
+        if len(ranked) < limit:
+            for i in sorted(self._contains_matches(query) - ranked.keys(), key=lambda i: (len(self.names[i]), self.ids[i])):
+                ranked[i] = None
+        return [self.item(i) for i in list(ranked)[:limit]]
+
+
+def load(path: str = FOODS_DATASET) -> FoodIndex:
+    with open(path, encoding="utf-8", newline="") as f:
+        return FoodIndex(list(csv.DictReader(f)))
+
+
+# 第一次查詢時才載入，worker 啟動不需讀取資料檔
+_index: FoodIndex | None = None
+_lock = threading.Lock()
+
+def get_index() -> FoodIndex:
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                _index = load()
+    return _index
@@ -0,0 +1,44 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Request, Response
+
+# 瀏覽器可以保存回應，但每次使用前都要以 If-None-Match 重新驗證
+CACHE_CONTROL = "private, no-cache"
+
+
+class Validators:
+    """某位使用者資料版本對應的 ETag 與 Last-Modified"""
+
+    def __init__(self, user_id: int, version: int, updated_at: datetime | None):
+        # 使用者的任何寫入都會遞增 data_version，同一 URL 的內容只會隨版本改變
+        self.etag = f'"u{user_id}-v{version}"'
+        self.last_modified = updated_at.replace(tzinfo=timezone.utc, microsecond=0) if updated_at else None
+
+    def headers(self) -> dict:
+        headers = {"ETag": self.etag, "Cache-Control": CACHE_CONTROL}
+        if self.last_modified:
+            headers["Last-Modified"] = format_datetime(self.last_modified, usegmt=True)
+        return headers
+
+    def matches(self, request: Request) -> bool:
+        """依 If-None-Match (優先) 或 If-Modified-Since 判斷用戶端的副本是否仍有效"""
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [t.strip() for t in if_none_match.split(",")]
+            return "*" in tags or self.etag in tags or f"W/{self.etag}" in tags
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since and self.last_modified:
+            try:
+                return self.last_modified <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+def not_modified(validators: Validators) -> Response:
+    """304 回應：不查詢其餘資料、不序列化回應模型"""
+    return Response(status_code=304, headers=validators.headers())
+
+def apply(response: Response, validators: Validators):
+    response.headers.update(validators.headers())
@@ -0,0 +1,257 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session, joinedload
+
+from . import coordination, crud, feedback_cache, models_db, schemas, services, singleflight
+from .database import SessionLocal
+from .llm_client import LLMError
+from .settings import LLM_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# running 超過此時間仍未更新，視為原 worker 已死亡，重新排入
+STALE_RUNNING_AFTER = timedelta(minutes=5)
+# pending 超過此時間仍未被處理，可能是排入它的 worker 行程已結束；閒置的 worker 會接手
+STALE_PENDING_AFTER = timedelta(minutes=1)
+# 閒置 worker 檢查遺留工作的間隔 (秒)
+SWEEP_INTERVAL = 30.0
+# worker 等待佇列的逾時 (秒)，也是 stop_workers 最久的等待時間
+POP_TIMEOUT = 1.0
+
+_ACTIVE_STATUSES = (models_db.JobStatusEnum.pending, models_db.JobStatusEnum.running)
+
+_workers: list[threading.Thread] = []
+_workers_lock = threading.Lock()
+_stopping = threading.Event()
+_sweep_lock = threading.Lock()
+_next_sweep = 0.0
+
+
+# --- Job 查詢／建立 ---
+def get_job(db: Session, job_id: int, with_record: bool = False) -> models_db.LLMJob | None:
+    q = db.query(models_db.LLMJob)
+    if with_record:
+        q = q.options(joinedload(models_db.LLMJob.record))
+    return q.filter(models_db.LLMJob.id == job_id).first()
+
+def get_job_result(db: Session, job_id: int) -> schemas.LLMJob | None:
+    """工作狀態；完成時一併帶出建議內容 (與紀錄 JOIN 成單一查詢)"""
+    job = get_job(db, job_id, with_record=True)
+    if job is None:
+        return None
+    result = schemas.LLMJob.model_validate(job)
+    if job.status == models_db.JobStatusEnum.done and job.record is not None:
+        result.llm_feedback = job.record.llm_feedback
+    return result
+
+def enqueue_feedback_job(db: Session, record: models_db.DailyRecord) -> int | None:
+    """
+    為該日紀錄建立產生建議的工作並回傳 job id；若已有進行中的工作則直接沿用。
+    回傳 None 代表擋下插入的工作已在這之間結束 (見 enqueue_feedback_jobs)。
+    """
+    record_id = record.id  # commit 後屬性會過期，先取出
+    return enqueue_feedback_jobs(db, [record]).get(record_id)
+
+def enqueue_feedback_jobs(db: Session, records: list[models_db.DailyRecord]) -> dict[int, int]:
+    """
+    批次建立工作並提交；回傳 {record_id: job_id}。
+    並行請求 (含其他行程) 的重複工作由 ux_llm_jobs_active_record 擋下 (ON CONFLICT DO NOTHING)，
+    因此同一筆紀錄只會拿到同一個進行中的 job。
+    擋下插入的工作可能在接著查詢進行中工作之前就已結束 (PostgreSQL READ COMMITTED、多個 worker)，
+    這些紀錄不會出現在回傳的 dict 中，呼叫端應以 .get() 取值並重新檢查建議是否已備妥。
+    """
+    if not records:
+        return {}
+    stmt = crud.dialect_insert(db, models_db.LLMJob).values(
+        [{"user_id": r.user_id, "record_id": r.id} for r in records]
+    )
+    inserted = dict(db.execute(
+        stmt.on_conflict_do_nothing().returning(models_db.LLMJob.record_id, models_db.LLMJob.id)
+    ).all())
+
+    job_ids = dict(inserted)
+    existing = [r.id for r in records if r.id not in inserted]
+    if existing:
+        job_ids.update(
+            db.query(models_db.LLMJob.record_id, models_db.LLMJob.id)
+            .filter(models_db.LLMJob.record_id.in_(existing), models_db.LLMJob.status.in_(_ACTIVE_STATUSES))
+            .all()
+        )
+    db.commit()
+    queue = coordination.backend()
+    for job_id in inserted.values():
+        queue.push_job(job_id)
+    return job_ids
+
+
+# --- Job 執行 ---
+def lookup_cached(key: str) -> str | None:
+    """以獨立 session 查詢共用建議快取 (single-flight 的 check 用)"""
+    db = SessionLocal()
+    try:
+        return feedback_cache.lookup(db, key)
+    finally:
+        db.close()
+
+def generate_feedback(summary, key: str) -> str:
+    """
+    呼叫 LLM 並寫入共用快取；以 (user_id, record_date, 輸入雜湊) 做 single-flight，
+    同一天的並行請求 (同行程或其他 uvicorn worker) 只會發出一次 LLM 呼叫。
+    """
+    def _generate():
+        feedback = services.get_llm_feedback(summary)
+        db = SessionLocal()
+        try:
+            feedback_cache.store(db, key, feedback)
+            db.commit()
+        finally:
+            db.close()
+        return feedback
+
+    return singleflight.do(feedback_flight_key(summary, key), _generate, check=lambda: lookup_cached(key))
+
+def feedback_flight_key(summary, key: str) -> str:
+    """產生建議的 single-flight 鍵；背景工作與 SSE 串流共用，兩者不會為同一天各呼叫一次 LLM"""
+    return f"{summary.user_info.id}:{summary.date}:{key}"
+
+def _claim(db: Session, job_id: int) -> bool:
+    """以條件式 UPDATE 搶下工作 (pending -> running)，多個行程同時搶時只有一個會成功"""
+    claimed = (
+        db.query(models_db.LLMJob)
+        .filter(models_db.LLMJob.id == job_id, models_db.LLMJob.status == models_db.JobStatusEnum.pending)
+        .update({"status": models_db.JobStatusEnum.running, "updated_at": datetime.utcnow()}, synchronize_session=False)
+    )
+    db.commit()
+    return claimed == 1
+
+def _finish(db: Session, job: models_db.LLMJob, status: models_db.JobStatusEnum, error: str | None = None):
+    job.status = status
+    job.error = error
+    db.commit()
+
+def run_feedback_job(job_id: int):
+    """執行單一工作：計算總結、查快取或呼叫 LLM，並把建議寫回 DailyRecord.llm_feedback"""
+    db = SessionLocal()
+    try:
+        if not _claim(db, job_id):
+            return  # 已被其他 worker 處理或已完成
+        job = get_job(db, job_id)
+        record = job.record
+        if record is None:
+            _finish(db, job, models_db.JobStatusEnum.failed, "Daily record not found")
+            return
+        summary = services.build_daily_summary(record.owner, record)
+        key = services.feedback_cache_key(summary)
+        if not (record.llm_feedback and record.llm_feedback_key == key):
+            # 排隊期間可能已有相同輸入的建議被產生，先查快取再呼叫 LLM
+            feedback = feedback_cache.lookup(db, key)
+            if feedback is None:
+                feedback = generate_feedback(summary, key)
+            record.llm_feedback = feedback
+            record.llm_feedback_key = key
+            crud.bump_data_version(db, record.user_id)
+        _finish(db, job, models_db.JobStatusEnum.done)
+    except LLMError as e:
+        # 上游失敗：工作標為 failed，紀錄與快取都不寫入，下次查詢會重新排入
+        logger.warning("LLM job %s failed: %s", job_id, e)
+        db.rollback()
+        job = get_job(db, job_id)
+        if job is not None:
+            _finish(db, job, models_db.JobStatusEnum.failed, str(e))
+    except Exception as e:
+        logger.exception("LLM job %s failed", job_id)
+        db.rollback()
+        job = get_job(db, job_id)
+        if job is not None:
+            _finish(db, job, models_db.JobStatusEnum.failed, str(e))
+    finally:
+        db.close()
+
+
+# --- Worker pool ---
+def queue_depth() -> int:
+    """尚在佇列等待 worker 處理的工作數 (近似值；redis 後端為所有行程共用的佇列)"""
+    return coordination.backend().job_queue_depth()
+
+def _requeue(stale_pending: bool) -> int:
+    """
+    把 DB 中尚未完成的工作重新排入佇列：running 過久的先改回 pending；
+    stale_pending 為 True 時只排入等待過久的 pending (其他行程遺留的) 與剛改回 pending 的，否則排入全部 (啟動時)。
+    重複排入無妨，_claim 保證同一工作只會被執行一次。
+    """
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        recovered = [job_id for (job_id,) in db.execute(
+            update(models_db.LLMJob)
+            .where(models_db.LLMJob.status == models_db.JobStatusEnum.running,
+                   models_db.LLMJob.updated_at < now - STALE_RUNNING_AFTER)
+            .values(status=models_db.JobStatusEnum.pending, updated_at=now)
+            .returning(models_db.LLMJob.id)
+        ).all()]
+        db.commit()
+        q = db.query(models_db.LLMJob.id).filter(models_db.LLMJob.status == models_db.JobStatusEnum.pending)
+        if stale_pending:
+            q = q.filter(models_db.LLMJob.updated_at < now - STALE_PENDING_AFTER)
+        pending = {job_id for (job_id,) in q.all()}
+        # 剛改回 pending 的 updated_at 是 now，不會被上面的 stale 條件選到，一併排入
+        pending.update(recovered)
+        queue = coordination.backend()
+        for job_id in sorted(pending):
+            queue.push_job(job_id)
+        return len(pending)
+    finally:
+        db.close()
+
+def _sweep_if_idle():
+    """佇列已空時 (由一個 worker) 定期接手其他行程遺留的工作"""
+    global _next_sweep
+    with _sweep_lock:
+        if time.monotonic() < _next_sweep:
+            return
+        _next_sweep = time.monotonic() + SWEEP_INTERVAL
+    if queue_depth() == 0:
+        requeued = _requeue(stale_pending=True)
+        if requeued:
+            logger.info("Re-queued %d stale LLM jobs", requeued)
+
+def _worker_loop():
+    queue = coordination.backend()
+    while not _stopping.is_set():
+        try:
+            job_id = queue.pop_job(POP_TIMEOUT)
+            if job_id is None:
+                _sweep_if_idle()
+                continue
+        except Exception:
+            logger.exception("LLM job queue unavailable")
+            _stopping.wait(POP_TIMEOUT)
+            continue
+        run_feedback_job(job_id)
+
+def start_workers(n: int = LLM_WORKERS):
+    global _next_sweep
+    with _workers_lock:
+        if _workers:
+            return
+        _stopping.clear()
+        recovered = _requeue(stale_pending=False)
+        if recovered:
+            logger.info("Re-queued %d pending LLM jobs", recovered)
+        _next_sweep = time.monotonic() + SWEEP_INTERVAL
+        for i in range(n):
+            t = threading.Thread(target=_worker_loop, name=f"llm-worker-{i}", daemon=True)
+            t.start()
+            _workers.append(t)
+
+def stop_workers(timeout: float = 5.0):
+    """通知 worker 結束 (最多等 POP_TIMEOUT 才會發現)；佇列中尚未執行的工作留在 DB，下次啟動時重新排入"""
+    _stopping.set()
+    with _workers_lock:
+        for t in _workers:
+            t.join(timeout)
+        _workers.clear()
@@ -0,0 +1,291 @@
+import logging
+import random
+import threading
+import time
+from typing import Iterator
+
+from . import metrics
+from .settings import (
+    LLM_ACQUIRE_TIMEOUT_SECONDS, LLM_BACKOFF_BASE_SECONDS, LLM_BACKOFF_MAX_SECONDS, LLM_BREAKER_FAILURES,
+    LLM_BREAKER_RESET_SECONDS, LLM_MAX_CONCURRENCY, LLM_MAX_RETRIES, LLM_RATE_BURST, LLM_RATE_LIMIT_PER_MIN,
+    LLM_TIMEOUT_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class LLMError(Exception):
+    """LLM 呼叫失敗；此類錯誤不可當作建議內容寫入資料庫或快取"""
+
+class LLMUnavailableError(LLMError):
+    """未設定 LLM 後端，或等不到速率／併發配額"""
+
+class LLMTimeoutError(LLMError):
+    pass
+
+class LLMEmptyResponseError(LLMError):
+    """回應沒有可用內容 (例如被安全過濾擋下)"""
+
+class CircuitOpenError(LLMUnavailableError):
+    """斷路器打開中，直接失敗不呼叫上游"""
+
+
+# 上游暫時性錯誤 (google.api_core.exceptions 的類別名稱，不需在此匯入 google 套件)
+_RETRYABLE_NAMES = {
+    "DeadlineExceeded", "ResourceExhausted", "ServiceUnavailable", "InternalServerError",
+    "TooManyRequests", "BadGateway", "GatewayTimeout", "Aborted",
+}
+_RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (LLMTimeoutError, TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in _RETRYABLE_NAMES:
+        return True
+    return getattr(error, "code", None) in _RETRYABLE_CODES
+
+
+class TokenBucket:
+    """執行緒安全的 token bucket：每秒補充 rate 個，最多累積 capacity 個"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout: float | None = None) -> bool:
+        """取得一個 token；timeout 內拿不到回傳 False"""
+        if self.rate <= 0:
+            return True  # 未啟用速率限制
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    closed：正常呼叫；連續 failure_threshold 次失敗後轉為 open。
+    open：直接拒絕，reset_timeout 秒後轉為 half_open。
+    half_open：只放行一個試探請求，成功則回到 closed，失敗則重新 open。
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def release(self):
+        """放棄這次放行 (未真正呼叫上游)，讓 half_open 可再放行下一個試探請求"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning("LLM circuit breaker opened after %d failures", self._failures)
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class LLMClient:
+    """
+    包裝 generate_content 的呼叫：速率限制 → 斷路器 → 併發上限 → 逾時呼叫，
+    暫時性錯誤以 full-jitter 指數退避重試。失敗一律拋出 LLMError，不回傳錯誤字串。
+    """
+
+    def __init__(self, model, rate_per_min: float = LLM_RATE_LIMIT_PER_MIN, burst: int = LLM_RATE_BURST,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY, timeout: float = LLM_TIMEOUT_SECONDS,
+                 acquire_timeout: float = LLM_ACQUIRE_TIMEOUT_SECONDS, max_retries: int = LLM_MAX_RETRIES,
+                 backoff_base: float = LLM_BACKOFF_BASE_SECONDS, backoff_max: float = LLM_BACKOFF_MAX_SECONDS,
+                 breaker: CircuitBreaker | None = None):
+        self.model = model
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.bucket = TokenBucket(rate_per_min / 60, burst)
+        self.breaker = breaker or CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS)
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _admit(self):
+        """取得速率配額並通過斷路器；失敗時拋出 LLMUnavailableError / CircuitOpenError"""
+        if not self.bucket.acquire(timeout=self.acquire_timeout):
+            raise LLMUnavailableError("Timed out waiting for the LLM rate limiter")
+        if not self.breaker.allow():
+            metrics.llm_requests_total.inc("circuit_open")
+            raise CircuitOpenError("LLM circuit breaker is open")
+
+    def _acquire_slot(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            self.breaker.release()  # 本地配額不足，與上游健康狀態無關
+            raise LLMUnavailableError("Timed out waiting for an LLM concurrency slot")
+
+    def _request_options(self) -> dict:
+        # google-generativeai 以 request_options 設定 HTTP 逾時
+        return {"timeout": self.timeout}
+
+    def _failed(self, error: Exception, started: float, attempt: int, retry: bool = True) -> float:
+        """
+        記錄一次失敗並決定是否重試：可重試時回傳退避秒數，否則拋出 LLMError。
+        上游有回應的錯誤 (例如參數錯誤、內容被擋) 不算上游故障，不計入斷路器。
+        """
+        timed_out = type(error).__name__ == "DeadlineExceeded" or isinstance(error, TimeoutError)
+        metrics.observe_llm_call(time.perf_counter() - started, "timeout" if timed_out else "error")
+        if timed_out:
+            error = LLMTimeoutError(str(error) or "LLM request timed out")
+        if not is_retryable(error):
+            self.breaker.record_success()
+            raise _as_llm_error(error)
+        self.breaker.record_failure()
+        if not retry or attempt >= self.max_retries:
+            raise _as_llm_error(error)
+        metrics.llm_retries_total.inc()
+        delay = self._backoff(attempt)
+        logger.info("Retrying LLM call (attempt %d) in %.2fs after %s", attempt + 1, delay, type(error).__name__)
+        return delay
+
+    def _empty(self, response):
+        self.breaker.record_success()
+        detail = getattr(response, "prompt_feedback", None)
+        return LLMEmptyResponseError(f"LLM returned no content{f': {detail}' if detail else ''}")
+
+    def generate(self, prompt: str, **kwargs) -> str:
+        """回傳模型產生的文字；重試用盡、斷路器打開或上游拒絕時拋出 LLMError"""
+        attempt = 0
+        while True:
+            self._admit()
+            self._acquire_slot()
+            started = time.perf_counter()
+            delay = None
+            try:
+                response = self.model.generate_content(prompt, request_options=self._request_options(), **kwargs)
+            except Exception as e:
+                delay = self._failed(e, started, attempt)
+            finally:
+                self._slots.release()
+            if delay is not None:
+                attempt += 1
+                time.sleep(delay)  # 退避期間不佔用併發名額
+                continue
+
+            text = response_text(response)
+            metrics.observe_llm_call(time.perf_counter() - started, "ok" if text else "empty", response)
+            if not text:
+                raise self._empty(response)
+            self.breaker.record_success()
+            return text
+
+    def generate_stream(self, prompt: str, **kwargs) -> Iterator[str]:
+        """
+        以串流 API 逐段產生文字。尚未輸出任何內容前的暫時性錯誤會重試；
+        已輸出部分內容後失敗則直接拋出 LLMError (呼叫端不可保存不完整的內容)。
+        """
+        attempt = 0
+        while True:
+            self._admit()
+            self._acquire_slot()
+            started = time.perf_counter()
+            emitted = False
+            last = None
+            delay = None
+            try:
+                for chunk in self.model.generate_content(prompt, stream=True, request_options=self._request_options(), **kwargs):
+                    last = chunk
+                    text = response_text(chunk)
+                    if text:
+                        emitted = True
+                        yield text
+            except GeneratorExit:
+                # 呼叫端中途放棄 (例如用戶端斷線)：不算成功也不算失敗
+                self.breaker.release()
+                raise
+            except Exception as e:
+                delay = self._failed(e, started, attempt, retry=not emitted)
+            finally:
+                self._slots.release()
+            if delay is not None:
+                attempt += 1
+                time.sleep(delay)
+                continue
+
+            # 最後一個 chunk 帶有整段回應的 usage_metadata
+            metrics.observe_llm_call(time.perf_counter() - started, "ok" if emitted else "empty", last)
+            if not emitted:
+                raise self._empty(last)
+            self.breaker.record_success()
+            return
+
+def _as_llm_error(error: Exception) -> LLMError:
+    if isinstance(error, LLMError):
+        return error
+    wrapped = LLMError(f"{type(error).__name__}: {error}")
+    wrapped.__cause__ = error
+    return wrapped
+
+def response_text(response) -> str:
+    """取出回應文字；沒有可用內容時回傳空字串"""
+    if response is None:
+        return ""
+    if response.parts:
+        return response.text
+    if response.candidates and response.candidates[0].content.parts:  # 有些 API 版本差異
+        return "".join(part.text for part in response.candidates[0].content.parts)
+    return ""
@@ -0,0 +1,146 @@
+import json
+import random
+import re
+import threading
+import time
+
+
+class _FakePart:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _FakeUsage:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    """模仿 google.generativeai 的 GenerateContentResponse，只提供 services 會用到的屬性"""
+
+    def __init__(self, text: str, prompt: str = ""):
+        self.text = text
+        self.parts = [_FakePart(text)] if text else []
+        self.candidates = []
+        self.prompt_feedback = None if text else "block_reason: SAFETY"
+        # 粗估 token 數 (約 4 個字元一個 token)，讓 metrics 在假後端下也有數據
+        self.usage_metadata = _FakeUsage(len(prompt) // 4, len(text) // 4)
+
+
+class FakeAPIError(Exception):
+    """模仿 google.api_core.exceptions 的錯誤：帶 HTTP 狀態碼 code"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class ServiceUnavailable(FakeAPIError):
+    def __init__(self, message: str = "503 The model is overloaded."):
+        super().__init__(503, message)
+
+class ResourceExhausted(FakeAPIError):
+    def __init__(self, message: str = "429 Resource has been exhausted (e.g. check quota)."):
+        super().__init__(429, message)
+
+class InvalidArgument(FakeAPIError):
+    def __init__(self, message: str = "400 Request contains an invalid argument."):
+        super().__init__(400, message)
+
+class DeadlineExceeded(FakeAPIError):
+    def __init__(self, message: str = "504 Deadline Exceeded"):
+        super().__init__(504, message)
+
+
+# 注入失敗的種類 (interrupted 只對串流有意義：輸出第一段後中斷；malformed 只對 JSON 回應有意義：回傳截斷的 JSON)
+FAILURE_MODES = ("unavailable", "rate_limit", "invalid", "timeout", "empty", "interrupted", "malformed")
+
+# 批次提示中的項目 id (見 services.build_batch_feedback_prompt)
+_ITEM_ID = re.compile(r'"id": "([^"]+)"')
+
+
+def _wants_json(kwargs: dict) -> bool:
+    config = kwargs.get("generation_config") or {}
+    mime_type = config.get("response_mime_type") if isinstance(config, dict) else getattr(config, "response_mime_type", None)
+    return mime_type == "application/json"
+
+
+class FakeGeminiModel:
+    """
+    測試／壓測用的假 LLM 後端，不需網路與 API 金鑰。
+    latency_ms: 每次呼叫模擬的延遲 (毫秒)
+    failure_rate / failure_mode: 以機率注入失敗 (見 FAILURE_MODES)
+    fail_next(): 讓接下來的 n 次呼叫固定失敗，用來重現重試與斷路器行為
+    stream_chunk_chars / stream_chunk_ms: stream=True 時每段的字數與段間延遲
+    """
+
+    def __init__(self, latency_ms: float = 0.0, reply: str = "今日評分：8/10\n熱量控制良好，請繼續保持！",
+                 failure_rate: float = 0.0, failure_mode: str = "unavailable", seed: int | None = None,
+                 stream_chunk_chars: int = 8, stream_chunk_ms: float = 0.0):
+        if failure_mode not in FAILURE_MODES:
+            raise ValueError(f"Unknown failure mode: {failure_mode}")
+        self.latency_ms = latency_ms
+        self.reply = reply
+        self.failure_rate = failure_rate
+        self.failure_mode = failure_mode
+        self.stream_chunk_chars = max(1, stream_chunk_chars)
+        self.stream_chunk_ms = stream_chunk_ms
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._scripted: list[str] = []
+        self._lock = threading.Lock()
+
+    def fail_next(self, n: int = 1, mode: str | None = None):
+        with self._lock:
+            self._scripted.extend([mode or self.failure_mode] * n)
+
+    def _next_failure(self) -> str | None:
+        with self._lock:
+            self.calls += 1
+            if self._scripted:
+                return self._scripted.pop(0)
+            if self.failure_rate and self._random.random() < self.failure_rate:
+                return self.failure_mode
+        return None
+
+    def generate_content(self, prompt: str, request_options: dict | None = None, stream: bool = False, **kwargs):
+        failure = self._next_failure()
+        timeout = (request_options or {}).get("timeout")
+        if failure == "timeout":
+            # 模擬上游卡住直到逾時
+            time.sleep(timeout if timeout is not None else self.latency_ms / 1000)
+            raise DeadlineExceeded()
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)  # 串流時代表第一段的延遲
+        if failure == "unavailable":
+            raise ServiceUnavailable()
+        if failure == "rate_limit":
+            raise ResourceExhausted()
+        if failure == "invalid":
+            raise InvalidArgument()
+        reply = "" if failure == "empty" else self.reply
+        if reply and _wants_json(kwargs):
+            # 批次請求：每個項目 id 回一則建議
+            items = [{"id": item_id, "feedback": self.reply} for item_id in _ITEM_ID.findall(prompt)]
+            reply = json.dumps(items, ensure_ascii=False)
+            if failure == "malformed":
+                reply = reply[: len(reply) // 2]
+        if stream:
+            return self._stream(prompt, reply, interrupted=failure == "interrupted")
+        return FakeResponse(reply, prompt)
+
+    def _stream(self, prompt: str, reply: str, interrupted: bool = False):
+        """模仿 stream=True 的回應：逐段產生 chunk，最後一段帶 usage_metadata"""
+        n = self.stream_chunk_chars
+        pieces = [reply[i:i + n] for i in range(0, len(reply), n)] or [""]
+        for i, piece in enumerate(pieces):
+            if i and self.stream_chunk_ms:
+                time.sleep(self.stream_chunk_ms / 1000)
+            if interrupted and i == 1:
+                raise ServiceUnavailable("503 Stream interrupted.")
+            chunk = FakeResponse(piece)
+            last = i == len(pieces) - 1
+            chunk.usage_metadata = _FakeUsage(len(prompt) // 4, len(reply) // 4) if last else None
+            yield chunk
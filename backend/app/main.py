@@ -1,204 +1,555 @@
-from fastapi import FastAPI, Depends, HTTPException, Path, Body, Query
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Path, Body, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional, Union
 from datetime import date
 import logging
-import os # <--- 新增這一行
 
-from . import crud, models_db, schemas, services
-from .database import SessionLocal, engine, get_db
+from . import aggregates, assets, bulk, coordination, crud, feedback_cache, foods, http_cache, jobs, metrics, migrations, models_db, pagination, schemas, services, streaming, user_cache
+from .database import DB_ASYNC_MODE, SessionLocal, async_engine, engine, get_pool_stats, get_session, run_db
+from .settings import AUTO_MIGRATE, COORDINATION_BACKEND, DATABASE_URL, GEMINI_API_KEY, LLM_BACKEND
 
-# 創建資料庫表 (如果不存在)
-# 在生產環境中，您可能希望使用 Alembic 進行資料庫遷移管理
-models_db.Base.metadata.create_all(bind=engine)
+# 路由都掛在 router 上，由 create_app() 組成 app；匯入本模組不會連線資料庫或載入 LLM SDK
+router = APIRouter()
 
-app = FastAPI()
-app.mount("/static", StaticFiles(directory="../frontend"), name="static")
+# 期間總結一次最多涵蓋的天數
+MAX_SUMMARY_RANGE_DAYS = 366
+# 趨勢查詢一次最多回傳的區間數 (約五年的週資料)
+MAX_TREND_BUCKETS = 260
+# 食物搜尋一次最多回傳的筆數
+MAX_FOOD_SEARCH_RESULTS = 50
+
+# 端點的 DB session：DB_ASYNC_MODE 時為 AsyncSession，否則為同步 Session (皆經由 run_db 存取)
+DBSession = Union[AsyncSession, Session]
+
+# --- Metrics：SQL 事件與輸出時才取值的 gauge ---
+metrics.instrument_engine(engine)
+if async_engine is not None:
+    metrics.instrument_engine(async_engine.sync_engine)
+
+def _cache_metrics() -> dict:
+    stats = feedback_cache.stats()
+    return {
+        ("memory", "hits"): stats["memory"]["hits"],
+        ("memory", "misses"): stats["memory"]["misses"],
+        ("memory", "evictions"): stats["memory"]["evictions"],
+        ("memory", "size"): stats["memory"]["size"],
+        ("db", "hits"): stats["db_hits"],
+        ("db", "misses"): stats["db_misses"],
+    }
+
+def _pool_metrics() -> dict:
+    values = {}
+    for name, pool in get_pool_stats().items():
+        for key, value in pool.items():
+            values[(name, key)] = value
+    return values
+
+metrics.register(metrics.GaugeCallback(
+    "llm_feedback_cache", "LLM feedback cache counters and size, by tier.", ("tier", "stat"), _cache_metrics))
+metrics.register(metrics.GaugeCallback(
+    "llm_feedback_cache_hit_ratio", "Overall LLM feedback cache hit ratio.", (),
+    lambda: {(): feedback_cache.stats()["hit_ratio"]}))
+metrics.register(metrics.GaugeCallback(
+    "user_profile_cache", "User profile cache counters.", ("stat",),
+    lambda: {(k,): v for k, v in user_cache.stats().items() if isinstance(v, (int, float))}))
+metrics.register(metrics.GaugeCallback(
+    "db_pool", "Database connection pool statistics, by engine.", ("engine", "stat"), _pool_metrics))
+metrics.register(metrics.GaugeCallback(
+    "llm_circuit_breaker_open", "1 when the LLM circuit breaker is rejecting calls.", (),
+    lambda: {(): int(services.llm_circuit_open())}))
+metrics.register(metrics.GaugeCallback(
+    "llm_job_queue_depth", "LLM feedback jobs waiting in the job queue.", (),
+    lambda: {(): jobs.queue_depth()}))
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # --- User Endpoints ---
-@app.post("/users/", response_model=schemas.User, tags=["Users"], summary="創建新使用者")
-def create_user(user: schemas.UserCreate = Body(...), db: Session = Depends(get_db)):
+@router.post("/users/", response_model=schemas.User, tags=["Users"], summary="創建新使用者")
+async def create_user(user: schemas.UserCreate = Body(...), db: DBSession = Depends(get_session)):
     # MVP 階段，我們可以假設只有一個使用者，或者每次都創建一個新的。
     # 為了簡化，這裡允許創建多個使用者，前端可以選擇記住 user_id。
     # 檢查是否有重複的邏輯可以後續添加 (例如基於 email 或 username，但目前模型沒有這些欄位)
-    logger.info(f"Attempting to create user with data: {user.model_dump()}")
-    db_user = crud.create_user(db=db, user=user)
-    logger.info(f"User created with ID: {db_user.id}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Attempting to create user with data: %s", user.model_dump())
+    db_user = await run_db(db, crud.create_user, user=user)
+    logger.info("User created with ID: %s", db_user.id)
     return db_user
 
-@app.get("/")
-def index():
-    return FileResponse("../frontend/index.html")
+@router.api_route("/", methods=["GET", "HEAD"], include_in_schema=False)
+async def index(request: Request):
+    return assets.response(request, "index.html") or PlainTextResponse("Frontend not found", status_code=404)
+
+@router.api_route("/static/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def static_file(request: Request, path: str):
+    """前端靜態檔 (預先壓縮；帶 ?v=內容雜湊 時可長期快取)"""
+    response = assets.response(request, path)
+    if response is None:
+        raise HTTPException(404, "Not found")
+    return response
 
-@app.get("/users/", response_model=List[schemas.User], tags=["Users"], summary="列出所有使用者")
-def list_users(
-    skip: int = Query(0, ge=0, description="略過筆數 (分頁)"),
-    limit: int = Query(100, gt=0, description="最多回傳筆數"),
-    db: Session = Depends(get_db)
+def _set_page_headers(response: Response, page: pagination.Page):
+    """游標放在回應標頭，列表本體維持原本的 JSON 陣列格式"""
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    if page.prev_cursor:
+        response.headers["X-Prev-Cursor"] = page.prev_cursor
+
+async def _fetch_page(db: DBSession, fn, *args, **kwargs) -> pagination.Page:
+    try:
+        return await run_db(db, fn, *args, **kwargs)
+    except pagination.InvalidCursor as e:
+        raise HTTPException(400, str(e))
+
+@router.get("/users/", response_model=List[schemas.User], tags=["Users"], summary="列出所有使用者")
+async def list_users(
+    response: Response,
+    cursor: Optional[str] = Query(None, description="分頁游標 (取自上一頁回應的 X-Next-Cursor / X-Prev-Cursor 標頭)"),
+    skip: int = Query(0, ge=0, description="略過筆數 (舊的 offset 分頁，請改用 cursor)", deprecated=True),
+    limit: int = Query(100, ge=1, le=pagination.MAX_PAGE_SIZE, description="最多回傳筆數"),
+    db: DBSession = Depends(get_session)
 ):
-    return crud.get_users(db, skip=skip, limit=limit)
+    if skip:
+        if cursor:
+            raise HTTPException(400, "skip cannot be combined with cursor")
+        return await run_db(db, crud.get_users, skip=skip, limit=limit)
+    page = await _fetch_page(db, crud.get_users_page, limit=limit, cursor=cursor)
+    _set_page_headers(response, page)
+    return page.items
 
 
-@app.get("/users/{user_id}/", response_model=schemas.User, tags=["Users"], summary="獲取使用者資訊")
-def read_user(
-    user_id: int = Path(..., description="使用者 ID", ge=1), db: Session = Depends(get_db)
+@router.get("/users/{user_id}/", response_model=schemas.User, tags=["Users"], summary="獲取使用者資訊")
+async def read_user(
+    user_id: int = Path(..., description="使用者 ID", ge=1), db: DBSession = Depends(get_session)
 ):
-    logger.info(f"Fetching user with ID: {user_id}")
-    db_user = crud.get_user(db, user_id=user_id)
-    if db_user is None:
-        logger.warning(f"User with ID {user_id} not found.")
+    logger.info("Fetching user with ID: %s", user_id)
+    profile = await run_db(db, services.get_user_profile, user_id)
+    if profile is None:
+        logger.warning("User with ID %s not found.", user_id)
         raise HTTPException(status_code=404, detail="User not found")
-    return db_user
+    return profile.user
 
-@app.put("/users/{user_id}/", response_model=schemas.User, tags=["Users"], summary="更新使用者資訊")
-def update_user_info(
+@router.put("/users/{user_id}/", response_model=schemas.User, tags=["Users"], summary="更新使用者資訊")
+async def update_user_info(
     user_id: int = Path(..., description="使用者 ID", ge=1),
     user_update: schemas.UserUpdate = Body(...),
-    db: Session = Depends(get_db)
+    db: DBSession = Depends(get_session)
 ):
-    logger.info(f"Attempting to update user with ID: {user_id}, data: {user_update.model_dump()}")
-    db_user = crud.update_user(db=db, user_id=user_id, user_update=user_update)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Attempting to update user with ID: %s, data: %s", user_id, user_update.model_dump())
+    db_user = await run_db(db, crud.update_user, user_id=user_id, user_update=user_update)
     if db_user is None:
-        logger.warning(f"User with ID {user_id} not found for update.")
+        logger.warning("User with ID %s not found for update.", user_id)
         raise HTTPException(status_code=404, detail="User not found")
-    logger.info(f"User with ID {user_id} updated successfully.")
+    logger.info("User with ID %s updated successfully.", user_id)
     return db_user
 
 # --- Daily Record Endpoints ---
-@app.post("/users/{user_id}/daily_records/", response_model=schemas.DailyRecord, tags=["Daily Records"], summary="新增或更新每日記錄")
-def create_or_update_daily_record_for_user(
+@router.post("/users/{user_id}/daily_records/", response_model=schemas.DailyRecord, tags=["Daily Records"], summary="新增或更新每日記錄")
+async def create_or_update_daily_record_for_user(
     user_id: int = Path(..., description="使用者 ID", ge=1),
     daily_record: schemas.DailyRecordCreate = Body(...),
-    db: Session = Depends(get_db)
+    db: DBSession = Depends(get_session)
 ):
-    logger.info(f"Attempting to create/update daily record for user ID: {user_id}, date: {daily_record.record_date}")
-    db_user = crud.get_user(db, user_id=user_id)
-    if db_user is None:
-        logger.warning(f"User with ID {user_id} not found when creating daily record.")
+    logger.info("Attempting to create/update daily record for user ID: %s, date: %s", user_id, daily_record.record_date)
+    # 使用 get_or_create_daily_record 以單一 upsert 處理新增或更新；使用者不存在時回傳 None
+    db_daily_record = await run_db(db, crud.get_or_create_daily_record, user_id=user_id, record_data=daily_record)
+    if db_daily_record is None:
+        logger.warning("User with ID %s not found when creating daily record.", user_id)
         raise HTTPException(status_code=404, detail="User not found")
-    
-    # 使用 get_or_create_daily_record 來處理新增或更新
-    db_daily_record = crud.get_or_create_daily_record(db=db, user_id=user_id, record_data=daily_record)
-    logger.info(f"Daily record for user ID: {user_id}, date: {daily_record.record_date} processed. Record ID: {db_daily_record.id}")
+    logger.info("Daily record for user ID: %s, date: %s processed. Record ID: %s", user_id, daily_record.record_date, db_daily_record.id)
     return db_daily_record
 
-@app.get("/users/{user_id}/daily_records/dates/", response_model=list[date], tags=["Daily Records"], summary="列出使用者已填寫日期")
-def list_filled_dates_for_user(
+@router.get("/users/{user_id}/daily_records/dates/", response_model=list[date], tags=["Daily Records"], summary="列出使用者已填寫日期")
+async def list_filled_dates_for_user(
+    request: Request,
+    response: Response,
     user_id: int = Path(..., ge=1, description="使用者 ID"),
     # ⬇ 可選：僅查詢某段期間，預防資料量暴衝
     start: Optional[date] = Query(None, description="起始日 (YYYY-MM-DD)"),
     end:   Optional[date] = Query(None, description="結束日 (YYYY-MM-DD)"),
-    db: Session = Depends(get_db)
+    db: DBSession = Depends(get_session)
 ):
-    db_user = crud.get_user(db, user_id=user_id)
-    if db_user is None:
+    # 先只查資料版本 (同時確認使用者存在)；用戶端的副本仍有效時直接回 304
+    version = await run_db(db, crud.get_data_version, user_id)
+    if version is None:
+        raise HTTPException(404, "User not found")
+    validators = http_cache.Validators(user_id, *version)
+    if validators.matches(request):
+        return http_cache.not_modified(validators)
+    http_cache.apply(response, validators)
+    return await run_db(db, crud.get_filled_dates, user_id=user_id, start=start, end=end)
+
+@router.post("/users/{user_id}/daily_records/import/", response_model=schemas.BulkImportResult, tags=["Daily Records"], summary="批次匯入每日記錄 (CSV / NDJSON)")
+async def import_daily_records_for_user(
+    request: Request,
+    user_id: int = Path(..., ge=1, description="使用者 ID"),
+    format: Optional[Literal["csv", "ndjson"]] = Query(None, description="檔案格式；未指定時依 Content-Type 判斷"),
+    db: DBSession = Depends(get_session)
+):
+    # 請求本體以串流方式逐行解析，每 BULK_CHUNK_SIZE 筆以單一 upsert 寫入，同一日期以最後一筆為準
+    fmt = format or bulk.detect_format(request.headers.get("content-type"))
+    if fmt is None:
+        raise HTTPException(415, "Use text/csv or application/x-ndjson, or pass ?format=")
+    if await run_db(db, services.get_user_profile, user_id) is None:
         raise HTTPException(404, "User not found")
 
-    q = db.query(models_db.DailyRecord.record_date).filter_by(user_id=user_id)
-    if start:
-        q = q.filter(models_db.DailyRecord.record_date >= start)
-    if end:
-        q = q.filter(models_db.DailyRecord.record_date <= end)
+    result = schemas.BulkImportResult()
+    batch: dict[date, dict] = {}
 
-    # SQLAlchemy 會傳回 list[(date,)]，展平成純 date
-    return [d[0] for d in q.all()]
+    def add_error(line_no: int, message: str):
+        result.error_count += 1
+        if len(result.errors) < 100:
+            result.errors.append(schemas.BulkImportError(line=line_no, error=message))
+
+    async for line_no, data, error in bulk.iter_records(request.stream(), fmt):
+        if error:
+            add_error(line_no, error)
+            continue
+        result.received += 1
+        try:
+            record = schemas.DailyRecordCreate.model_validate(data)
+        except ValidationError as e:
+            add_error(line_no, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+            continue
+        # 未提供的欄位 (例如 CSV 沒有運動消耗欄) 不帶預設值，更新既有紀錄時保留原值
+        batch[record.record_date] = record.model_dump(exclude_unset=True)
+        if len(batch) >= bulk.BULK_CHUNK_SIZE:
+            result.upserted += await run_db(db, crud.bulk_upsert_daily_records, user_id, list(batch.values()))
+            batch.clear()
+    result.upserted += await run_db(db, crud.bulk_upsert_daily_records, user_id, list(batch.values()))
+
+    logger.info("Imported daily records for user ID %s: %s upserted, %s errors", user_id, result.upserted, result.error_count)
+    return result
+
+@router.get("/users/{user_id}/daily_records/export/", tags=["Daily Records"], summary="串流匯出每日記錄 (CSV / NDJSON)")
+async def export_daily_records_for_user(
+    user_id: int = Path(..., ge=1, description="使用者 ID"),
+    format: Literal["csv", "ndjson"] = Query("csv", description="檔案格式"),
+    start: Optional[date] = Query(None, description="起始日 (YYYY-MM-DD)"),
+    end:   Optional[date] = Query(None, description="結束日 (YYYY-MM-DD)"),
+    db: DBSession = Depends(get_session)
+):
+    if await run_db(db, services.get_user_profile, user_id) is None:
+        raise HTTPException(404, "User not found")
+    return StreamingResponse(
+        bulk.export_records(user_id, format, start, end),
+        media_type=bulk.CONTENT_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="daily_records_user{user_id}.{format}"'},
+    )
 
-@app.get("/users/{user_id}/daily_records/", response_model=List[schemas.DailyRecord], tags=["Daily Records"], summary="獲取使用者所有每日記錄")
-def read_daily_records_for_user(
+@router.get("/users/{user_id}/daily_records/", response_model=List[schemas.DailyRecord], tags=["Daily Records"], summary="獲取使用者所有每日記錄")
+async def read_daily_records_for_user(
+    response: Response,
     user_id: int = Path(..., description="使用者 ID", ge=1),
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="分頁游標 (取自上一頁回應的 X-Next-Cursor / X-Prev-Cursor 標頭)"),
+    skip: int = Query(0, ge=0, description="略過筆數 (舊的 offset 分頁，請改用 cursor)", deprecated=True),
+    limit: int = Query(100, ge=1, le=pagination.MAX_PAGE_SIZE, description="最多回傳筆數"),
+    db: DBSession = Depends(get_session)
 ):
-    logger.info(f"Fetching daily records for user ID: {user_id}, skip: {skip}, limit: {limit}")
-    db_user = crud.get_user(db, user_id=user_id)
-    if db_user is None:
-        logger.warning(f"User with ID {user_id} not found when fetching daily records.")
+    logger.info("Fetching daily records for user ID: %s, skip: %s, limit: %s", user_id, skip, limit)
+    if skip:
+        if cursor:
+            raise HTTPException(400, "skip cannot be combined with cursor")
+        records = await run_db(db, crud.get_daily_records_by_user, user_id=user_id, skip=skip, limit=limit)
+    else:
+        page = await _fetch_page(db, crud.get_daily_records_page, user_id=user_id, limit=limit, cursor=cursor)
+        _set_page_headers(response, page)
+        records = page.items
+    if not records and await run_db(db, services.get_user_profile, user_id) is None:
+        logger.warning("User with ID %s not found when fetching daily records.", user_id)
         raise HTTPException(status_code=404, detail="User not found")
-    
-    records = crud.get_daily_records_by_user(db, user_id=user_id, skip=skip, limit=limit)
     return records
 
-@app.get("/users/{user_id}/daily_records/{record_date}/", response_model=schemas.DailyRecord, tags=["Daily Records"], summary="取得使用者單日完整紀錄")
-def read_daily_record_by_date(
+@router.get("/users/{user_id}/daily_records/{record_date}/", response_model=schemas.DailyRecord, tags=["Daily Records"], summary="取得使用者單日完整紀錄")
+async def read_daily_record_by_date(
+    request: Request,
+    response: Response,
     user_id: int = Path(..., ge=1, description="使用者 ID"),
     record_date: date = Path(..., description="記錄日期 (YYYY-MM-DD)"),
-    db: Session = Depends(get_db)
+    db: DBSession = Depends(get_session)
 ):
-    if crud.get_user(db, user_id) is None:
+    # 單一 LEFT JOIN 同時取得使用者 (資料版本、404 判斷) 與紀錄
+    row = await run_db(db, crud.get_user_with_record, user_id=user_id, record_date=record_date)
+    if row is None:
         raise HTTPException(404, "User not found")
-
-    record = crud.get_daily_record_by_date(db, user_id, record_date)
+    db_user, record = row
     if record is None:
         raise HTTPException(404, "Record not found")
+    validators = http_cache.Validators(user_id, db_user.data_version, db_user.data_updated_at)
+    if validators.matches(request):
+        return http_cache.not_modified(validators)
+    http_cache.apply(response, validators)
     return record
 
-@app.get("/users/{user_id}/daily_summary/{record_date}/", response_model=schemas.DailySummary, tags=["Summary & LLM"], summary="獲取每日總結與 LLM 建議")
-def get_daily_summary_with_llm(
+# --- Food / Meal Entry Endpoints ---
+@router.get("/foods/search/", response_model=List[schemas.FoodItem], tags=["Foods"], summary="搜尋食物 (自動完成)")
+async def search_foods(
+    q: str = Query(..., min_length=1, max_length=64, description="名稱 (中文或英文)，前綴相符者優先"),
+    limit: int = Query(10, ge=1, le=MAX_FOOD_SEARCH_RESULTS, description="最多回傳筆數"),
+):
+    return foods.get_index().search(q, limit)
+
+@router.get("/foods/{food_id}/", response_model=schemas.FoodItem, tags=["Foods"], summary="取得食物營養資料 (每 100 g)")
+async def read_food(food_id: int = Path(..., ge=1, description="食物 ID")):
+    food = foods.get_index().get(food_id)
+    if food is None:
+        raise HTTPException(status_code=404, detail="Food not found")
+    return food
+
+@router.post("/users/{user_id}/meal_entries/", response_model=schemas.MealEntry, tags=["Foods"], summary="新增食物紀錄 (累加進當日總量)")
+async def create_meal_entry(
+    user_id: int = Path(..., description="使用者 ID", ge=1),
+    entry: schemas.MealEntryCreate = Body(...),
+    db: DBSession = Depends(get_session)
+):
+    food = foods.get_index().get(entry.food_id)
+    if food is None:
+        raise HTTPException(status_code=404, detail="Food not found")
+    db_entry = await run_db(db, crud.add_meal_entry, user_id, entry, food)
+    if db_entry is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_entry
+
+@router.get("/users/{user_id}/meal_entries/{record_date}/", response_model=List[schemas.MealEntry], tags=["Foods"], summary="列出當日食物紀錄")
+async def read_meal_entries(
     user_id: int = Path(..., description="使用者 ID", ge=1),
     record_date: date = Path(..., description="記錄日期 (YYYY-MM-DD)"),
-    db: Session = Depends(get_db)
+    db: DBSession = Depends(get_session)
 ):
-    logger.info(f"Fetching daily summary for user ID: {user_id}, date: {record_date}")
-    db_user = crud.get_user(db, user_id=user_id)
-    if db_user is None:
-        logger.warning(f"User with ID {user_id} not found for daily summary.")
+    entries = await run_db(db, crud.get_meal_entries, user_id, record_date)
+    if not entries and await run_db(db, services.get_user_profile, user_id) is None:
         raise HTTPException(status_code=404, detail="User not found")
+    return entries
+
+@router.delete("/users/{user_id}/meal_entries/{entry_id}/", status_code=204, tags=["Foods"], summary="刪除食物紀錄 (自當日總量扣除)")
+async def delete_meal_entry(
+    user_id: int = Path(..., description="使用者 ID", ge=1),
+    entry_id: int = Path(..., description="食物紀錄 ID", ge=1),
+    db: DBSession = Depends(get_session)
+):
+    if not await run_db(db, crud.delete_meal_entry, user_id, entry_id):
+        raise HTTPException(status_code=404, detail="Meal entry not found")
+    return Response(status_code=204)
 
-    db_daily_record = crud.get_daily_record_by_date(db, user_id=user_id, record_date=record_date)
+# --- Weight Log / TDEE Endpoints ---
+@router.post("/users/{user_id}/weight_logs/", response_model=schemas.WeightLog, tags=["Weight & TDEE"], summary="新增或更新當日體重")
+async def upsert_weight_log(
+    user_id: int = Path(..., description="使用者 ID", ge=1),
+    log: schemas.WeightLogCreate = Body(...),
+    db: DBSession = Depends(get_session)
+):
+    db_log = await run_db(db, crud.upsert_weight_log, user_id, log)
+    if db_log is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_log
+
+@router.get("/users/{user_id}/weight_logs/", response_model=List[schemas.WeightLog], tags=["Weight & TDEE"], summary="列出體重紀錄")
+async def read_weight_logs(
+    user_id: int = Path(..., description="使用者 ID", ge=1),
+    start: Optional[date] = Query(None, description="起始日 (YYYY-MM-DD)"),
+    end: Optional[date] = Query(None, description="結束日 (YYYY-MM-DD)"),
+    db: DBSession = Depends(get_session)
+):
+    logs = await run_db(db, crud.get_weight_logs, user_id, start, end)
+    if not logs and await run_db(db, services.get_user_profile, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return logs
+
+@router.get("/users/{user_id}/tdee/", response_model=schemas.TDEEEstimate, tags=["Weight & TDEE"], summary="由攝取與體重紀錄擬合的 TDEE")
+async def read_tdee_estimate(
+    user_id: int = Path(..., description="使用者 ID", ge=1), db: DBSession = Depends(get_session)
+):
+    estimate = await run_db(db, services.get_tdee_estimate, user_id)
+    if estimate is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return estimate
+
+@router.get("/users/{user_id}/daily_summary/{record_date}/", response_model=schemas.DailySummary, tags=["Summary & LLM"], summary="獲取每日總結與 LLM 建議")
+async def get_daily_summary_with_llm(
+    request: Request,
+    response: Response,
+    user_id: int = Path(..., description="使用者 ID", ge=1),
+    record_date: date = Path(..., description="記錄日期 (YYYY-MM-DD)"),
+    db: DBSession = Depends(get_session)
+):
+    logger.info("Fetching daily summary for user ID: %s, date: %s", user_id, record_date)
+    row = await run_db(db, crud.get_user_with_record, user_id=user_id, record_date=record_date)
+    if row is None:
+        logger.warning("User with ID %s not found for daily summary.", user_id)
+        raise HTTPException(status_code=404, detail="User not found")
+
+    db_user, db_daily_record = row
     if db_daily_record is None:
-        logger.warning(f"Daily record for user ID {user_id} on date {record_date} not found.")
+        logger.warning("Daily record for user ID %s on date %s not found.", user_id, record_date)
         raise HTTPException(status_code=404, detail=f"Daily record for date {record_date} not found")
 
-    # 1. 計算 BMR
-    bmr = services.calculate_bmr(db_user)
-    logger.info(f"Calculated BMR for user ID {user_id}: {bmr}")
-
-    # 2. 根據目標設定建議每日熱量攝取 (假設活動係數為 1.2)
-    # TODO: 未來可以讓使用者輸入活動係數
-    recommended_calories = services.calculate_recommended_calories(bmr, db_user.goal, activity_level=1.2)
-    logger.info(f"Calculated recommended calories for user ID {user_id}: {recommended_calories}")
-    
-    # 3. 計算熱量差
-    # 熱量差 = 當日攝取總熱量 - 建議每日熱量攝取
-    # (更精確的可能是 攝取 - (TDEE - 目標調整值 + 運動消耗))
-    # 這裡簡化為：攝取 - 建議攝取 (建議攝取已包含目標調整)
-    calorie_balance = db_daily_record.calories_consumed - recommended_calories + db_daily_record.calories_burned_exercise
-    logger.info(f"Calculated calorie balance for user ID {user_id}, date {record_date}: {calorie_balance}")
-
-    summary_data = schemas.DailySummary(
-        date=record_date,
-        user_info=schemas.User.from_orm(db_user), 
-        daily_record=schemas.DailyRecord.from_orm(db_daily_record), 
-        bmr=bmr,
-        recommended_daily_calories=recommended_calories,
-        calorie_balance=calorie_balance,
-        llm_feedback=None # 先初始化
-    )
+    # 只有建議已備妥的回應會帶 ETag，因此版本相同代表內容 (含建議) 都沒變
+    validators = http_cache.Validators(user_id, db_user.data_version, db_user.data_updated_at)
+    if validators.matches(request):
+        return http_cache.not_modified(validators)
+
+    summary_data = services.build_daily_summary(db_user, db_daily_record)
+    logger.info("Calculated summary for user ID %s, date %s: BMR %s, recommended %s, balance %s", user_id, record_date, summary_data.bmr, summary_data.recommended_daily_calories, summary_data.calorie_balance)
 
-    # 4. 呼叫Service層LLM相關函數獲取建議
-    summary_data = services.ensure_llm_feedback(db, db_daily_record, summary_data)
+    # 4. 已有建議就直接帶回，否則排入背景工作 (回傳 pending 與 job id)
+    summary_data = await run_db(db, services.ensure_llm_feedback, db_daily_record, summary_data)
+    if summary_data.llm_feedback_status == "ready":
+        # 從快取補上建議時版本已遞增，以寫入後的版本產生 ETag
+        http_cache.apply(response, http_cache.Validators(user_id, db_user.data_version, db_user.data_updated_at))
+    else:
+        response.headers["Cache-Control"] = "no-store"
     return summary_data
 
+@router.get("/users/{user_id}/daily_summary/{record_date}/stream/", tags=["Summary & LLM"], summary="以 SSE 串流每日總結與 LLM 建議",
+         response_class=StreamingResponse, responses={200: {"content": {"text/event-stream": {}}}})
+async def stream_daily_summary_with_llm(
+    request: Request,
+    user_id: int = Path(..., description="使用者 ID", ge=1),
+    record_date: date = Path(..., description="記錄日期 (YYYY-MM-DD)"),
+    db: DBSession = Depends(get_session)
+):
+    """
+    事件依序為 summary (數值總結)、feedback (建議片段，可能多次)、done (完整建議與 ETag)；
+    LLM 失敗時以 error 事件結束。建議在串流完成後才寫入紀錄。
+    """
+    row = await run_db(db, crud.get_user_with_record, user_id=user_id, record_date=record_date)
+    if row is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    db_user, db_daily_record = row
+    if db_daily_record is None:
+        raise HTTPException(status_code=404, detail=f"Daily record for date {record_date} not found")
+
+    validators = http_cache.Validators(user_id, db_user.data_version, db_user.data_updated_at)
+    if validators.matches(request):
+        return http_cache.not_modified(validators)
+
+    summary_data = services.build_daily_summary(db_user, db_daily_record)
+    key = await run_db(db, services.prepare_feedback_stream, db_daily_record, summary_data)
+    headers = dict(streaming.SSE_HEADERS)
+    etag = None
+    if summary_data.llm_feedback_status == "ready":
+        etag = http_cache.Validators(user_id, db_user.data_version, db_user.data_updated_at).etag
+        headers["ETag"] = etag
+    return StreamingResponse(streaming.daily_summary_events(summary_data, key, etag),
+                             media_type="text/event-stream", headers=headers)
+
+@router.get("/users/{user_id}/daily_summaries/", response_model=schemas.DailySummaryRange, tags=["Summary & LLM"], summary="獲取期間內每日總結 (圖表用)")
+async def get_daily_summaries_in_range(
+    user_id: int = Path(..., description="使用者 ID", ge=1),
+    start: date = Query(..., description="起始日 (YYYY-MM-DD)"),
+    end: date = Query(..., description="結束日 (YYYY-MM-DD)"),
+    db: DBSession = Depends(get_session)
+):
+    if end < start:
+        raise HTTPException(400, "end must not be earlier than start")
+    if (end - start).days >= MAX_SUMMARY_RANGE_DAYS:
+        raise HTTPException(400, f"Date range must not exceed {MAX_SUMMARY_RANGE_DAYS} days")
+
+    profile = await run_db(db, services.get_user_profile, user_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    records = await run_db(db, crud.get_daily_records_in_range, user_id=user_id, start=start, end=end)
+    return await run_db(db, services.build_summary_range, profile, records, start, end)
+
+@router.get("/users/{user_id}/trends/{period}/", response_model=schemas.NutritionTrend, tags=["Summary & LLM"], summary="每週／每月營養趨勢")
+async def read_nutrition_trend(
+    user_id: int = Path(..., description="使用者 ID", ge=1),
+    period: models_db.PeriodEnum = Path(..., description="彙總區間：week (週一起算) 或 month"),
+    start: Optional[date] = Query(None, description="起始日期 (含該日所在區間)"),
+    end: Optional[date] = Query(None, description="結束日期 (含，預設今天)"),
+    limit: int = Query(12, ge=1, le=MAX_TREND_BUCKETS, description="最多回傳的區間數 (取最近的)"),
+    db: DBSession = Depends(get_session)
+):
+    if start and end and end < start:
+        raise HTTPException(400, "end must not be earlier than start")
+    profile = await run_db(db, services.get_user_profile, user_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return await run_db(db, aggregates.get_trend, profile, period, start, end, limit)
+
+@router.get("/llm/cache/stats/", tags=["Summary & LLM"], summary="LLM 建議快取命中統計")
+async def read_llm_cache_stats():
+    return feedback_cache.stats()
+
+# --- System Endpoints ---
+@router.get("/system/user_cache/", tags=["System"], summary="使用者資料快取命中統計")
+async def read_user_cache_stats():
+    return user_cache.stats()
+
+@router.get("/system/coordination/", tags=["System"], summary="多 worker 協調後端資訊")
+async def read_coordination_stats():
+    return {**coordination.stats(), "llm_job_queue_depth": jobs.queue_depth()}
+
+@router.get("/system/db_pool/", tags=["System"], summary="資料庫連線池統計")
+async def read_db_pool_stats():
+    return get_pool_stats()
+
+@router.get("/metrics", response_class=PlainTextResponse, tags=["System"], summary="Prometheus 格式的監控指標")
+async def read_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# --- Background Job Endpoints ---
+@router.get("/jobs/{job_id}/", response_model=schemas.LLMJob, tags=["Summary & LLM"], summary="查詢 LLM 建議產生工作狀態")
+async def read_llm_job(
+    job_id: int = Path(..., description="工作 ID", ge=1),
+    db: DBSession = Depends(get_session)
+):
+    job = await run_db(db, jobs.get_job_result, job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    return job
+
 # 根路徑，用於健康檢查或基本資訊
 #@app.get("/", tags=["Root"])
 #async def root():
 #    return {"message": "歡迎使用健康管理系統 API"}
 
-# 可以在這裡加入一個簡單的 on_event("startup") 來印出環境變數狀態
-@app.on_event("startup")
-async def startup_event():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """啟動時才做的工作：資料庫 migration (AUTO_MIGRATE)、清理建議快取、啟動背景 LLM worker；關閉時停止 worker"""
     logger.info("應用程式啟動...")
-    db_url = os.getenv("DATABASE_URL", "未設定 DATABASE_URL")
-    gemini_key_status = "已設定" if os.getenv("GEMINI_API_KEY") else "未設定"
-    logger.info(f"資料庫 URL: {db_url}")
-    logger.info(f"Gemini API Key 狀態: {gemini_key_status}")
-    if not os.getenv("GEMINI_API_KEY"):
+    logger.info("資料庫 URL: %s", DATABASE_URL)
+    logger.info("LLM 後端: %s，Gemini API Key 狀態: %s", LLM_BACKEND, "已設定" if GEMINI_API_KEY else "未設定")
+    logger.info("資料庫存取模式: %s", "async" if DB_ASYNC_MODE else "sync")
+    logger.info("協調後端: %s (%s)", COORDINATION_BACKEND, coordination.OWNER)
+    if not services.llm_available():
         logger.warning("警告：GEMINI_API_KEY 環境變數未設定。LLM 功能將受限。")
+    # 創建資料庫表 (如果不存在)，並補上舊資料庫缺少的欄位；
+    # 多個 worker 時由 python -m app.serve / gunicorn.conf.py 先執行一次 migration，worker 不再各自執行
+    if AUTO_MIGRATE:
+        migrations.upgrade(engine)
+    # 清掉過期的共用建議快取 (走 created_at 索引)；舊版誤存的錯誤訊息由 migration 一次性清除
+    db = SessionLocal()
+    try:
+        purged = feedback_cache.purge_expired(db)
+        if purged:
+            logger.info("Purged %s expired LLM feedback cache entries", purged)
+    finally:
+        db.close()
+    # 接收其他 worker 行程的快取失效通知，再啟動背景 LLM worker
+    coordination.start()
+    jobs.start_workers()
+    try:
+        yield
+    finally:
+        jobs.stop_workers()
+        coordination.stop()
+
+
+def create_app() -> FastAPI:
+    """組成 FastAPI app (路由、middleware)；需要 I/O 的初始化都在 lifespan 中進行"""
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(metrics.MetricsMiddleware)
+    app.include_router(router)
+    return app
+
 
+# uvicorn app.main:app
+app = create_app()
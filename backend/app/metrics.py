@@ -0,0 +1,213 @@
+import bisect
+import contextvars
+import threading
+import time
+from typing import Callable, Iterable
+
+from sqlalchemy import event
+
+# 延遲 (秒) 的直方圖區間
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 每個請求的 SQL 語句數區間
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: tuple[tuple[str, str], ...] = ()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [各區間計數..., 總和, 次數]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(labels)
+            if data is None:
+                data = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(labels, list(data)) for labels, data in self._values.items()]
+        for labels, data in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, (("le", _format_value(float(bound))),))
+                yield f"{self.name}_bucket{le} {cumulative}"
+            le = _format_labels(self.labelnames, labels, (("le", "+Inf"),))
+            yield f"{self.name}_bucket{le} {data[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(data[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {data[-1]}"
+
+
+class GaugeCallback:
+    """在輸出時才呼叫 callback 取值的 gauge，callback 回傳 {labels tuple: value}"""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...], callback: Callable[[], dict]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.callback = callback
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        for labels, value in self.callback().items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+_registry: list = []
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+def render() -> str:
+    """Prometheus 文字格式 (text/plain; version=0.0.4)"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+# --- HTTP ---
+http_requests_total = register(Counter(
+    "http_requests_total", "HTTP requests by route template, method and status code.", ("method", "route", "status")))
+http_request_duration_seconds = register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route")))
+http_request_sql_statements = register(Histogram(
+    "http_request_sql_statements", "SQL statements executed per HTTP request.", ("method", "route"), buckets=COUNT_BUCKETS))
+
+# --- SQL ---
+sql_statements_total = register(Counter(
+    "sql_statements_total", "SQL statements executed, by leading keyword.", ("operation",)))
+sql_statement_duration_seconds = register(Histogram(
+    "sql_statement_duration_seconds", "SQL statement execution time, by leading keyword.", ("operation",)))
+
+# --- LLM ---
+llm_requests_total = register(Counter(
+    "llm_requests_total", "LLM generate calls by outcome.", ("outcome",)))
+llm_request_duration_seconds = register(Histogram(
+    "llm_request_duration_seconds", "LLM generate call latency.", ()))
+llm_retries_total = register(Counter(
+    "llm_retries_total", "LLM calls retried after a transient upstream error.", ()))
+llm_tokens_total = register(Counter(
+    "llm_tokens_total", "LLM tokens reported by the API.", ("kind",)))
+
+
+def observe_llm_call(seconds: float, outcome: str, response=None):
+    """記錄一次 LLM 呼叫的延遲、結果 (ok / empty / timeout / error) 與 usage_metadata 回報的 token 數"""
+    llm_requests_total.inc(outcome)
+    llm_request_duration_seconds.observe(seconds)
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    for kind, attr in (("prompt", "prompt_token_count"), ("completion", "candidates_token_count")):
+        count = getattr(usage, attr, None)
+        if count:
+            llm_tokens_total.inc(kind, amount=count)
+
+
+# 目前請求內的 SQL 語句計數 (由 middleware 設定；threadpool 與 greenlet 都會沿用同一個 context)
+_request_sql_count: contextvars.ContextVar[list | None] = contextvars.ContextVar("request_sql_count", default=None)
+
+
+def instrument_engine(engine):
+    """在 engine 上掛 SQL 計數與計時事件 (async engine 請傳入 .sync_engine)"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        sql_statements_total.inc(operation)
+        sql_statement_duration_seconds.observe(elapsed, operation)
+        counter = _request_sql_count.get()
+        if counter is not None:
+            counter[0] += 1
+
+
+class MetricsMiddleware:
+    """純 ASGI middleware：以路由樣板 (而非實際路徑) 為標籤記錄延遲、狀態碼與 SQL 語句數"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+        sql_count = [0]
+        token = _request_sql_count.set(sql_count)
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_sql_count.reset(token)
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or ("/static" if scope["path"].startswith("/static/") else "unmatched")
+            method = scope["method"]
+            http_requests_total.inc(method, route_path, str(status["code"]))
+            http_request_duration_seconds.observe(elapsed, method, route_path)
+            http_request_sql_statements.observe(sql_count[0], method, route_path)
@@ -0,0 +1,92 @@
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from . import aggregates, feedback_cache, models_db, tdee
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# create_all 只會建立不存在的資料表，不會替既有資料表補欄位；
+# 之後新增到既有資料表的欄位都登記在這裡：(資料表, 欄位, 欄位型別 DDL)
+ADDED_COLUMNS = [
+    ("daily_records", "llm_feedback_key", "VARCHAR(64)"),
+    ("users", "data_version", "INTEGER NOT NULL DEFAULT 0"),
+    ("users", "data_updated_at", "TIMESTAMP"),
+    ("users", "tdee_estimate", "FLOAT"),
+    ("users", "tdee_confidence", "FLOAT"),
+    ("users", "tdee_window_end", "DATE"),
+]
+
+# 一次性的資料修正：(名稱, fn(session) -> 受影響列數)。執行過的名稱記在 data_migrations，之後不再執行
+DATA_MIGRATIONS = [
+    # 舊版把 LLM 錯誤訊息當成建議存下：刪除快取列並讓對應紀錄重新產生
+    ("purge_legacy_error_feedback", feedback_cache.purge_error_feedback),
+]
+
+
+def upgrade(engine: Engine):
+    """建立缺少的資料表，補上舊資料庫缺少的欄位與索引，並執行尚未執行過的一次性資料修正"""
+    had_aggregates = inspect(engine).has_table(models_db.NutritionAggregate.__tablename__)
+    models_db.Base.metadata.create_all(bind=engine)
+
+    inspector = inspect(engine)
+    added = set()
+    with engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            existing = {c["name"] for c in inspector.get_columns(table)}
+            if column not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+                added.add((table, column))
+
+    # 同理，既有資料表上新定義的索引也要補建
+    for table in models_db.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+    # 彙總表是新建的：由既有的每日紀錄回填一次 (之後由寫入時增量維護)
+    if not had_aggregates:
+        db = SessionLocal(bind=engine)
+        try:
+            aggregates.rebuild(db)
+        finally:
+            db.close()
+
+    # TDEE 估計欄位是新加的：以既有紀錄擬合一次 (之後由寫入時增量更新)
+    if ("users", "tdee_window_end") in added:
+        db = SessionLocal(bind=engine)
+        try:
+            tdee.rebuild(db)
+        finally:
+            db.close()
+
+    _apply_data_migrations(engine)
+
+
+def _apply_data_migrations(engine: Engine):
+    db = SessionLocal(bind=engine)
+    try:
+        applied = {name for (name,) in db.query(models_db.DataMigration.name)}
+        for name, fn in DATA_MIGRATIONS:
+            if name in applied:
+                continue
+            affected = fn(db)
+            db.add(models_db.DataMigration(name=name))
+            db.commit()
+            logger.info("Applied data migration %s (%d rows)", name, affected)
+    finally:
+        db.close()
+
+
+def main():
+    """部署時的 migration 步驟 (AUTO_MIGRATE=false 時須在啟動 API 前執行)：python -m app.migrations"""
+    from .database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    upgrade(engine)
+    print(f"Database schema is up to date ({engine.url.render_as_string(hide_password=True)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, UniqueConstraint, Float, Date, ForeignKey, Enum as SQLAlchemyEnum , Text, String
+from sqlalchemy import Column, Integer, UniqueConstraint, Index, Float, Date, DateTime, ForeignKey, Enum as SQLAlchemyEnum , Text, String, text, PrimaryKeyConstraint
 from sqlalchemy.orm import relationship
 import enum
+from datetime import datetime
 
 from .database import Base
 
@@ -14,6 +15,22 @@ class GoalEnum(str, enum.Enum):
     maintain = "maintain"
     gain_muscle = "gain_muscle"
 
+class PeriodEnum(str, enum.Enum):
+    week = "week"
+    month = "month"
+
+class MealEnum(str, enum.Enum):
+    breakfast = "breakfast"
+    lunch = "lunch"
+    dinner = "dinner"
+    snack = "snack"
+
+class JobStatusEnum(str, enum.Enum):
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
 class User(Base):
     __tablename__ = "users"
 
@@ -24,6 +41,13 @@ class User(Base):
     age = Column(Integer, nullable=False)
     gender = Column(SQLAlchemyEnum(GenderEnum), nullable=False)
     goal = Column(SQLAlchemyEnum(GoalEnum), nullable=False)
+    # 使用者資料 (個人資訊、每日紀錄、LLM 建議) 每次寫入都會遞增，作為 HTTP ETag / Last-Modified 的依據
+    data_version = Column(Integer, nullable=False, default=0, server_default="0")
+    data_updated_at = Column(DateTime, nullable=True)
+    # 由攝取與體重紀錄擬合的 TDEE 與可信度 (0～1)，以 tdee_window_end 為視窗終點；資料不足時為 None (改用公式)
+    tdee_estimate = Column(Float, nullable=True)
+    tdee_confidence = Column(Float, nullable=True)
+    tdee_window_end = Column(Date, nullable=True)
 
     # Relationship to DailyRecord
     daily_records = relationship("DailyRecord", back_populates="owner")
@@ -39,7 +63,9 @@ class DailyRecord(Base):
     carbs_g = Column(Float, nullable=False)
     calories_burned_exercise = Column(Integer, nullable=True, default=0)
     llm_feedback = Column(Text, nullable=True)
-    
+    # 產生 llm_feedback 時的輸入雜湊；與目前輸入不同代表建議已過期
+    llm_feedback_key = Column(String(64), nullable=True)
+
     user_id = Column(Integer, ForeignKey("users.id"))
 
     owner = relationship("User", back_populates="daily_records")
@@ -47,3 +73,117 @@ class DailyRecord(Base):
     __table_args__ = (
         UniqueConstraint("user_id", "record_date", name="ux_daily_user_date"),
     )
+
+class MealEntry(Base):
+    """
+    單筆食物紀錄。營養值在寫入時依份量換算並存下 (資料集之後更新也不影響舊紀錄)，
+    同時以遞增方式累加進當日 DailyRecord 的總量。
+    """
+    __tablename__ = "meal_entries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    record_date = Column(Date, nullable=False)
+    meal = Column(SQLAlchemyEnum(MealEnum), nullable=False)
+    food_id = Column(Integer, nullable=False)
+    food_name = Column(String(64), nullable=False)
+    grams = Column(Float, nullable=False)
+    calories = Column(Integer, nullable=False)
+    protein_g = Column(Float, nullable=False)
+    fat_g = Column(Float, nullable=False)
+    carbs_g = Column(Float, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_meal_entries_user_date", "user_id", "record_date"),
+    )
+
+class WeightLog(Base):
+    """每日體重 (同一天只保留一筆)；最新一筆同步寫回 User.weight_kg"""
+    __tablename__ = "weight_logs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    log_date = Column(Date, nullable=False)
+    weight_kg = Column(Float, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "log_date", name="ux_weight_user_date"),
+    )
+
+class LLMJob(Base):
+    """背景產生 LLM 建議的工作；狀態存在 DB，任何 worker 行程都能查詢"""
+    __tablename__ = "llm_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    record_id = Column(Integer, ForeignKey("daily_records.id"), nullable=False, index=True)
+    status = Column(SQLAlchemyEnum(JobStatusEnum), nullable=False, default=JobStatusEnum.pending, index=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    record = relationship("DailyRecord")
+
+    __table_args__ = (
+        # 每筆紀錄同時最多一個進行中的工作；並行 enqueue 靠 ON CONFLICT DO NOTHING 去重 (跨行程亦然)
+        Index("ux_llm_jobs_active_record", "record_id", unique=True,
+              sqlite_where=text("status IN ('pending', 'running')"),
+              postgresql_where=text("status IN ('pending', 'running')")),
+    )
+
+class LLMFeedbackCache(Base):
+    """以提示輸入雜湊為鍵的共用 LLM 建議快取，跨使用者與 worker 共用"""
+    __tablename__ = "llm_feedback_cache"
+
+    key = Column(String(64), primary_key=True)
+    feedback = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+class LLMLease(Base):
+    """跨行程的 single-flight 租約：同一 key 同時只有一個 worker 能呼叫 LLM"""
+    __tablename__ = "llm_leases"
+
+    key = Column(String(128), primary_key=True)
+    owner = Column(String(128), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+class CoordinationEvent(Base):
+    """跨行程通知 (例如使用者快取失效)；各 worker 依 id 遞增輪詢，舊列定期刪除"""
+    __tablename__ = "coordination_events"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    channel = Column(String(64), nullable=False)
+    key = Column(String(128), nullable=False)
+    origin = Column(String(128), nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+class NutritionAggregate(Base):
+    """
+    每位使用者每週 (週一起算) ／每月的營養總和，於每日紀錄寫入時同步更新。
+    熱量平衡依使用者目前的建議攝取量在讀取時計算，不存在表中 (使用者資料變更後不會過期)。
+    """
+    __tablename__ = "nutrition_aggregates"
+
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    period = Column(SQLAlchemyEnum(PeriodEnum), nullable=False)
+    period_start = Column(Date, nullable=False)
+    days = Column(Integer, nullable=False)
+    calories_consumed = Column(Integer, nullable=False)
+    protein_g = Column(Float, nullable=False)
+    fat_g = Column(Float, nullable=False)
+    carbs_g = Column(Float, nullable=False)
+    calories_burned_exercise = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("user_id", "period", "period_start", name="pk_nutrition_aggregates"),
+    )
+
+class DataMigration(Base):
+    """已執行過的一次性資料修正 (migrations.DATA_MIGRATIONS)，每個名稱只執行一次"""
+    __tablename__ = "data_migrations"
+
+    name = Column(String(128), primary_key=True)
+    applied_at = Column(DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,76 @@
+import base64
+import json
+from typing import Callable, NamedTuple
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query
+
+# 列表端點每頁最多筆數
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class Page(NamedTuple):
+    items: list
+    next_cursor: str | None
+    prev_cursor: str | None
+
+
+def encode_cursor(scope: str, direction: str, key: list) -> str:
+    """游標內容對前端不透明：{"s": 範圍, "d": next/prev, "k": 排序鍵} 的 URL-safe base64"""
+    raw = json.dumps({"s": scope, "d": direction, "k": key}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, scope: str, parsers: list[Callable]) -> tuple[str, list]:
+    """解析游標並以 parsers 還原排序鍵的型別；格式錯誤或不屬於此列表時拋出 InvalidCursor"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        direction, key = data["d"], data["k"]
+        if data["s"] != scope or direction not in ("next", "prev") or len(key) != len(parsers):
+            raise InvalidCursor("Cursor does not belong to this listing")
+        return direction, [parse(value) for parse, value in zip(parsers, key)]
+    except InvalidCursor:
+        raise
+    except (ValueError, TypeError, KeyError) as e:
+        raise InvalidCursor("Malformed cursor") from e
+
+
+def keyset_page(query: Query, columns: list, descending: bool, limit: int, scope: str,
+                cursor: str | None = None, parsers: list[Callable] | None = None,
+                serializers: list[Callable] | None = None) -> Page:
+    """
+    以 keyset (seek) 方式取一頁：WHERE (排序鍵) < / > 游標值 ORDER BY 排序鍵 LIMIT limit+1，
+    走索引範圍掃描，成本與頁數深度無關。多取一筆用來判斷是否還有下一頁／上一頁。
+    columns: 排序鍵欄位 (需能唯一決定順序)；descending: 列表的顯示順序。
+    """
+    parsers = parsers or [int] * len(columns)
+    serializers = serializers or [lambda v: v] * len(columns)
+    direction, key = decode_cursor(cursor, scope, parsers) if cursor else (None, None)
+
+    # 往前翻頁時反向排序取資料，再轉回顯示順序
+    backward = direction == "prev"
+    scan_desc = descending != backward
+    if key is not None:
+        keys, value = (tuple_(*columns), tuple(key)) if len(columns) > 1 else (columns[0], key[0])
+        query = query.filter(keys < value if scan_desc else keys > value)
+    query = query.order_by(*[c.desc() if scan_desc else c.asc() for c in columns])
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+    has_next = has_more if not backward else True
+    has_prev = has_more if backward else direction is not None
+
+    def cursor_for(row, to: str) -> str:
+        return encode_cursor(scope, to, [s(getattr(row, c.key)) for s, c in zip(serializers, columns)])
+
+    return Page(
+        items=rows,
+        next_cursor=cursor_for(rows[-1], "next") if rows and has_next else None,
+        prev_cursor=cursor_for(rows[0], "prev") if rows and has_prev else None,
+    )
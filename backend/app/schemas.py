@@ -1,7 +1,8 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Literal
 from datetime import date
-from .models_db import GenderEnum, GoalEnum # Import enums from models
+from datetime import datetime
+from .models_db import GenderEnum, GoalEnum, JobStatusEnum, MealEnum, PeriodEnum # Import enums from models
 
 # --- User Schemas ---
 class UserBase(BaseModel):
@@ -24,6 +25,16 @@ class User(UserBase):
         "from_attributes": True
     }
 
+class UserProfile(BaseModel):
+    """使用者資料與由其推導的每日熱量數值 (快取用)"""
+    user: User
+    bmr: float
+    tdee: float
+    # formula: BMR × 1.2；estimated: 由攝取與體重紀錄擬合 (tdee_confidence 為擬合值所佔的權重)
+    tdee_source: Literal["formula", "estimated"] = "formula"
+    tdee_confidence: float = 0.0
+    recommended_daily_calories: float
+
 # --- Daily Record Schemas ---
 class DailyRecordBase(BaseModel):
     record_date: date = Field(..., description="記錄日期")
@@ -44,6 +55,81 @@ class DailyRecord(DailyRecordBase):
         "from_attributes": True
     }
 
+# --- Food / Meal Entry Schemas ---
+class FoodItem(BaseModel):
+    id: int
+    name: str
+    name_en: Optional[str] = None
+    serving_g: float = Field(..., description="一般一份的重量 (g)")
+    calories: float = Field(..., description="每 100 g 熱量 (kcal)")
+    protein_g: float = Field(..., description="每 100 g 蛋白質 (g)")
+    fat_g: float = Field(..., description="每 100 g 脂肪 (g)")
+    carbs_g: float = Field(..., description="每 100 g 碳水化合物 (g)")
+
+class MealEntryCreate(BaseModel):
+    record_date: date = Field(..., description="記錄日期")
+    meal: MealEnum = Field(..., description="餐別")
+    food_id: int = Field(..., ge=1, description="食物 ID (取自 /foods/search/)")
+    grams: float = Field(..., gt=0, le=5000, description="份量 (g)")
+
+class MealEntry(BaseModel):
+    id: int
+    user_id: int
+    record_date: date
+    meal: MealEnum
+    food_id: int
+    food_name: str
+    grams: float
+    calories: int
+    protein_g: float
+    fat_g: float
+    carbs_g: float
+    created_at: datetime
+
+    model_config = {
+        "from_attributes": True
+    }
+
+# --- Weight Log / TDEE Schemas ---
+class WeightLogCreate(BaseModel):
+    log_date: date = Field(..., description="量測日期")
+    weight_kg: float = Field(..., gt=0, le=500, description="體重 (kg)")
+
+class WeightLog(WeightLogCreate):
+    id: int
+    user_id: int
+
+    model_config = {
+        "from_attributes": True
+    }
+
+class TDEEEstimate(BaseModel):
+    """擬合的 TDEE 與其依據 (視窗內的攝取與體重變化)"""
+    user_id: int
+    bmr: float
+    formula_tdee: float = Field(..., description="公式值 (BMR × 1.2)")
+    tdee: float = Field(..., description="實際採用的 TDEE (擬合值與公式值依可信度加權)")
+    tdee_source: Literal["formula", "estimated"]
+    tdee_confidence: float = Field(..., description="擬合值所佔的權重 (0～1)")
+    estimated_tdee: Optional[float] = Field(None, description="擬合值 (資料不足時為 null)")
+    recommended_daily_calories: float
+    window_start: Optional[date] = None
+    window_end: Optional[date] = None
+    intake_days: int = Field(0, description="視窗內有攝取紀錄的天數")
+    weight_days: int = Field(0, description="視窗內有體重紀錄的天數")
+    avg_net_intake: Optional[float] = Field(None, description="平均淨攝取 (攝取 - 運動消耗，kcal)")
+    weight_change_kg_per_week: Optional[float] = None
+
+class BulkImportError(BaseModel):
+    line: int = Field(..., description="上傳檔案中的行號 (從 1 開始)")
+    error: str
+
+class BulkImportResult(BaseModel):
+    received: int = Field(0, description="解析到的資料筆數 (不含標題與空白行)")
+    upserted: int = Field(0, description="成功新增或更新的筆數")
+    error_count: int = 0
+    errors: List[BulkImportError] = Field(default_factory=list, description="錯誤明細 (最多列出前 100 筆)")
+
 # --- Calculation and Summary Schemas ---
 class BMRCalculationResult(BaseModel):
     bmr: float = Field(..., description="基礎代謝率 (BMR)")
@@ -57,6 +143,71 @@ class DailySummary(BaseModel):
     recommended_daily_calories: float
     calorie_balance: float # 熱量盈餘／赤字
     llm_feedback: Optional[str] = None
+    # ready: 已有建議；pending: 背景產生中 (以 llm_job_id 查詢)；streaming: 由串流端點接著送出；
+    # unavailable: LLM 未配置或暫時無法使用；failed: 產生失敗
+    llm_feedback_status: Literal["ready", "pending", "streaming", "unavailable", "failed"] = "ready"
+    llm_job_id: Optional[int] = None
+
+    model_config = {
+        "from_attributes": True
+    }
+
+class DailySummaryPoint(BaseModel):
+    """期間總結中的單日資料 (精簡欄位，方便前端畫圖)"""
+    date: date
+    record_id: int
+    calories_consumed: int
+    protein_g: float
+    fat_g: float
+    carbs_g: float
+    calories_burned_exercise: int
+    calorie_balance: float
+    llm_feedback_status: Literal["ready", "pending", "unavailable", "failed"] = "ready"
+    llm_job_id: Optional[int] = None
+
+class DailySummaryRange(BaseModel):
+    user_id: int
+    start: date
+    end: date
+    bmr: float
+    recommended_daily_calories: float
+    days: List[DailySummaryPoint]
+
+# --- Trend Schemas ---
+class TrendBucket(BaseModel):
+    """一週或一個月的總和與每日平均 (平均以有紀錄的天數計算)"""
+    period_start: date
+    period_end: date
+    days: int
+    total_calories_consumed: int
+    total_protein_g: float
+    total_fat_g: float
+    total_carbs_g: float
+    total_calories_burned_exercise: int
+    total_calorie_balance: float
+    avg_calories_consumed: float
+    avg_protein_g: float
+    avg_fat_g: float
+    avg_carbs_g: float
+    avg_calories_burned_exercise: float
+    avg_calorie_balance: float
+
+class NutritionTrend(BaseModel):
+    user_id: int
+    period: PeriodEnum
+    recommended_daily_calories: float
+    buckets: List[TrendBucket]
+
+# --- Background Job Schemas ---
+class LLMJob(BaseModel):
+    id: int
+    user_id: int
+    record_id: int
+    status: JobStatusEnum
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    llm_feedback: Optional[str] = Field(None, description="工作完成後的 LLM 建議")
 
     model_config = {
         "from_attributes": True
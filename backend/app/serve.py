@@ -0,0 +1,39 @@
+"""
+多 worker 啟動入口：先在這個行程執行一次 migration，再以 uvicorn 啟動 N 個 worker 行程 (共用同一個資料庫；
+租約、快取失效與 LLM 工作佇列經由 app.coordination 協調)。在 backend 目錄下執行：
+    python -m app.serve --workers 4 --host 0.0.0.0 --port 8000
+Linux 上也可以改用 gunicorn：gunicorn -c gunicorn.conf.py app.main:app
+"""
+import argparse
+import os
+
+
+def main(argv: list[str] | None = None):
+    # worker 行程 (spawn) 與本行程都從環境變數讀取設定：schema 由這裡更新一次，worker 不必各自檢查。
+    # 必須在匯入 app.settings 之前設定
+    os.environ["AUTO_MIGRATE"] = "false"
+
+    import uvicorn
+
+    from . import migrations
+    from .settings import HOST, PORT, WEB_CONCURRENCY
+
+    parser = argparse.ArgumentParser(description="以多個 uvicorn worker 啟動 API")
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY, help="worker 行程數 (預設 WEB_CONCURRENCY)")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--no-access-log", action="store_true", help="不輸出每個請求的存取紀錄")
+    parser.add_argument("--skip-migrate", action="store_true", help="不執行 migration (已另外執行過)")
+    args = parser.parse_args(argv)
+
+    # worker 依此判斷是否有其他行程需要接收快取失效通知
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    if not args.skip_migrate:
+        migrations.main()
+    uvicorn.run("app.main:app", host=args.host, port=args.port, workers=args.workers,
+                log_level=args.log_level, access_log=not args.no_access_log)
+
+
+if __name__ == "__main__":
+    main()
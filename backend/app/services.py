@@ -1,22 +1,54 @@
-import os
-from dotenv import load_dotenv
+import hashlib
+import json
+import logging
+import threading
+from datetime import date
+from typing import Iterator
 from sqlalchemy.orm import Session
-import google.generativeai as genai
-from . import models_db, schemas
+from . import crud, feedback_cache, models_db, schemas, tdee, user_cache
+from .llm_client import CircuitBreaker, LLMClient, LLMUnavailableError
+from .settings import (
+    FAKE_LLM_FAILURE_MODE, FAKE_LLM_FAILURE_RATE, FAKE_LLM_LATENCY_MS, FAKE_LLM_STREAM_CHUNK_MS,
+    GEMINI_API_KEY, GEMINI_MODEL, LLM_BACKEND,
+)
 
-# 載入 .env 檔案中的環境變數
-# 確保 .env 檔案位於 backend 資料夾下
-dotenv_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env')
-load_dotenv(dotenv_path=dotenv_path)
+logger = logging.getLogger(__name__)
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# 所有 LLM 呼叫都經由 llm_client：速率限制、併發上限、逾時、重試與斷路器。
+# 第一次呼叫時才建立 (google.generativeai 載入很慢，不在匯入時設定 SDK 或建立模型)
+_llm: LLMClient | None = None
+_llm_lock = threading.Lock()
+
+
+def _create_model():
+    if LLM_BACKEND == "fake":
+        from .llm_fake import FakeGeminiModel
+        return FakeGeminiModel(latency_ms=FAKE_LLM_LATENCY_MS, failure_rate=FAKE_LLM_FAILURE_RATE,
+                               failure_mode=FAKE_LLM_FAILURE_MODE, stream_chunk_ms=FAKE_LLM_STREAM_CHUNK_MS)
+    import google.generativeai as genai
 
-if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
-    gemini_model = genai.GenerativeModel('gemini-1.5-flash-latest') # 或者選擇其他適合的模型
-else:
-    print("警告：GEMINI_API_KEY 未設定。LLM 功能將無法使用。")
-    gemini_model = None
+    return genai.GenerativeModel(GEMINI_MODEL)
+
+def get_llm() -> LLMClient:
+    """LLM client (第一次呼叫時建立)；LLM 未配置時拋出 LLMUnavailableError"""
+    global _llm
+    if _llm is None:
+        if not llm_available():
+            raise LLMUnavailableError("LLM 服務未配置或 API 金鑰遺失")
+        with _llm_lock:
+            if _llm is None:
+                _llm = LLMClient(_create_model())
+                logger.info("LLM client initialized (backend=%s)", LLM_BACKEND)
+    return _llm
+
+def llm_available() -> bool:
+    """是否有可用的 LLM 後端 (真實 Gemini 需要 API 金鑰，假後端則永遠可用)"""
+    return LLM_BACKEND == "fake" or bool(GEMINI_API_KEY)
+
+def llm_circuit_open() -> bool:
+    """上游持續失敗、斷路器打開中 (此時不排入新工作，直接回報暫時無法使用)；尚未建立 client 時不會觸發建立"""
+    return _llm is not None and _llm.breaker.state == CircuitBreaker.OPEN
 
 
 def calculate_bmr(user: models_db.User) -> float:
@@ -44,8 +76,9 @@ def calculate_recommended_calories(bmr: float, goal: models_db.GoalEnum, activit
     這裡我們先用一個固定的 activity_level (例如 1.2 代表久坐) 來計算 TDEE (Total Daily Energy Expenditure)
     TDEE = BMR * activity_level
     """
-    tdee = bmr * activity_level # 假設輕度活動或久坐
+    return recommended_calories_for_tdee(bmr * activity_level, goal)
 
+def recommended_calories_for_tdee(tdee: float, goal: models_db.GoalEnum) -> float:
     if goal == models_db.GoalEnum.lose_fat:
         # 建議每日赤字 300-500 kcal
         return round(tdee - 500, 2)
@@ -57,74 +90,343 @@ def calculate_recommended_calories(bmr: float, goal: models_db.GoalEnum, activit
     else:
         return round(tdee, 2) # 預設為維持
 
-def ensure_llm_feedback(db: Session, record: models_db.DailyRecord, summary: schemas.DailySummary):
-    """若該日紀錄還沒有 llm_feedback，就呼叫 LLM，並存回 DB"""
-    if record.llm_feedback:
+# 採用擬合值時 TDEE 取整到 10 kcal：估計本身沒有更高的精度，也避免每天的小幅變動讓所有建議過期
+TDEE_ROUND_KCAL = 10
+
+def resolve_tdee(user, bmr: float) -> tuple[float, float]:
+    """
+    回傳 (TDEE, 採用擬合值的權重)。擬合值 (tdee.py) 依可信度與公式值 (BMR × 1.2) 加權，
+    並限制在 BMR ～ 2.5 倍 BMR 之間 (擋下紀錄不完整造成的離譜結果)；沒有擬合值時即為公式值。
+    user 可以是 ORM 物件或任何帶 tdee_estimate / tdee_confidence 欄位的列。
+    """
+    formula = bmr * 1.2
+    estimate, confidence = getattr(user, "tdee_estimate", None), getattr(user, "tdee_confidence", None) or 0.0
+    if estimate is None or confidence <= 0:
+        return formula, 0.0
+    fitted = min(max(estimate, bmr), bmr * 2.5)
+    blended = confidence * fitted + (1 - confidence) * formula
+    return round(blended / TDEE_ROUND_KCAL) * TDEE_ROUND_KCAL, confidence
+
+def daily_targets(user) -> tuple[float, float, float]:
+    """(BMR, TDEE, 建議每日熱量)"""
+    bmr = calculate_bmr(user)
+    tdee, _ = resolve_tdee(user, bmr)
+    return bmr, tdee, recommended_calories_for_tdee(tdee, user.goal)
+
+def build_user_profile(user: models_db.User) -> schemas.UserProfile:
+    """使用者資料與 BMR / TDEE / 建議熱量 (TDEE 有擬合值時採用加權後的值，否則為 BMR × 1.2)"""
+    bmr = calculate_bmr(user)
+    tdee, confidence = resolve_tdee(user, bmr)
+    return schemas.UserProfile(
+        user=schemas.User.model_validate(user),
+        bmr=bmr,
+        tdee=round(tdee, 2),
+        tdee_source="estimated" if confidence > 0 else "formula",
+        tdee_confidence=confidence,
+        recommended_daily_calories=recommended_calories_for_tdee(tdee, user.goal),
+    )
+
+def get_user_profile(db: Session, user_id: int) -> schemas.UserProfile | None:
+    """經由使用者快取取得資料 (crud.update_user 會使其失效)；使用者不存在時回傳 None"""
+    def load():
+        user = crud.get_user(db, user_id)
+        return build_user_profile(user) if user is not None else None
+    return user_cache.get_or_load(user_id, load)
+
+def describe_tdee(db: Session, user: models_db.User) -> schemas.TDEEEstimate:
+    """目前採用的 TDEE，以及擬合視窗內的攝取與體重變化 (只讀取視窗內的資料)"""
+    bmr, tdee_value, recommended = daily_targets(user)
+    _, confidence = resolve_tdee(user, bmr)
+    result = schemas.TDEEEstimate(
+        user_id=user.id, bmr=bmr, formula_tdee=round(bmr * 1.2, 2), tdee=round(tdee_value, 2),
+        tdee_source="estimated" if confidence > 0 else "formula", tdee_confidence=confidence,
+        estimated_tdee=user.tdee_estimate, recommended_daily_calories=recommended,
+    )
+    if user.tdee_window_end is None:
+        return result
+    fitted = tdee.window_fit(db, user.id, user.tdee_window_end)
+    result.window_start = tdee.window_start(user.tdee_window_end)
+    result.window_end = user.tdee_window_end
+    result.intake_days = int(fitted.intake_days[0])
+    result.weight_days = int(fitted.weight_days[0])
+    if result.intake_days:
+        result.avg_net_intake = round(float(fitted.avg_net_intake[0]), 1)
+    if result.weight_days >= 2:
+        result.weight_change_kg_per_week = round(float(fitted.weight_slope[0]) * 7, 2)
+    return result
+
+def get_tdee_estimate(db: Session, user_id: int) -> schemas.TDEEEstimate | None:
+    user = crud.get_user(db, user_id)
+    return describe_tdee(db, user) if user is not None else None
+
+def build_daily_summary(user: models_db.User, record: models_db.DailyRecord) -> schemas.DailySummary:
+    """計算 BMR、建議熱量與熱量差，組成每日總結 (不含 LLM 建議)"""
+    # 1. 計算 BMR 與建議每日熱量攝取 (TDEE 取擬合值與公式值的加權，見 resolve_tdee)
+    bmr, _, recommended_calories = daily_targets(user)
+
+    # 2. 計算熱量差
+    # 熱量差 = 當日攝取總熱量 - 建議每日熱量攝取
+    # (更精確的可能是 攝取 - (TDEE - 目標調整值 + 運動消耗))
+    # 這裡簡化為：攝取 - 建議攝取 (建議攝取已包含目標調整)
+    calorie_balance = record.calories_consumed - recommended_calories + (record.calories_burned_exercise or 0)
+
+    return schemas.DailySummary(
+        date=record.record_date,
+        user_info=schemas.User.model_validate(user),
+        daily_record=schemas.DailyRecord.model_validate(record),
+        bmr=bmr,
+        recommended_daily_calories=recommended_calories,
+        calorie_balance=calorie_balance,
+        llm_feedback=None # 先初始化
+    )
+
+def feedback_inputs(summary: schemas.DailySummary) -> dict:
+    """
+    取出產生 LLM 建議所需的全部輸入，並做輕度量化 (熱量取整數 kcal、營養素取整數 g、身高體重取 0.1)，
+    讓幾乎相同的日子共用同一份建議。提示詞只由這些值組成，因此雜湊相同即代表提示詞相同。
+    """
+    return _feedback_inputs(summary.user_info, summary.daily_record, summary.bmr,
+                            summary.recommended_daily_calories, summary.calorie_balance)
+
+def _feedback_inputs(user, record, bmr: float, recommended_calories: float, calorie_balance: float) -> dict:
+    # user / record 可以是 ORM 物件或 Pydantic schema，兩者欄位相同
+    return {
+        "age": user.age,
+        "gender": user.gender.value,
+        "height_cm": round(user.height_cm, 1),
+        "weight_kg": round(user.weight_kg, 1),
+        "goal": user.goal.value,
+        "bmr": round(bmr),
+        "recommended_daily_calories": round(recommended_calories),
+        "calories_consumed": record.calories_consumed,
+        "protein_g": round(record.protein_g),
+        "fat_g": round(record.fat_g),
+        "carbs_g": round(record.carbs_g),
+        "calories_burned_exercise": record.calories_burned_exercise or 0,
+        "calorie_balance": round(calorie_balance),
+    }
+
+def record_feedback_inputs(user, record, bmr: float, recommended_calories: float) -> dict:
+    """不組 DailySummary，直接由使用者與紀錄欄位計算提示輸入 (批次產生時使用)"""
+    calorie_balance = record.calories_consumed - recommended_calories + (record.calories_burned_exercise or 0)
+    return _feedback_inputs(user, record, bmr, recommended_calories, calorie_balance)
+
+def inputs_key(inputs: dict) -> str:
+    payload = json.dumps(inputs, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def feedback_cache_key(summary: schemas.DailySummary) -> str:
+    """提示輸入的 SHA-256 雜湊，作為建議快取與過期判斷的鍵"""
+    return inputs_key(feedback_inputs(summary))
+
+def build_summary_range(db: Session, profile: schemas.UserProfile, records: list[models_db.DailyRecord],
+                        start: date, end: date) -> schemas.DailySummaryRange:
+    """
+    一次計算多天的總結：BMR 與建議熱量取自使用者快取，熱量差對整段期間一次算完。
+    缺少或過期的建議先以共用快取批次補上，其餘一次排入背景工作 (不在請求中呼叫 LLM)。
+    """
+    user = profile.user
+    bmr = profile.bmr
+    recommended_calories = profile.recommended_daily_calories
+    balances = [r.calories_consumed - recommended_calories + (r.calories_burned_exercise or 0) for r in records]
+    keys = [inputs_key(_feedback_inputs(user, r, bmr, recommended_calories, b)) for r, b in zip(records, balances)]
+
+    points = [
+        schemas.DailySummaryPoint(
+            date=r.record_date,
+            record_id=r.id,
+            calories_consumed=r.calories_consumed,
+            protein_g=r.protein_g,
+            fat_g=r.fat_g,
+            carbs_g=r.carbs_g,
+            calories_burned_exercise=r.calories_burned_exercise or 0,
+            calorie_balance=round(b, 2),
+        )
+        for r, b in zip(records, balances)
+    ]
+
+    result = schemas.DailySummaryRange(
+        user_id=user.id, start=start, end=end, bmr=bmr,
+        recommended_daily_calories=recommended_calories, days=points,
+    )
+
+    stale = [(r, k, p) for r, k, p in zip(records, keys, points) if not (r.llm_feedback and r.llm_feedback_key == k)]
+    if not stale:
+        return result
+
+    cached = feedback_cache.lookup_many(db, [k for _, k, _ in stale])
+    can_generate = llm_available() and not llm_circuit_open()
+    missing = []
+    for r, k, p in stale:
+        if k in cached:
+            r.llm_feedback = cached[k]
+            r.llm_feedback_key = k
+        elif can_generate:
+            missing.append((r, k, p))
+        else:
+            p.llm_feedback_status = "unavailable"
+    if any(k in cached for _, k, _ in stale):
+        crud.bump_data_version(db, user.id)
+
+    if missing:
+        from . import jobs  # 避免循環匯入：jobs 會反過來使用 services
+        job_ids = jobs.enqueue_feedback_jobs(db, [r for r, _, _ in missing])  # 會一併提交上面寫回的快取建議
+        # 沒拿到 job 的紀錄：擋下插入的工作剛結束，成功時建議已在共用快取中
+        finished = feedback_cache.lookup_many(db, [k for _, k, p in missing if p.record_id not in job_ids])
+        for r, k, p in missing:
+            p.llm_job_id = job_ids.get(p.record_id)
+            if p.llm_job_id is not None:
+                p.llm_feedback_status = "pending"
+            else:
+                p.llm_feedback_status = "ready" if k in finished else "failed"
+    else:
+        db.commit()
+    return result
+
+def _apply_existing_feedback(db: Session, record: models_db.DailyRecord, summary: schemas.DailySummary, key: str) -> bool:
+    """
+    紀錄上的建議仍對應目前輸入就直接帶回；否則查共用快取，命中就寫回紀錄。
+    LLM 無法使用時填入提示訊息。回傳 True 代表不需要再呼叫 LLM。
+    """
+    if record.llm_feedback and record.llm_feedback_key == key:
         summary.llm_feedback = record.llm_feedback
-        return summary     # 已有建議，直接回
+        summary.llm_feedback_status = "ready"
+        return True     # 已有建議且未過期，直接回
+
+    cached = feedback_cache.lookup(db, key)
+    if cached is not None:
+        record.llm_feedback = cached
+        record.llm_feedback_key = key
+        crud.bump_data_version(db, record.user_id)
+        db.commit()
+        summary.llm_feedback = cached
+        summary.llm_feedback_status = "ready"
+        return True
 
-    if not (GEMINI_API_KEY and gemini_model):
+    if not llm_available():
         summary.llm_feedback = "LLM 服務未配置或 API 金鑰遺失。"
+        summary.llm_feedback_status = "unavailable"
+        return True
+    if llm_circuit_open():
+        summary.llm_feedback = "AI 建議服務暫時無法使用，請稍後再試。"
+        summary.llm_feedback_status = "unavailable"
+        return True
+    return False
+
+def ensure_llm_feedback(db: Session, record: models_db.DailyRecord, summary: schemas.DailySummary):
+    """
+    若該日紀錄的 llm_feedback 仍對應目前的輸入就直接帶回；
+    否則先查共用快取，命中就寫回紀錄 (不需呼叫 LLM)；
+    都沒有時排入背景工作，回傳 pending 狀態與 job id，由前端輪詢 /jobs/{job_id}/ 取得結果。
+    """
+    if _apply_existing_feedback(db, record, summary, feedback_cache_key(summary)):
         return summary
 
-    feedback = get_llm_feedback(summary)  # 呼叫大模型
-    record.llm_feedback = feedback        # 寫回 DB
-    db.commit()
-    summary.llm_feedback = feedback
+    from . import jobs  # 避免循環匯入：jobs 會反過來使用 services
+    summary.llm_job_id = jobs.enqueue_feedback_job(db, record)
+    if summary.llm_job_id is not None:
+        summary.llm_feedback_status = "pending"
+    elif not _apply_existing_feedback(db, record, summary, feedback_cache_key(summary)):
+        # 擋下插入的工作在這之間結束卻沒有留下建議：該次產生失敗
+        summary.llm_feedback_status = "failed"
     return summary
 
-
-def get_llm_feedback(daily_summary_data: schemas.DailySummary) -> str:
+def prepare_feedback_stream(db: Session, record: models_db.DailyRecord, summary: schemas.DailySummary) -> str | None:
     """
-    將資料傳送給 LLM API (Gemini)，產生評分與建議語句
+    串流端點用：建議已備妥 (或無法產生) 時填好 summary 並回傳 None；
+    需要呼叫 LLM 時把狀態設為 streaming，回傳之後寫入快取用的輸入雜湊。
     """
-    if not gemini_model:
-        return "LLM 服務未配置，無法提供建議。"
-    if not GEMINI_API_KEY:
-        return "GEMINI_API_KEY 未設定，無法呼叫 LLM。"
+    key = feedback_cache_key(summary)
+    if _apply_existing_feedback(db, record, summary, key):
+        return None
+    summary.llm_feedback_status = "streaming"
+    return key
 
-    user = daily_summary_data.user_info
-    record = daily_summary_data.daily_record
-    
-    prompt = f"""
-    這是一位使用者 {user.age} 歲 {user.gender.value} 的健康數據。
-    身高: {user.height_cm} cm, 體重: {user.weight_kg} kg.
-    他的目標是: {user.goal.value}.
-    他的基礎代謝率 (BMR) 是: {daily_summary_data.bmr:.2f} kcal.
-    系統建議他每日攝取熱量為: {daily_summary_data.recommended_daily_calories:.2f} kcal.
-
-    在 {record.record_date} 這一天，他的飲食和運動記錄如下:
-    攝取總熱量: {record.calories_consumed} kcal
-    蛋白質: {record.protein_g} g
-    脂肪: {record.fat_g} g
-    碳水化合物: {record.carbs_g} g
-    額外運動消耗: {record.calories_burned_exercise} kcal
-    計算出的熱量差 (攝取 - (BMR*活動因子 + 運動消耗) - 建議熱量調整): {daily_summary_data.calorie_balance:.2f} kcal.
+def save_llm_feedback(db: Session, record_id: int, user_id: int, key: str, feedback: str):
+    """串流完成後寫入共用快取與紀錄，並遞增使用者資料版本 (同一交易)"""
+    feedback_cache.store(db, key, feedback)
+    db.query(models_db.DailyRecord).filter(models_db.DailyRecord.id == record_id).update(
+        {"llm_feedback": feedback, "llm_feedback_key": key}, synchronize_session=False
+    )
+    crud.bump_data_version(db, user_id)
+    db.commit()
+
+
+def build_feedback_prompt(inputs: dict) -> str:
+    """由 feedback_inputs() 的結果組出提示詞 (不含日期與使用者識別，確保可跨日、跨使用者共用)"""
+    return f"""
+    這是一位使用者 {inputs["age"]} 歲 {inputs["gender"]} 的健康數據。
+    身高: {inputs["height_cm"]} cm, 體重: {inputs["weight_kg"]} kg.
+    他的目標是: {inputs["goal"]}.
+    他的基礎代謝率 (BMR) 是: {inputs["bmr"]} kcal.
+    系統建議他每日攝取熱量為: {inputs["recommended_daily_calories"]} kcal.
+
+    今天，他的飲食和運動記錄如下:
+    攝取總熱量: {inputs["calories_consumed"]} kcal
+    蛋白質: {inputs["protein_g"]} g
+    脂肪: {inputs["fat_g"]} g
+    碳水化合物: {inputs["carbs_g"]} g
+    額外運動消耗: {inputs["calories_burned_exercise"]} kcal
+    計算出的熱量差 (攝取 - (BMR*活動因子 + 運動消耗) - 建議熱量調整): {inputs["calorie_balance"]} kcal.
     (熱量差的計算方式為：當日攝取總熱量 - 建議每日熱量攝取。正數代表盈餘，負數代表赤字。)
 
     請根據以上數據，提供今天的飲食和運動評分 (1-10分)，並給予具體的營養建議和鼓勵。
     請著重於以下幾點：
     1. 熱量攝取是否符合目標？
     2. 三大營養素的比例是否均衡？（可以給出大致的建議比例，例如蛋白質佔總熱量20-30%等）
-    3. 針對他的目標 ({user.goal.value})，今天的表現如何？
+    3. 針對他的目標 ({inputs["goal"]})，今天的表現如何？
     4. 提供1-2個具體的改進建議或鼓勵的話。
 
     請以友善、鼓勵的語氣回覆，並將回覆內容控制在150字以內。
     """
 
-    try:
-        response = gemini_model.generate_content(prompt)
-        # 檢查 response.parts 是否存在以及是否有內容
-        if response.parts:
-            return response.text.replace("\n", "<br>")
-        elif response.candidates and response.candidates[0].content.parts: # 有些 API 版本差異
-             return "".join(part.text for part in response.candidates[0].content.parts)
-        else:
-            # 嘗試獲取錯誤訊息
-            error_message = "LLM API 回應格式不符預期或無有效內容。"
-            if hasattr(response, 'prompt_feedback') and response.prompt_feedback:
-                error_message += f" Prompt Feedback: {response.prompt_feedback}"
-            return error_message
-    except Exception as e:
-        print(f"呼叫 Gemini API 時發生錯誤: {e}")
-        return f"無法從 LLM 獲取建議: {str(e)}"
+
+# 批次提示中每一項的欄位說明 (鍵名與 feedback_inputs() 相同)
+BATCH_FIELD_NOTES = """
+    age: 年齡；gender: 性別；height_cm / weight_kg: 身高 (cm) / 體重 (kg)；goal: 目標 (lose_fat 減脂、maintain 維持、gain_muscle 增肌)
+    bmr: 基礎代謝率 (kcal)；recommended_daily_calories: 系統建議每日攝取熱量 (kcal)
+    calories_consumed: 攝取總熱量 (kcal)；protein_g / fat_g / carbs_g: 蛋白質 / 脂肪 / 碳水化合物 (g)
+    calories_burned_exercise: 額外運動消耗 (kcal)
+    calorie_balance: 熱量差 = 當日攝取總熱量 - 建議每日熱量攝取 + 運動消耗 (正數代表盈餘，負數代表赤字)
+"""
+
+def build_batch_feedback_prompt(items: dict[str, dict]) -> str:
+    """
+    多筆 (跨使用者、跨日) 的建議合併成一次請求：共用的指示只送一次，資料以 JSON 陣列附上，
+    要求模型回傳可逐項解析的 JSON。items: {項目 id: feedback_inputs() 的結果}
+    """
+    data = json.dumps([{"id": item_id, **inputs} for item_id, inputs in items.items()], ensure_ascii=False)
+    return f"""
+    以下 JSON 陣列中的每一項，是一位使用者某一天的健康數據與飲食、運動記錄。欄位說明：
+    {BATCH_FIELD_NOTES}
+    請針對每一項分別提供當天的飲食和運動評分 (1-10分)，並給予具體的營養建議和鼓勵。
+    請著重於以下幾點：
+    1. 熱量攝取是否符合目標？
+    2. 三大營養素的比例是否均衡？（可以給出大致的建議比例，例如蛋白質佔總熱量20-30%等）
+    3. 針對他的目標，今天的表現如何？
+    4. 提供1-2個具體的改進建議或鼓勵的話。
+    每一項都以友善、鼓勵的語氣回覆，並將內容控制在150字以內。
+
+    只回傳一個 JSON 陣列，每一項的格式為 {{"id": "<對應的 id>", "feedback": "<建議內容>"}}，
+    每個 id 恰好出現一次，不要加上其他文字。
+
+    資料：
+    {data}
+    """
+
+def get_llm_feedback(daily_summary_data: schemas.DailySummary) -> str:
+    """
+    將資料傳送給 LLM API (Gemini)，產生評分與建議語句。
+    失敗時拋出 llm_client.LLMError，呼叫端不可把錯誤當成建議內容寫入紀錄或快取。
+    """
+    prompt = build_feedback_prompt(feedback_inputs(daily_summary_data))
+    return get_llm().generate(prompt).replace("\n", "<br>")
+
+def stream_llm_feedback(daily_summary_data: schemas.DailySummary) -> Iterator[str]:
+    """
+    與 get_llm_feedback 相同，但以串流 API 逐段產生 (換行同樣轉成 <br>)。
+    中途失敗拋出 llm_client.LLMError，已送出的片段不可保存。
+    """
+    prompt = build_feedback_prompt(feedback_inputs(daily_summary_data))
+    for text in get_llm().generate_stream(prompt):
+        yield text.replace("\n", "<br>")
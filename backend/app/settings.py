@@ -0,0 +1,115 @@
+"""
+所有由環境變數讀取的設定。backend/.env 只在這裡載入一次 (不覆寫已存在的環境變數)，
+其他模組一律由這裡匯入設定值，不自行呼叫 load_dotenv / os.getenv。
+"""
+import os
+
+from dotenv import load_dotenv
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+load_dotenv(dotenv_path=os.path.join(BACKEND_DIR, ".env"))
+
+
+def _bool(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+def _resolve_sqlite_path(url: str) -> str:
+    """相對路徑的 SQLite 檔案以 backend 目錄為基準，不受啟動時的工作目錄影響 (每個 worker 都開到同一個檔案)"""
+    scheme, sep, rest = url.partition(":///")
+    if not sep or scheme.split("+", 1)[0] != "sqlite":
+        return url
+    path, query_sep, query = rest.partition("?")
+    if not path or path.startswith(":memory:") or os.path.isabs(path):
+        return url
+    return f"{scheme}:///{os.path.normpath(os.path.join(BACKEND_DIR, path))}{query_sep}{query}"
+
+
+# --- 資料庫 ---
+DATABASE_URL = _resolve_sqlite_path(os.getenv("DATABASE_URL", "sqlite:///./health_app.db"))
+# 啟動時自動建立資料表並補上缺少的欄位／索引；關閉時須先另外執行 python -m app.migrations
+AUTO_MIGRATE = _bool("AUTO_MIGRATE", "true")
+# 非同步模式：API 端點改用 AsyncSession (aiosqlite / asyncpg)，DB I/O 不再佔用 threadpool
+DB_ASYNC_MODE = _bool("DB_ASYNC_MODE", "false")
+
+# 連線池設定 (SQLite 與 PostgreSQL 皆適用)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# 以下兩項只用於 PostgreSQL 等網路資料庫：定期換掉舊連線、借出前先確認連線還活著
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = _bool("DB_POOL_PRE_PING", "true")
+
+# SQLite 調校 (每條新連線都會套用)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# --- 部署 (python -m app.serve / gunicorn.conf.py) ---
+HOST = os.getenv("HOST", "127.0.0.1")
+PORT = int(os.getenv("PORT", "8000"))
+# worker 行程數 (與 gunicorn 慣用的環境變數同名)；大於 1 時才發送／接收跨行程的快取失效通知
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# 多 worker 共用的租約、快取失效通知與 LLM 工作佇列："database" (預設，使用 DATABASE_URL) 或 "redis"
+COORDINATION_BACKEND = os.getenv("COORDINATION_BACKEND", "database").lower()
+COORDINATION_REDIS_URL = os.getenv("COORDINATION_REDIS_URL", "redis://localhost:6379/0")
+# database 後端多久檢查一次其他行程發出的快取失效通知 (即跨 worker 讀到舊資料的上限)
+COORDINATION_POLL_SECONDS = float(os.getenv("COORDINATION_POLL_SECONDS", "1"))
+
+# 前端靜態檔目錄 (相對路徑以 backend 目錄為基準)，與帶內容雜湊 (?v=) 的靜態檔快取秒數
+STATIC_DIR = os.path.normpath(os.path.join(BACKEND_DIR, os.getenv("STATIC_DIR", "../frontend")))
+STATIC_MAX_AGE_SECONDS = int(os.getenv("STATIC_MAX_AGE_SECONDS", str(365 * 24 * 3600)))
+
+# --- LLM ---
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash-latest")
+# LLM 後端："gemini" (預設) 或 "fake" (測試／壓測用，不需 API 金鑰)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").lower()
+# fake 後端的延遲與失敗注入
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "0"))
+FAKE_LLM_FAILURE_RATE = float(os.getenv("FAKE_LLM_FAILURE_RATE", "0"))
+FAKE_LLM_FAILURE_MODE = os.getenv("FAKE_LLM_FAILURE_MODE", "unavailable")
+FAKE_LLM_STREAM_CHUNK_MS = float(os.getenv("FAKE_LLM_STREAM_CHUNK_MS", "0"))
+
+# 速率限制 (token bucket)：每分鐘可發出的請求數與可累積的突發量
+LLM_RATE_LIMIT_PER_MIN = float(os.getenv("LLM_RATE_LIMIT_PER_MIN", "60"))
+LLM_RATE_BURST = int(os.getenv("LLM_RATE_BURST", "5"))
+# 同時進行中的 LLM 呼叫上限 (跨所有 worker 執行緒)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+# 單次呼叫逾時，以及等待速率／併發配額的上限
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_ACQUIRE_TIMEOUT_SECONDS = float(os.getenv("LLM_ACQUIRE_TIMEOUT_SECONDS", "60"))
+# 重試：最多重試次數與 full-jitter 指數退避的基準／上限秒數
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+# 斷路器：連續失敗幾次後打開，打開後多久放一個試探請求
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+# 背景 worker 執行緒數量 (同時進行中的 LLM 呼叫上限)
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "4"))
+# single-flight 租約存活秒數：持有者產生期間每 TTL/3 秒續約；持有者當機時，其他 worker 最多等這麼久就能接手
+LLM_LEASE_TTL_SECONDS = int(os.getenv("LLM_LEASE_TTL_SECONDS", "60"))
+# 建議快取存活時間與記憶體層最大筆數
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+# 批次產生建議：一次 LLM 請求包含的紀錄數與同時進行的請求數
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "10"))
+LLM_BATCH_PARALLELISM = int(os.getenv("LLM_BATCH_PARALLELISM", "4"))
+
+# --- 使用者資料快取 (BMR / TDEE / 建議熱量) ---
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "4096"))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "300"))
+# 設定後改用 Redis 共用快取，多個 uvicorn worker 看到同一份資料與同一次失效；
+# 未設定時每個 worker 各自快取，其他 worker 最多在 TTL 內看到舊資料
+USER_CACHE_REDIS_URL = os.getenv("USER_CACHE_REDIS_URL")
+
+# --- 食物資料與 TDEE 擬合 ---
+# 內建食物營養資料 (每 100 g)；可指向其他同格式的 CSV
+FOODS_DATASET = os.getenv("FOODS_DATASET", os.path.join(BACKEND_DIR, "app", "data", "foods.csv"))
+# 擬合視窗天數、體重迴歸權重的半衰期
+TDEE_WINDOW_DAYS = int(os.getenv("TDEE_WINDOW_DAYS", "28"))
+TDEE_HALF_LIFE_DAYS = float(os.getenv("TDEE_HALF_LIFE_DAYS", "14"))
+# 視窗內至少要有幾天攝取紀錄、第一筆到最後一筆體重至少相隔幾天，才採用擬合值
+TDEE_MIN_INTAKE_DAYS = int(os.getenv("TDEE_MIN_INTAKE_DAYS", "10"))
+TDEE_MIN_WEIGHT_SPAN_DAYS = int(os.getenv("TDEE_MIN_WEIGHT_SPAN_DAYS", "7"))
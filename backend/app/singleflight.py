@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Hashable
+
+from . import coordination
+from .settings import LLM_LEASE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# 等待其他行程結果時的輪詢間隔
+LEASE_POLL_INTERVAL = 0.2
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """同一行程內的 single-flight：相同 key 的並行呼叫只執行一次，其餘執行緒等待並共用結果"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+_local = SingleFlight()
+
+def _keep_alive(leases, key: str, done: threading.Event):
+    """
+    持有租約期間每 TTL/3 秒續約一次：一次產生 (含逾時重試與退避) 可能超過 TTL，
+    租約中途過期會讓其他行程接手並重複呼叫 LLM。持有者當機時不再續約，租約照常在 TTL 後過期。
+    """
+    while not done.wait(LLM_LEASE_TTL_SECONDS / 3):
+        try:
+            if not leases.renew_lease(key, coordination.OWNER, LLM_LEASE_TTL_SECONDS):
+                logger.warning("Lease %s expired before it could be renewed", key)
+                return
+        except Exception:
+            logger.warning("Failed to renew lease %s", key, exc_info=True)
+
+def _release(leases, key: str):
+    """結果已寫入共用快取，釋放失敗 (例如 Redis 連線中斷) 不影響這次的結果，租約在 TTL 後自動過期"""
+    try:
+        leases.release_lease(key, coordination.OWNER)
+    except Exception:
+        logger.warning("Failed to release lease %s; it expires in %ss", key, LLM_LEASE_TTL_SECONDS, exc_info=True)
+
+def do(key: str, fn: Callable[[], Any], check: Callable[[], Any]) -> Any:
+    """
+    對 key 做跨執行緒、跨行程的 single-flight。
+    fn: 實際工作 (例如呼叫 LLM 並寫入共用快取)
+    check: 查詢其他行程是否已產生結果 (例如查共用快取)，尚未產生時回傳 None
+    同行程的並行呼叫共用一次執行；其他行程持有租約 (coordination 後端) 時輪詢 check，
+    直到拿到結果或租約過期後接手。持有者在執行 fn 期間會持續續約。
+    """
+    def leader():
+        leases = coordination.backend()
+        while True:
+            if leases.acquire_lease(key, coordination.OWNER, LLM_LEASE_TTL_SECONDS):
+                done = threading.Event()
+                threading.Thread(target=_keep_alive, args=(leases, key, done),
+                                 name="coordination-lease-renewal", daemon=True).start()
+                try:
+                    # 前一個持有者可能剛完成並釋放租約，拿到租約後先確認一次
+                    result = check()
+                    return result if result is not None else fn()
+                finally:
+                    done.set()
+                    _release(leases, key)
+            result = check()
+            if result is not None:
+                return result
+            time.sleep(LEASE_POLL_INTERVAL)
+
+    return _local.do(key, leader)
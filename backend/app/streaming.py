@@ -0,0 +1,167 @@
+"""
+每日總結的 SSE 串流。同一天的建議 (與背景工作相同的 single-flight 鍵) 只由一個 producer 執行緒呼叫 LLM，
+片段廣播給所有連線中的用戶端 (中途加入的先補上已產生的片段)；其他行程已持有租約時等待其結果。
+建議在 producer 中寫入紀錄與共用快取，用戶端中斷連線只是停止接收，不會取消產生。
+"""
+import asyncio
+import json
+import logging
+import threading
+from typing import AsyncIterator
+
+from . import crud, http_cache, jobs, schemas, services, singleflight
+from .database import SessionLocal
+from .llm_client import LLMError
+
+logger = logging.getLogger(__name__)
+
+# SSE 回應標頭：不可快取，並關閉反向代理 (nginx) 的緩衝，讓片段即時送達
+SSE_HEADERS = {"Cache-Control": "no-store", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event: str, data) -> str:
+    """依 text/event-stream 格式編碼一個事件 (data 為 JSON)"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class _Broadcast:
+    """一次建議產生的片段：producer 執行緒寫入，任意數量的 SSE 連線 (各自的 event loop) 讀取"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._parts: list[str] = []
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+        self.finished = False
+        self.feedback: str | None = None
+        self.etag: str | None = None
+        self.error: str | None = None
+
+    def _update(self, part: str | None = None, **fields):
+        with self._lock:
+            if part is not None:
+                self._parts.append(part)
+            for name, value in fields.items():
+                setattr(self, name, value)
+            waiters, self._waiters = self._waiters, []
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # 該連線的 event loop 已關閉
+
+    def publish(self, part: str):
+        self._update(part)
+
+    def finish(self, feedback: str, etag: str):
+        self._update(feedback=feedback, etag=etag, finished=True)
+
+    def fail(self, error: str):
+        self._update(error=error, finished=True)
+
+    async def follow(self) -> AsyncIterator[str]:
+        """從頭依序產出片段，直到 finish / fail"""
+        loop = asyncio.get_running_loop()
+        sent = 0
+        while True:
+            event = asyncio.Event()
+            with self._lock:
+                parts = self._parts[sent:]
+                finished = self.finished
+                if not parts and not finished:
+                    self._waiters.append((loop, event))
+            for part in parts:
+                yield part
+            sent += len(parts)
+            if finished:
+                return
+            if not parts:
+                await event.wait()
+
+
+_flights: dict[str, _Broadcast] = {}
+_flights_lock = threading.Lock()
+
+
+def _save(summary: schemas.DailySummary, key: str, feedback: str):
+    db = SessionLocal()
+    try:
+        services.save_llm_feedback(db, summary.daily_record.id, summary.user_info.id, key, feedback)
+    finally:
+        db.close()
+
+def _etag(user_id: int) -> str | None:
+    db = SessionLocal()
+    try:
+        user = crud.get_user(db, user_id)
+        return http_cache.Validators(user_id, user.data_version, user.data_updated_at).etag if user else None
+    finally:
+        db.close()
+
+def _produce(flight_key: str, broadcast: _Broadcast, summary: schemas.DailySummary, key: str):
+    """producer 執行緒：在 single-flight 租約內串流呼叫 LLM，並在釋放租約前寫入共用快取與紀錄"""
+    streamed = False
+
+    def generate() -> str:
+        nonlocal streamed
+        parts = []
+        for text in services.stream_llm_feedback(summary):
+            streamed = True
+            parts.append(text)
+            broadcast.publish(text)
+        feedback = "".join(parts)
+        _save(summary, key, feedback)
+        return feedback
+
+    try:
+        feedback = singleflight.do(flight_key, generate, check=lambda: jobs.lookup_cached(key))
+        if not streamed:
+            # 結果來自其他執行緒／行程 (背景工作或另一個串流)：整段送出並寫回這筆紀錄
+            broadcast.publish(feedback)
+            _save(summary, key, feedback)
+        # 回傳寫入後的 ETag，前端可把組好的總結存進快取，下次以 If-None-Match 驗證
+        broadcast.finish(feedback, _etag(summary.user_info.id))
+    except LLMError as e:
+        logger.warning("Streaming feedback for user %s on %s failed: %s", summary.user_info.id, summary.date, e)
+        broadcast.fail(str(e))
+    except Exception:
+        logger.exception("Streaming feedback for user %s on %s failed", summary.user_info.id, summary.date)
+        broadcast.fail("Internal error while generating feedback")
+    finally:
+        with _flights_lock:
+            if _flights.get(flight_key) is broadcast:
+                del _flights[flight_key]
+
+def _join(summary: schemas.DailySummary, key: str) -> _Broadcast:
+    """取得這天正在產生中的建議；沒有時啟動 producer"""
+    flight_key = jobs.feedback_flight_key(summary, key)
+    with _flights_lock:
+        broadcast = _flights.get(flight_key)
+        if broadcast is not None:
+            return broadcast
+        broadcast = _flights[flight_key] = _Broadcast()
+    threading.Thread(target=_produce, args=(flight_key, broadcast, summary, key),
+                     name="llm-stream", daemon=True).start()
+    return broadcast
+
+
+async def daily_summary_events(summary: schemas.DailySummary, key: str | None,
+                               etag: str | None = None) -> AsyncIterator[str]:
+    """
+    先送出數值總結 (summary 事件)，再逐段送出 LLM 建議 (feedback 事件)，最後以 done 事件收尾。
+    key 為 None 代表建議已備妥或無法產生，只送 summary 與 done (etag 為已備妥時的 ETag)。
+    LLM 中途失敗送出 error 事件 (不寫入任何內容)；用戶端中斷連線時 producer 照常完成並寫入。
+    """
+    yield sse_event("summary", summary.model_dump(mode="json"))
+    if key is None:
+        yield sse_event("done", {"llm_feedback": summary.llm_feedback,
+                                 "llm_feedback_status": summary.llm_feedback_status, "etag": etag})
+        return
+
+    broadcast = _join(summary, key)
+    async for text in broadcast.follow():
+        yield sse_event("feedback", {"text": text})
+    if broadcast.error is not None:
+        yield sse_event("error", {"detail": broadcast.error, "llm_feedback_status": "failed"})
+        return
+    yield sse_event("done", {"llm_feedback": broadcast.feedback, "llm_feedback_status": "ready",
+                             "etag": broadcast.etag})
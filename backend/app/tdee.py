@@ -0,0 +1,261 @@
+"""
+由每日攝取與體重紀錄擬合使用者實際的 TDEE (能量平衡)：
+
+    TDEE ≈ 平均淨攝取 (攝取 - 運動消耗) - 體重變化速度 (kg/天) × 7700 kcal/kg
+
+以最近 TDEE_WINDOW_DAYS 天 (以使用者最後一筆資料為終點) 為視窗，體重變化速度取自指數衰減加權的線性迴歸
+(越近的量測權重越高，同時平滑掉每日的水分波動)。擬合結果與可信度存在 users 上，
+讀取時與公式值 (BMR × 1.2) 依可信度加權 (見 services.resolve_tdee)，資料少時仍以公式為主。
+
+寫入紀錄時只重新擬合該使用者視窗內的資料 (refresh，與寫入在同一交易)，視窗外的舊資料不影響估計；
+全部使用者重新計算：
+
+    python -m app.tdee rebuild [--user-id 3] [--parallel 4]
+"""
+import argparse
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import TYPE_CHECKING, NamedTuple
+
+from sqlalchemy import bindparam, func, select, union, update
+from sqlalchemy.orm import Session
+
+from . import crud, models_db, user_cache
+from .settings import TDEE_HALF_LIFE_DAYS, TDEE_MIN_INTAKE_DAYS, TDEE_MIN_WEIGHT_SPAN_DAYS, TDEE_WINDOW_DAYS
+
+# NumPy 在第一次擬合時才載入 (crud 會匯入本模組，不讓每個 worker 啟動都付出載入成本)
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 批次重算時每個工作 (一個 session、一次向量化擬合) 處理的使用者數
+REBUILD_CHUNK_SIZE = 500
+# 1 kg 體重約對應的熱量
+KCAL_PER_KG = 7700.0
+
+
+class Fit(NamedTuple):
+    """fit() 的結果，每個欄位都是長度為使用者數的陣列"""
+    tdee: "np.ndarray"            # 擬合的 TDEE；資料不足時為 NaN
+    confidence: "np.ndarray"      # 0～1，資料不足時為 0
+    avg_net_intake: "np.ndarray"  # 有紀錄日的平均淨攝取；沒有紀錄時為 NaN
+    weight_slope: "np.ndarray"    # 體重變化 (kg/天)
+    intake_days: "np.ndarray"
+    weight_days: "np.ndarray"
+
+
+def fit(intake: "np.ndarray", weight: "np.ndarray") -> Fit:
+    """
+    intake / weight 為 (使用者數, 視窗天數) 的矩陣，第 0 欄是視窗第一天，缺資料的日子為 NaN。
+    所有使用者一次以陣列運算擬合 (單一使用者傳入一列即可)。
+    """
+    import numpy as np
+
+    intake = np.atleast_2d(np.asarray(intake, dtype=float))
+    weight = np.atleast_2d(np.asarray(weight, dtype=float))
+    days = intake.shape[1]
+    t = np.arange(days, dtype=float)
+
+    has_intake = ~np.isnan(intake)
+    intake_days = has_intake.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_net_intake = np.nansum(intake, axis=1) / intake_days
+
+    # 加權最小平方法求斜率：w 為指數衰減權重 (缺資料的日子為 0)
+    has_weight = ~np.isnan(weight)
+    weight_days = has_weight.sum(axis=1)
+    w = np.where(has_weight, 0.5 ** ((days - 1 - t) / TDEE_HALF_LIFE_DAYS), 0.0)
+    y = np.where(has_weight, weight, 0.0)
+    w_sum = np.maximum(w.sum(axis=1), 1e-12)
+    t_mean = (w * t).sum(axis=1) / w_sum
+    y_mean = (w * y).sum(axis=1) / w_sum
+    dt = t - t_mean[:, None]
+    sxx = (w * dt * dt).sum(axis=1)
+    sxy = (w * dt * (y - y_mean[:, None])).sum(axis=1)
+    slope = np.divide(sxy, sxx, out=np.zeros_like(sxy), where=sxx > 0)
+
+    first = has_weight.argmax(axis=1)
+    last = days - 1 - has_weight[:, ::-1].argmax(axis=1)
+    span = np.where(weight_days > 0, last - first, 0)
+
+    valid = (intake_days >= TDEE_MIN_INTAKE_DAYS) & (weight_days >= 2) & (span >= TDEE_MIN_WEIGHT_SPAN_DAYS)
+    tdee = np.where(valid, avg_net_intake - slope * KCAL_PER_KG, np.nan)
+    # 攝取紀錄越完整、體重量測涵蓋的期間越長，越相信擬合值
+    confidence = np.where(valid, np.minimum(intake_days / days, 1.0) * np.minimum(span / max(days - 1, 1), 1.0), 0.0)
+    return Fit(tdee, confidence, avg_net_intake, slope, intake_days, weight_days)
+
+
+def window_start(window_end: date) -> date:
+    return window_end - timedelta(days=TDEE_WINDOW_DAYS - 1)
+
+def _fill(matrix: "np.ndarray", row: int, start: date, day: date, value: float):
+    offset = (day - start).days
+    if 0 <= offset < matrix.shape[1]:
+        matrix[row, offset] = value
+
+def _stored(fitted: Fit, i: int) -> tuple[float | None, float | None]:
+    """寫入 users 的 (tdee_estimate, tdee_confidence)；資料不足時兩者皆為 None"""
+    if math.isnan(fitted.tdee[i]):
+        return None, None
+    return round(float(fitted.tdee[i]), 1), round(float(fitted.confidence[i]), 3)
+
+
+def _window_rows(db: Session, user_ids: list[int], start: date, end: date):
+    """期間內的 (user_id, 日期, 淨攝取) 與 (user_id, 日期, 體重)，皆走 (user_id, 日期) 索引"""
+    R, W = models_db.DailyRecord, models_db.WeightLog
+    intake = db.execute(
+        select(R.user_id, R.record_date, R.calories_consumed - func.coalesce(R.calories_burned_exercise, 0))
+        .where(R.user_id.in_(user_ids), R.record_date >= start, R.record_date <= end)
+    ).all()
+    weights = db.execute(
+        select(W.user_id, W.log_date, W.weight_kg)
+        .where(W.user_id.in_(user_ids), W.log_date >= start, W.log_date <= end)
+    ).all()
+    return intake, weights
+
+
+def window_fit(db: Session, user_id: int, window_end: date) -> Fit:
+    """單一使用者以 window_end 為終點的擬合 (只讀取視窗內的資料)"""
+    import numpy as np
+
+    start = window_start(window_end)
+    intake_rows, weight_rows = _window_rows(db, [user_id], start, window_end)
+    intake = np.full((1, TDEE_WINDOW_DAYS), np.nan)
+    weight = np.full((1, TDEE_WINDOW_DAYS), np.nan)
+    for _, day, value in intake_rows:
+        _fill(intake, 0, start, day, value)
+    for _, day, value in weight_rows:
+        _fill(weight, 0, start, day, value)
+    return fit(intake, weight)
+
+
+# --- 寫入時的增量更新 ---
+def refresh(db: Session, user_id: int, dates) -> bool:
+    """
+    每日紀錄或體重寫入後呼叫 (不 commit，與寫入在同一個交易)。
+    日期都在目前視窗之前時不影響估計，直接略過；否則把視窗終點推到最新日期，重新擬合視窗內的資料。
+    回傳估計值是否改變 (改變時呼叫端須在 commit 後使使用者快取失效)。
+    """
+    dates = list(dates)
+    if not dates:
+        return False
+    U = models_db.User
+    row = db.execute(select(U.tdee_estimate, U.tdee_confidence, U.tdee_window_end).where(U.id == user_id)).first()
+    if row is None:
+        return False
+    latest = max(dates)
+    if row.tdee_window_end is not None and latest < window_start(row.tdee_window_end):
+        return False
+    window_end = max(latest, row.tdee_window_end or latest)
+
+    estimate, confidence = _stored(window_fit(db, user_id, window_end), 0)
+    db.execute(update(U).where(U.id == user_id).values(
+        tdee_estimate=estimate, tdee_confidence=confidence, tdee_window_end=window_end))
+    return (estimate, confidence) != (row.tdee_estimate, row.tdee_confidence)
+
+
+# --- 批次重算 ---
+def _rebuild_chunk(bind, user_ids: list[int]) -> int:
+    """以獨立的 session 重算一批使用者 (一次向量化擬合、一次 executemany 寫回)，回傳估計改變的人數"""
+    import numpy as np
+
+    from .database import SessionLocal
+
+    U, R, W = models_db.User, models_db.DailyRecord, models_db.WeightLog
+    db = SessionLocal(bind=bind)
+    try:
+        latest = union(
+            select(R.user_id.label("user_id"), func.max(R.record_date).label("day"))
+            .where(R.user_id.in_(user_ids)).group_by(R.user_id),
+            select(W.user_id.label("user_id"), func.max(W.log_date).label("day"))
+            .where(W.user_id.in_(user_ids)).group_by(W.user_id),
+        ).subquery()
+        ends: dict[int, date] = {}
+        for uid, day in db.execute(select(latest.c.user_id, latest.c.day)):
+            ends[uid] = max(day, ends.get(uid, day))
+        if not ends:
+            return 0
+
+        uids = sorted(ends)
+        row_of = {uid: i for i, uid in enumerate(uids)}
+        starts = {uid: window_start(end) for uid, end in ends.items()}
+        intake = np.full((len(uids), TDEE_WINDOW_DAYS), np.nan)
+        weight = np.full((len(uids), TDEE_WINDOW_DAYS), np.nan)
+        intake_rows, weight_rows = _window_rows(db, uids, min(starts.values()), max(ends.values()))
+        for uid, day, value in intake_rows:
+            _fill(intake, row_of[uid], starts[uid], day, value)
+        for uid, day, value in weight_rows:
+            _fill(weight, row_of[uid], starts[uid], day, value)
+        fitted = fit(intake, weight)
+
+        previous = {r.id: (r.tdee_estimate, r.tdee_confidence)
+                    for r in db.execute(select(U.id, U.tdee_estimate, U.tdee_confidence).where(U.id.in_(uids)))}
+        params, changed = [], []
+        for uid in uids:
+            estimate, confidence = _stored(fitted, row_of[uid])
+            params.append({"uid": uid, "estimate": estimate, "confidence": confidence, "window_end": ends[uid]})
+            if (estimate, confidence) != previous.get(uid):
+                changed.append(uid)
+        table = U.__table__
+        db.execute(
+            update(table).where(table.c.id == bindparam("uid"))
+            .values(tdee_estimate=bindparam("estimate"), tdee_confidence=bindparam("confidence"),
+                    tdee_window_end=bindparam("window_end")),
+            params,
+        )
+        if changed:
+            # 建議熱量隨之改變，總結的 ETag 也要跟著變
+            crud.bump_data_version(db, changed)
+        db.commit()
+    finally:
+        db.close()
+    user_cache.invalidate_many(changed)
+    return len(changed)
+
+
+def rebuild(db: Session, user_id: int | None = None, parallel: int = 1, chunk_size: int = REBUILD_CHUNK_SIZE) -> dict:
+    """
+    重新擬合全部 (或單一) 有紀錄的使用者。使用者分批，每批由獨立的執行緒與 session 處理並各自提交，
+    NumPy 運算與 DB I/O 都會釋放 GIL，parallel > 1 時可以重疊進行。回傳統計。
+    """
+    R, W = models_db.DailyRecord, models_db.WeightLog
+    if user_id is not None:
+        user_ids = [user_id]
+    else:
+        user_ids = sorted(db.scalars(union(select(R.user_id), select(W.user_id))).all())
+    bind = db.get_bind()
+    db.commit()  # 結束讀取交易 (SQLite 下避免與各批次的寫入互相等待)
+    chunks = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), max(1, chunk_size))]
+    with ThreadPoolExecutor(max_workers=max(1, parallel), thread_name_prefix="tdee-rebuild") as pool:
+        changed = sum(pool.map(lambda chunk: _rebuild_chunk(bind, chunk), chunks))
+    return {"users": len(user_ids), "chunks": len(chunks), "changed": changed}
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="由攝取與體重紀錄重新擬合使用者的 TDEE")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cmd = sub.add_parser("rebuild", help="重新擬合全部使用者")
+    cmd.add_argument("--user-id", type=int, default=None, help="只重算指定使用者")
+    cmd.add_argument("--parallel", type=int, default=os.cpu_count() or 1, help="同時處理的批次數")
+    cmd.add_argument("--chunk-size", type=int, default=REBUILD_CHUNK_SIZE, help="每批的使用者數")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from .database import SessionLocal, engine
+    from . import migrations
+
+    migrations.upgrade(engine)
+    db = SessionLocal()
+    try:
+        stats = rebuild(db, user_id=args.user_id, parallel=args.parallel, chunk_size=args.chunk_size)
+    finally:
+        db.close()
+    print(f"Refitted {stats['users']} users in {stats['chunks']} chunks, {stats['changed']} estimates changed")
+
+
+if __name__ == "__main__":
+    main()
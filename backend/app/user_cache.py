@@ -0,0 +1,177 @@
+import logging
+import threading
+from typing import Callable
+
+from . import coordination, schemas
+from .cache import TTLCache
+from .database import run_blocking
+from .settings import USER_CACHE_MAX_ENTRIES, USER_CACHE_REDIS_URL, USER_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryStore:
+    """行程內 LRU + TTL；多 worker 時由 coordination 通知其他行程失效"""
+    name = "memory"
+    shared = False
+
+    def __init__(self, maxsize: int, ttl: int):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, user_id: int) -> schemas.UserProfile | None:
+        return self._cache.get(user_id)
+
+    def set(self, user_id: int, profile: schemas.UserProfile):
+        self._cache.set(user_id, profile)
+
+    def delete(self, user_id: int):
+        self._cache.delete(user_id)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._cache), "maxsize": self._cache.maxsize, "evictions": self._cache.evictions}
+
+
+class RedisStore:
+    """
+    Redis 共用快取 (JSON)；Redis 出錯時視為未命中，不影響請求。
+    呼叫經由 run_blocking，DB_ASYNC_MODE 下不在 event loop 上等待網路 I/O。
+    """
+    name = "redis"
+    shared = True
+
+    def __init__(self, url: str, ttl: int, prefix: str = "user_profile:"):
+        import redis  # 選用相依套件，只有設定 USER_CACHE_REDIS_URL 時才需要
+
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5)
+        self._errors = (redis.RedisError,)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.errors = 0
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}{user_id}"
+
+    def get(self, user_id: int) -> schemas.UserProfile | None:
+        try:
+            raw = run_blocking(self._client.get, self._key(user_id))
+        except self._errors as e:
+            self.errors += 1
+            logger.warning("User cache get failed: %s", e)
+            return None
+        return schemas.UserProfile.model_validate_json(raw) if raw else None
+
+    def set(self, user_id: int, profile: schemas.UserProfile):
+        try:
+            run_blocking(self._client.set, self._key(user_id), profile.model_dump_json(), ex=self.ttl)
+        except self._errors as e:
+            self.errors += 1
+            logger.warning("User cache set failed: %s", e)
+
+    def delete(self, user_id: int):
+        try:
+            run_blocking(self._client.delete, self._key(user_id))
+        except self._errors as e:
+            # 刪除失敗時舊資料最多存活到 TTL
+            self.errors += 1
+            logger.warning("User cache invalidation for user %s failed: %s", user_id, e)
+
+    def _clear(self):
+        for key in self._client.scan_iter(f"{self.prefix}*"):
+            self._client.delete(key)
+
+    def clear(self):
+        try:
+            run_blocking(self._clear)
+        except self._errors as e:
+            self.errors += 1
+            logger.warning("User cache clear failed: %s", e)
+
+    def stats(self) -> dict:
+        return {"errors": self.errors}
+
+
+if USER_CACHE_REDIS_URL:
+    _store = RedisStore(USER_CACHE_REDIS_URL, USER_CACHE_TTL_SECONDS)
+else:
+    _store = MemoryStore(USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL_SECONDS)
+# 跨行程失效通知的 channel 與代表「全部」的鍵
+CHANNEL = "user_profile"
+ALL = "*"
+# 保護以下計數 (threadpool、背景 LLM worker 與協調層執行緒會同時更新)；不在鎖內做快取 I/O
+_lock = threading.Lock()
+_hits = 0
+_misses = 0
+# 每次失效就遞增；載入期間若有失效發生，載入的結果可能已過期，不寫入快取
+_epoch = 0
+
+
+def get_or_load(user_id: int, loader: Callable[[], schemas.UserProfile | None]) -> schemas.UserProfile | None:
+    """
+    讀取快取的使用者資料；未命中時呼叫 loader 由 DB 載入並寫入快取。
+    不存在的使用者不快取 (新建立的使用者不需要額外失效)。
+    """
+    global _hits, _misses
+    profile = _store.get(user_id)
+    with _lock:
+        if profile is not None:
+            _hits += 1
+            return profile
+        _misses += 1
+        epoch = _epoch
+
+    profile = loader()
+    if profile is not None and _current(epoch):
+        _store.set(user_id, profile)
+        if not _current(epoch):
+            _store.delete(user_id)  # 寫入的同時發生失效：撤回，可能已過期的資料不留在快取
+    return profile
+
+def _current(epoch: int) -> bool:
+    with _lock:
+        return epoch == _epoch
+
+def _drop(user_id: int | None):
+    """只清本行程 (或共用 store) 的快取；None 代表全部"""
+    global _epoch
+    with _lock:
+        _epoch += 1
+    if user_id is None:
+        _store.clear()
+    else:
+        _store.delete(user_id)
+
+def invalidate(user_id: int):
+    """使用者資料變更後呼叫 (在 commit 之後)"""
+    invalidate_many([user_id])
+
+def invalidate_many(user_ids: list[int]):
+    """多位使用者一起失效，其他 worker 行程只需一次通知"""
+    for user_id in user_ids:
+        _drop(user_id)
+    if not _store.shared:
+        coordination.publish(CHANNEL, [str(user_id) for user_id in user_ids])
+
+def clear():
+    _drop(None)
+    if not _store.shared:
+        coordination.publish(CHANNEL, [ALL])
+
+def _on_remote_invalidation(key: str):
+    _drop(None if key == ALL else int(key))
+
+coordination.subscribe(CHANNEL, _on_remote_invalidation)
+
+def stats() -> dict:
+    with _lock:
+        hits, misses = _hits, _misses
+    lookups = hits + misses
+    return {
+        "backend": _store.name,
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+        **_store.stats(),
+    }
@@ -0,0 +1,433 @@
+"""
+API 效能測試：建立 N 位使用者、每人 M 天的每日紀錄，以並行用戶端逐一壓測 main.py 的每個路由，
+LLM 使用可設定延遲的 fake 後端 (LLM_BACKEND=fake)。
+
+在 backend 目錄下執行：
+    python -m bench.api_bench run --users 50 --days 120 --requests 200 --concurrency 8 --output before.json
+    python -m bench.api_bench compare before.json after.json
+
+mode=inprocess 以 httpx 的 ASGITransport 直接呼叫 app (不含網路與序列化到 socket 的成本)；
+mode=uvicorn 啟動真正的 uvicorn 子行程並走 HTTP。每種模式各自使用一個重新建立的資料庫，
+使用者、日期與請求順序都由 --seed 決定，因此不同 commit 的結果可以直接比較。
+每個路由的 SQL 語句數取自伺服器 /metrics 的 http_request_sql_statements (前後相減)。
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_START = date(2025, 1, 1)
+FOOD_QUERIES = ["雞", "雞胸", "豆", "飯", "奶", "chicken", "rice", "tofu", "egg", "milk"]
+
+# 壓測時的預設環境：fake LLM、不受速率限制 (可由外部環境變數覆寫)
+BENCH_ENV = {
+    "LLM_BACKEND": "fake",
+    "FAKE_LLM_LATENCY_MS": "50",
+    "FAKE_LLM_STREAM_CHUNK_MS": "5",
+    "LLM_RATE_LIMIT_PER_MIN": "1000000",
+    "LLM_RATE_BURST": "1000",
+}
+
+
+# --- 資料準備 ---
+def seed_database(url: str, users: int, days: int, seed: int):
+    """建立資料表並寫入測試資料 (以 executemany 批次寫入，再重建彙總表與 TDEE 估計)"""
+    from sqlalchemy import create_engine, insert
+
+    from app import aggregates, migrations, models_db, tdee
+    from app.database import SessionLocal
+
+    rng = random.Random(seed)
+    engine = create_engine(url)
+    migrations.upgrade(engine)
+    genders = list(models_db.GenderEnum)
+    goals = list(models_db.GoalEnum)
+    with engine.begin() as conn:
+        conn.execute(insert(models_db.User), [
+            {"id": uid, "nickname": f"User{uid:03d}", "height_cm": rng.uniform(150, 190),
+             "weight_kg": rng.uniform(45, 100), "age": rng.randint(18, 70),
+             "gender": rng.choice(genders), "goal": rng.choice(goals)}
+            for uid in range(1, users + 1)
+        ])
+        for uid in range(1, users + 1):
+            conn.execute(insert(models_db.DailyRecord), [
+                {"user_id": uid, "record_date": SEED_START + timedelta(days=d),
+                 "calories_consumed": rng.randint(1200, 3200), "protein_g": rng.uniform(40, 180),
+                 "fat_g": rng.uniform(30, 120), "carbs_g": rng.uniform(100, 400),
+                 "calories_burned_exercise": rng.choice([0, 0, 150, 300, 500])}
+                for d in range(days)
+            ])
+        # 每三天一筆體重，讓 TDEE 擬合有資料
+        conn.execute(insert(models_db.WeightLog), [
+            {"user_id": uid, "log_date": SEED_START + timedelta(days=d), "weight_kg": 70 + rng.uniform(-1, 1)}
+            for uid in range(1, users + 1) for d in range(0, days, 3)
+        ])
+        # 一批已完成的工作，讓 /jobs/{job_id}/ 有資料可查
+        conn.execute(insert(models_db.LLMJob), [
+            {"user_id": uid, "record_id": (uid - 1) * days + 1, "status": models_db.JobStatusEnum.done}
+            for uid in range(1, users + 1)
+        ])
+    db = SessionLocal(bind=engine)
+    try:
+        aggregates.rebuild(db)
+        tdee.rebuild(db)
+    finally:
+        db.close()
+    engine.dispose()
+
+
+# --- 請求情境：每個路由一個，由 rng 決定參數 ---
+class Scenarios:
+    def __init__(self, users: int, days: int, seed: int):
+        self.users = users
+        self.days = days
+        self.rng = random.Random(seed)
+
+    def _user(self) -> int:
+        return self.rng.randint(1, self.users)
+
+    def _date(self) -> str:
+        return (SEED_START + timedelta(days=self.rng.randrange(self.days))).isoformat()
+
+    def _record(self) -> dict:
+        return {"record_date": self._date(), "calories_consumed": self.rng.randint(1200, 3200),
+                "protein_g": round(self.rng.uniform(40, 180), 1), "fat_g": round(self.rng.uniform(30, 120), 1),
+                "carbs_g": round(self.rng.uniform(100, 400), 1), "calories_burned_exercise": self.rng.choice([0, 300])}
+
+    def _profile(self) -> dict:
+        return {"height_cm": round(self.rng.uniform(150, 190), 1), "weight_kg": round(self.rng.uniform(45, 100), 1),
+                "age": self.rng.randint(18, 70), "gender": self.rng.choice(["male", "female"]),
+                "goal": self.rng.choice(["gain_muscle", "lose_fat", "maintain"])}
+
+    def _csv(self) -> str:
+        rows = ["record_date,calories_consumed,protein_g,fat_g,carbs_g,calories_burned_exercise"]
+        for _ in range(30):
+            r = self._record()
+            rows.append(",".join(str(r[k]) for k in ("record_date", "calories_consumed", "protein_g",
+                                                      "fat_g", "carbs_g", "calories_burned_exercise")))
+        return "\n".join(rows) + "\n"
+
+    def build(self) -> dict:
+        """{(method, 路由樣板): 產生一個請求 (kwargs for httpx) 的函式}"""
+        entry_ids = itertools.count(1)
+
+        def window() -> tuple[str, str]:
+            start = SEED_START + timedelta(days=self.rng.randrange(max(self.days - 30, 1)))
+            return start.isoformat(), (start + timedelta(days=29)).isoformat()
+
+        return {
+            ("GET", "/"): lambda: {"url": "/"},
+            ("GET", "/static/{path:path}"): lambda: {"url": "/static/app.js", "headers": {"Accept-Encoding": "gzip, br"}},
+            ("POST", "/users/"): lambda: {"url": "/users/", "json": self._profile()},
+            ("GET", "/users/"): lambda: {"url": "/users/", "params": {"limit": 50}},
+            ("GET", "/users/{user_id}/"): lambda: {"url": f"/users/{self._user()}/"},
+            ("PUT", "/users/{user_id}/"): lambda: {"url": f"/users/{self._user()}/", "json": self._profile()},
+            ("POST", "/users/{user_id}/daily_records/"): lambda: {
+                "url": f"/users/{self._user()}/daily_records/", "json": self._record()},
+            ("GET", "/users/{user_id}/daily_records/dates/"): lambda: {
+                "url": f"/users/{self._user()}/daily_records/dates/"},
+            ("POST", "/users/{user_id}/daily_records/import/"): lambda: {
+                "url": f"/users/{self._user()}/daily_records/import/", "content": self._csv(),
+                "headers": {"Content-Type": "text/csv"}},
+            ("GET", "/users/{user_id}/daily_records/export/"): lambda: {
+                "url": f"/users/{self._user()}/daily_records/export/"},
+            ("GET", "/users/{user_id}/daily_records/"): lambda: {
+                "url": f"/users/{self._user()}/daily_records/", "params": {"limit": 50}},
+            ("GET", "/users/{user_id}/daily_records/{record_date}/"): lambda: {
+                "url": f"/users/{self._user()}/daily_records/{self._date()}/"},
+            ("GET", "/users/{user_id}/daily_summary/{record_date}/"): lambda: {
+                "url": f"/users/{self._user()}/daily_summary/{self._date()}/"},
+            ("GET", "/users/{user_id}/daily_summary/{record_date}/stream/"): lambda: {
+                "url": f"/users/{self._user()}/daily_summary/{self._date()}/stream/"},
+            ("GET", "/users/{user_id}/daily_summaries/"): lambda: {
+                "url": f"/users/{self._user()}/daily_summaries/", "params": dict(zip(("start", "end"), window()))},
+            ("GET", "/users/{user_id}/trends/{period}/"): lambda: {
+                "url": f"/users/{self._user()}/trends/{self.rng.choice(['week', 'month'])}/"},
+            ("GET", "/foods/search/"): lambda: {
+                "url": "/foods/search/", "params": {"q": self.rng.choice(FOOD_QUERIES), "limit": 10}},
+            ("GET", "/foods/{food_id}/"): lambda: {"url": f"/foods/{self.rng.randint(1, 100)}/"},
+            ("POST", "/users/{user_id}/meal_entries/"): lambda: {
+                "url": f"/users/{self._user()}/meal_entries/",
+                "json": {"record_date": self._date(), "meal": "lunch", "food_id": self.rng.randint(1, 100),
+                         "grams": self.rng.choice([50, 100, 150, 200])}},
+            ("GET", "/users/{user_id}/meal_entries/{record_date}/"): lambda: {
+                "url": f"/users/{self._user()}/meal_entries/{self._date()}/"},
+            # 依序刪除前面 POST 建立的紀錄 (使用者不符時為 404，同樣計入延遲)
+            ("DELETE", "/users/{user_id}/meal_entries/{entry_id}/"): lambda: {
+                "url": f"/users/{self._user()}/meal_entries/{next(entry_ids)}/"},
+            ("POST", "/users/{user_id}/weight_logs/"): lambda: {
+                "url": f"/users/{self._user()}/weight_logs/",
+                "json": {"log_date": self._date(), "weight_kg": round(self.rng.uniform(60, 80), 1)}},
+            ("GET", "/users/{user_id}/weight_logs/"): lambda: {
+                "url": f"/users/{self._user()}/weight_logs/", "params": dict(zip(("start", "end"), window()))},
+            ("GET", "/users/{user_id}/tdee/"): lambda: {"url": f"/users/{self._user()}/tdee/"},
+            ("GET", "/jobs/{job_id}/"): lambda: {"url": f"/jobs/{self._user()}/"},
+            ("GET", "/llm/cache/stats/"): lambda: {"url": "/llm/cache/stats/"},
+            ("GET", "/system/user_cache/"): lambda: {"url": "/system/user_cache/"},
+            ("GET", "/system/db_pool/"): lambda: {"url": "/system/db_pool/"},
+            ("GET", "/system/coordination/"): lambda: {"url": "/system/coordination/"},
+            ("GET", "/metrics"): lambda: {"url": "/metrics"},
+        }
+
+
+def api_routes(app) -> set[tuple[str, str]]:
+    from fastapi.routing import APIRoute
+    found, pending = set(), list(app.routes)
+    while pending:
+        route = pending.pop()
+        if isinstance(route, APIRoute):
+            found.update((m, route.path) for m in route.methods if m != "HEAD")
+        elif hasattr(route, "original_router"):  # 較新版 FastAPI 的 include_router 保留原本的 router
+            pending.extend(route.original_router.routes)
+    return found
+
+
+# --- 量測 ---
+_SQL_METRIC = re.compile(r'^http_request_sql_statements_(sum|count)\{method="([^"]+)",route="([^"]+)"\} (\S+)$')
+
+async def scrape_sql(client: httpx.AsyncClient) -> dict:
+    """{(method, route): [SQL 語句總數, 請求數]}"""
+    text = (await client.get("/metrics")).text
+    totals: dict = {}
+    for line in text.splitlines():
+        m = _SQL_METRIC.match(line)
+        if m:
+            kind, method, route, value = m.groups()
+            totals.setdefault((method, route), [0.0, 0.0])[0 if kind == "sum" else 1] = float(value)
+    return totals
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """nearest-rank 百分位數"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+async def run_route(client: httpx.AsyncClient, make_request, method: str, requests: int,
+                    concurrency: int, warmup: int) -> dict:
+    """先送 warmup 個請求 (不計)，再以 concurrency 個並行用戶端送出 requests 個請求"""
+    for _ in range(warmup):
+        await client.request(method, **make_request())
+
+    pending = [make_request() for _ in range(requests)]  # 先產生，讓請求內容不受完成順序影響
+    latencies: list[float] = []
+    statuses: dict[str, int] = {}
+
+    async def worker():
+        while pending:
+            kwargs = pending.pop()
+            started = time.perf_counter()
+            try:
+                r = await client.request(method, **kwargs)
+                await r.aread()
+                status = str(r.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ms = [v * 1000 for v in latencies]
+    errors = sum(n for s, n in statuses.items() if not (s.isdigit() and int(s) < 500))
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "status_counts": statuses,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(ms) / len(ms), 3) if ms else 0.0,
+            "p50": round(percentile(ms, 50), 3),
+            "p95": round(percentile(ms, 95), 3),
+            "p99": round(percentile(ms, 99), 3),
+            "max": round(ms[-1], 3) if ms else 0.0,
+        },
+    }
+
+async def run_all(client: httpx.AsyncClient, args, only: list[str] | None) -> dict:
+    scenarios = Scenarios(args.users, args.days, args.seed).build()
+    results = {}
+    for (method, path), make_request in scenarios.items():
+        if only and path not in only:
+            continue
+        before = await scrape_sql(client)
+        result = await run_route(client, make_request, method, args.requests, args.concurrency, args.warmup)
+        after = await scrape_sql(client)
+        sql_sum, count = (a - b for a, b in zip(after.get((method, path), [0, 0]), before.get((method, path), [0, 0])))
+        result["sql_per_request"] = round(sql_sum / count, 3) if count else None
+        results[f"{method} {path}"] = result
+        print(f"  {method:6} {path:55} p50 {result['latency_ms']['p50']:8.2f} ms  "
+              f"p99 {result['latency_ms']['p99']:8.2f} ms  {result['throughput_rps']:8.1f} req/s  "
+              f"sql {result['sql_per_request']}", file=sys.stderr)
+    return results
+
+
+# --- 兩種模式 ---
+async def bench_inprocess(args) -> dict:
+    import logging
+
+    from app.main import app
+
+    logging.getLogger().setLevel(logging.WARNING)  # 每個請求的 INFO 日誌會主導量測結果
+    missing = api_routes(app) - set(Scenarios(1, 1, 0).build())
+    if missing:
+        print(f"warning: routes without a scenario: {sorted(missing)}", file=sys.stderr)
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await run_all(client, args, args.route)
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def bench_uvicorn(args, url: str, workdir: str) -> dict:
+    port = _free_port()
+    env = {**os.environ, "DATABASE_URL": url}
+    log_path = os.path.join(workdir, "uvicorn.log")
+    with open(log_path, "w") as log:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+             "--log-level", "warning", "--no-access-log", *args.uvicorn_arg],
+            cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    await client.get("/metrics")
+                    break
+                except httpx.TransportError:
+                    if server.poll() is not None or time.monotonic() > deadline:
+                        raise RuntimeError(f"uvicorn did not start, see {log_path}")
+                    await asyncio.sleep(0.1)
+            return await run_all(client, args, args.route)
+    finally:
+        server.terminate()
+        server.wait(10)
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                             capture_output=True, text=True, check=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BACKEND_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return out.stdout.strip() + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+    os.environ["FAKE_LLM_LATENCY_MS"] = str(args.llm_latency_ms)
+    sys.path.insert(0, BACKEND_DIR)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("func", "output")},
+        },
+        "modes": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        for mode in (["inprocess", "uvicorn"] if args.mode == "both" else [args.mode]):
+            url = f"sqlite:///{os.path.join(workdir, mode + '.db')}"
+            os.environ["DATABASE_URL"] = url  # app.settings 在第一次匯入時讀取
+            started = time.perf_counter()
+            seed_database(url, args.users, args.days, args.seed)
+            print(f"[{mode}] seeded {args.users} users x {args.days} days in {time.perf_counter() - started:.1f}s",
+                  file=sys.stderr)
+            if mode == "inprocess":
+                report["modes"][mode] = asyncio.run(bench_inprocess(args))
+            else:
+                report["modes"][mode] = asyncio.run(bench_uvicorn(args, url, workdir))
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+def compare(args):
+    """並列兩次結果 (例如兩個 commit) 的 p50 / p99 / 吞吐量 / SQL 數"""
+    with open(args.baseline, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        cand = json.load(f)
+
+    def change(old, new):
+        return f"{(new - old) / old * 100:+7.1f}%" if old else "    n/a"
+
+    print(f"baseline {base['meta']['commit']}  vs  candidate {cand['meta']['commit']}")
+    for mode, routes in cand["modes"].items():
+        print(f"\n[{mode}]")
+        print(f"  {'route':62} {'p50 ms':>9} {'Δ':>8} {'p99 ms':>9} {'Δ':>8} {'req/s':>9} {'Δ':>8} {'sql':>7}")
+        for route, new in routes.items():
+            old = base["modes"].get(mode, {}).get(route)
+            if old is None:
+                print(f"  {route:62} (new)")
+                continue
+            sql = new["sql_per_request"]
+            sql_text = "" if sql is None else f"{sql:g}" if sql == old["sql_per_request"] else f"{old['sql_per_request']:g}->{sql:g}"
+            print(f"  {route:62} {new['latency_ms']['p50']:9.2f} {change(old['latency_ms']['p50'], new['latency_ms']['p50'])}"
+                  f" {new['latency_ms']['p99']:9.2f} {change(old['latency_ms']['p99'], new['latency_ms']['p99'])}"
+                  f" {new['throughput_rps']:9.1f} {change(old['throughput_rps'], new['throughput_rps'])} {sql_text:>7}")
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="API 效能測試 (fake LLM 後端)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    cmd = sub.add_parser("run", help="建立測試資料並壓測每個路由")
+    cmd.add_argument("--mode", choices=["inprocess", "uvicorn", "both"], default="both")
+    cmd.add_argument("--users", type=int, default=50, help="使用者數 (N)")
+    cmd.add_argument("--days", type=int, default=120, help="每位使用者的紀錄天數 (M)")
+    cmd.add_argument("--requests", type=int, default=200, help="每個路由的請求數")
+    cmd.add_argument("--concurrency", type=int, default=8, help="並行用戶端數")
+    cmd.add_argument("--warmup", type=int, default=5, help="每個路由不計入結果的暖身請求數")
+    cmd.add_argument("--llm-latency-ms", type=float, default=50, help="fake LLM 每次呼叫的延遲")
+    cmd.add_argument("--seed", type=int, default=42)
+    cmd.add_argument("--route", action="append", help="只測指定路由樣板 (可重複)，例如 /users/{user_id}/")
+    cmd.add_argument("--uvicorn-arg", action="append", default=[], help="額外傳給 uvicorn 的參數 (可重複)")
+    cmd.add_argument("--output", help="結果 JSON 寫入的檔案 (預設輸出到 stdout)")
+    cmd.set_defaults(func=run)
+
+    cmd = sub.add_parser("compare", help="比較兩次 run 的結果")
+    cmd.add_argument("baseline")
+    cmd.add_argument("candidate")
+    cmd.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+多 worker 測試：對每個 worker 數以 python -m app.serve --workers N 啟動伺服器 (所有 worker 共用同一個 SQLite 檔)，
+先驗證一致性，再量測吞吐量。
+    consistency  每個 worker 都快取某位使用者後更新其資料，等一個通知輪詢週期，再從每個 worker 讀取都必須是新值；
+                 同一天的每日總結由多條連線同時請求，只能建立一個 LLM 工作，完成後每個 worker 回傳相同的建議與 ETag
+    throughput   多個用戶端行程以唯讀請求 (使用者資料、紀錄列表、期間總結、趨勢) 壓測固定秒數，回報 req/s、延遲與
+                 擴充效率 = req/s(N) / (N × req/s(1))
+--min-efficiency 指定效率下限 (worker 數超過 CPU 核心數的量測不列入檢查)；一致性檢查失敗或效率不足時結束狀態為 1。
+用戶端與伺服器在同一台機器上搶 CPU，要量到接近線性的擴充，核心數至少要是最大 worker 數加上 --clients。
+
+在 backend 目錄下執行：
+    python -m bench.scale_bench --workers 1 2 4 --duration 10 --min-efficiency 0.7
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+
+import httpx
+
+from .api_bench import BACKEND_DIR, BENCH_ENV, SEED_START, _free_port, _git_commit, percentile, seed_database
+
+# 找齊每個 worker 時，最多開幾條新連線 (每個 worker 數的倍數)
+MAX_PROBES_PER_WORKER = 50
+
+
+# --- 伺服器 ---
+def start_server(workers: int, env: dict, log_path: str) -> tuple[subprocess.Popen, str]:
+    port = _free_port()
+    with open(log_path, "w") as log:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "app.serve", "--workers", str(workers), "--port", str(port),
+             "--log-level", "warning", "--no-access-log"],
+            cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            if httpx.get(f"{base_url}/metrics", timeout=5).status_code == 200:
+                return server, base_url
+        except httpx.TransportError:
+            pass
+        if server.poll() is not None or time.monotonic() > deadline:
+            server.terminate()
+            raise RuntimeError(f"server did not start, see {log_path}")
+        time.sleep(0.1)
+
+def stop_server(server: subprocess.Popen):
+    server.terminate()
+    try:
+        server.wait(30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+def per_worker(base_url: str, workers: int, request) -> dict[str, object]:
+    """
+    開新連線 (由核心分配給某個 worker) 直到每個 worker 都回應過；同一條連線先查出 worker 身分，
+    再執行 request(client)。回傳 {worker: request 的結果}，找不齊時只包含有回應的 worker。
+    """
+    results = {}
+    for _ in range(MAX_PROBES_PER_WORKER * workers):
+        with httpx.Client(base_url=base_url, timeout=30) as client:
+            owner = client.get("/system/coordination/").json()["owner"]
+            if owner not in results:
+                results[owner] = request(client)
+        if len(results) == workers:
+            break
+    return results
+
+
+# --- 一致性 ---
+def check_profile_invalidation(base_url: str, workers: int, poll_seconds: float) -> dict:
+    """每個 worker 先快取使用者 1，更新後每個 worker 都必須讀到新的體重"""
+    cached = per_worker(base_url, workers, lambda c: c.get("/users/1/").json())
+    profile = next(iter(cached.values()))
+    new_weight = round(profile["weight_kg"] + 1.5, 1)
+    httpx.put(f"{base_url}/users/1/", json={**profile, "weight_kg": new_weight}, timeout=30).raise_for_status()
+    time.sleep(poll_seconds * 2 + 0.2)
+    seen = per_worker(base_url, workers, lambda c: c.get("/users/1/").json()["weight_kg"])
+    stale = sorted(owner for owner, weight in seen.items() if weight != new_weight)
+    return {"workers_reached": len(seen), "stale_workers": len(stale),
+            "ok": not stale and len(cached) == len(seen) == workers}
+
+def check_feedback_dedup(base_url: str, workers: int, record_date: str) -> dict:
+    """新紀錄的每日總結由多條連線同時請求：只能有一個 LLM 工作，完成後每個 worker 回傳相同的建議與 ETag"""
+    record = {"record_date": record_date, "calories_consumed": 2100, "protein_g": 120.0, "fat_g": 70.0,
+              "carbs_g": 230.0, "calories_burned_exercise": 300}
+    httpx.post(f"{base_url}/users/2/daily_records/", json=record, timeout=30).raise_for_status()
+    url = f"/users/2/daily_summary/{record_date}/"
+
+    def request_summary(_):
+        with httpx.Client(base_url=base_url, timeout=30) as client:
+            return client.get(url).json()
+
+    with ThreadPoolExecutor(max_workers=4 * workers) as pool:
+        summaries = list(pool.map(request_summary, range(8 * workers)))
+    job_ids = {s["llm_job_id"] for s in summaries if s.get("llm_job_id") is not None}
+
+    deadline = time.monotonic() + 60
+    for job_id in job_ids:
+        while httpx.get(f"{base_url}/jobs/{job_id}/", timeout=30).json()["status"] in ("pending", "running"):
+            if time.monotonic() > deadline:
+                break
+            time.sleep(0.1)
+
+    def final(client):
+        r = client.get(url)
+        return r.json().get("llm_feedback"), r.headers.get("etag")
+    answers = per_worker(base_url, workers, final)
+    distinct = set(answers.values())
+    return {"jobs_created": len(job_ids), "workers_reached": len(answers), "distinct_answers": len(distinct),
+            "ok": len(job_ids) <= 1 and len(answers) == workers and len(distinct) == 1
+                  and next(iter(distinct))[0] is not None}
+
+
+# --- 吞吐量 ---
+def _read_requests(users: int, days: int, rng: random.Random):
+    uid = rng.randint(1, users)
+    start = SEED_START + timedelta(days=rng.randrange(max(days - 30, 1)))
+    return rng.choice([
+        (f"/users/{uid}/", None),
+        (f"/users/{uid}/daily_records/", {"limit": 30}),
+        (f"/users/{uid}/daily_summaries/", {"start": start.isoformat(), "end": (start + timedelta(days=29)).isoformat()}),
+        (f"/users/{uid}/trends/week/", None),
+    ])
+
+async def _client_load(base_url: str, users: int, days: int, concurrency: int, warmup: float,
+                       duration: float, seed: int) -> dict:
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        measure_from = time.monotonic() + warmup
+        stop_at = measure_from + duration
+
+        async def loop():
+            nonlocal errors
+            while (now := time.monotonic()) < stop_at:
+                path, params = _read_requests(users, days, rng)
+                try:
+                    r = await client.get(path, params=params)
+                    ok = r.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if now >= measure_from:
+                    if ok:
+                        latencies.append(time.monotonic() - now)
+                    else:
+                        errors += 1
+
+        await asyncio.gather(*(loop() for _ in range(concurrency)))
+    return {"latencies": latencies, "errors": errors}
+
+def client_process(*args) -> dict:
+    return asyncio.run(_client_load(*args))
+
+def measure_throughput(base_url: str, args) -> dict:
+    with ProcessPoolExecutor(max_workers=args.clients) as pool:
+        futures = [pool.submit(client_process, base_url, args.users, args.days, args.concurrency,
+                               args.warmup, args.duration, args.seed + i) for i in range(args.clients)]
+        results = [f.result() for f in futures]
+    latencies = sorted(l for r in results for l in r["latencies"])
+    return {
+        "requests": len(latencies),
+        "errors": sum(r["errors"] for r in results),
+        "throughput_rps": round(len(latencies) / args.duration, 1),
+        "latency_ms": {q: round(percentile(latencies, p) * 1000, 2) if latencies else None
+                       for q, p in (("p50", 50), ("p95", 95), ("p99", 99))},
+    }
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="多 worker 一致性與吞吐量擴充測試")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="要測試的 worker 數")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--clients", type=int, default=2, help="產生負載的用戶端行程數")
+    parser.add_argument("--concurrency", type=int, default=16, help="每個用戶端行程的並行請求數")
+    parser.add_argument("--warmup", type=float, default=2.0, help="不列入量測的暖機秒數")
+    parser.add_argument("--duration", type=float, default=10.0, help="量測秒數")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--min-efficiency", type=float, default=None,
+                        help="擴充效率下限 (0-1)，只檢查 worker 數不超過 CPU 核心數的量測")
+    parser.add_argument("--output", default=None, help="結果 JSON 檔")
+    args = parser.parse_args(argv)
+
+    cpus = os.cpu_count() or 1
+    poll_seconds = float(os.environ.get("COORDINATION_POLL_SECONDS", "1"))
+    report = {"commit": _git_commit(), "cpus": cpus,
+              "params": {k: v for k, v in vars(args).items() if k != "output"}, "runs": []}
+    failures = []
+    with tempfile.TemporaryDirectory(prefix="scale-") as workdir:
+        url = f"sqlite:///{os.path.join(workdir, 'scale.db')}"
+        env = {**os.environ, **{k: os.environ.get(k, v) for k, v in BENCH_ENV.items()}, "DATABASE_URL": url}
+        os.environ["DATABASE_URL"] = url  # 在本行程匯入 app.settings 之前設定
+        seed_database(url, args.users, args.days, args.seed)
+
+        for i, workers in enumerate(args.workers):
+            server, base_url = start_server(workers, env, os.path.join(workdir, f"serve-{workers}.log"))
+            try:
+                record_date = (SEED_START + timedelta(days=args.days + i)).isoformat()
+                consistency = {
+                    "profile_invalidation": check_profile_invalidation(base_url, workers, poll_seconds),
+                    "feedback_dedup": check_feedback_dedup(base_url, workers, record_date),
+                }
+                throughput = measure_throughput(base_url, args)
+            finally:
+                stop_server(server)
+            report["runs"].append({"workers": workers, "consistency": consistency, "throughput": throughput})
+            for name, result in consistency.items():
+                if not result["ok"]:
+                    failures.append(f"{workers} workers: {name} {result}")
+            print(f"{workers} workers: {throughput['throughput_rps']:8.1f} req/s  "
+                  f"p50 {throughput['latency_ms']['p50']} ms  p99 {throughput['latency_ms']['p99']} ms  "
+                  f"errors {throughput['errors']}  consistency "
+                  f"{'ok' if all(r['ok'] for r in consistency.values()) else 'FAILED'}", file=sys.stderr)
+
+    base = next((r for r in report["runs"] if r["workers"] == 1), None)
+    if base and base["throughput"]["throughput_rps"]:
+        for run in report["runs"]:
+            run["efficiency"] = round(
+                run["throughput"]["throughput_rps"] / (run["workers"] * base["throughput"]["throughput_rps"]), 3)
+            if args.min_efficiency is not None and run["workers"] <= cpus and run["efficiency"] < args.min_efficiency:
+                failures.append(f"{run['workers']} workers: efficiency {run['efficiency']} < {args.min_efficiency}")
+    elif args.min_efficiency is not None:
+        failures.append("--min-efficiency needs a 1-worker run as the baseline")
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
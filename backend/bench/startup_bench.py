@@ -0,0 +1,133 @@
+"""
+冷啟動效能測試：每一輪都開一個新的 Python 行程，量測
+    import   匯入 app.main 的時間 (不含直譯器本身啟動)
+    startup  lifespan 啟動 (migration 檢查、清理快取、啟動 worker) 的時間
+    first    第一個 API 請求 (GET /users/{id}/) 的時間
+    process  從開行程到完成第一個請求的總時間 (含直譯器啟動)
+並以 --target-ms 檢查 import + startup 的中位數，超過時以非零狀態結束 (可放進 CI)。
+
+在 backend 目錄下執行：
+    python -m bench.startup_bench --runs 10 --target-ms 1500
+    python -m bench.startup_bench --runs 10 --uvicorn      # 另外量測 uvicorn 從啟動到可回應的時間
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from .api_bench import BACKEND_DIR, BENCH_ENV, _free_port, _git_commit, seed_database
+
+# 子行程：量測各階段並以一行 JSON 回報
+CHILD = r"""
+import json, time
+t0 = time.perf_counter()
+import app.main
+t1 = time.perf_counter()
+import asyncio, sys, httpx
+
+async def main():
+    app_ = app.main.app
+    async with app_.router.lifespan_context(app_):
+        t2 = time.perf_counter()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app_), base_url="http://bench") as client:
+            r = await client.get("/users/1/")
+            r.raise_for_status()
+        t3 = time.perf_counter()
+    loaded = sorted(m for m in ("google.generativeai", "numpy") if m in sys.modules)
+    print(json.dumps({"import": t1 - t0, "startup": t2 - t1, "first": t3 - t2, "heavy_modules_loaded": loaded}))
+
+asyncio.run(main())
+"""
+
+
+def summarize(values: list[float]) -> dict:
+    ordered = sorted(values)
+    return {
+        "median_ms": round(statistics.median(ordered) * 1000, 1),
+        "min_ms": round(ordered[0] * 1000, 1),
+        "max_ms": round(ordered[-1] * 1000, 1),
+    }
+
+
+def run_inprocess(env: dict, runs: int) -> dict:
+    phases: dict[str, list[float]] = {"import": [], "startup": [], "first": [], "process": []}
+    heavy = set()
+    for _ in range(runs):
+        started = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", CHILD], cwd=BACKEND_DIR, env=env,
+                             capture_output=True, text=True, check=True)
+        phases["process"].append(time.perf_counter() - started)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        heavy.update(result.pop("heavy_modules_loaded"))
+        for phase, value in result.items():
+            phases[phase].append(value)
+    ready = [i + s for i, s in zip(phases["import"], phases["startup"])]
+    return {**{phase: summarize(values) for phase, values in phases.items()},
+            "ready": summarize(ready), "heavy_modules_loaded": sorted(heavy)}
+
+
+def run_uvicorn(env: dict, runs: int) -> dict:
+    """uvicorn 子行程從啟動到 GET /users/1/ 回應 200 的時間"""
+    times = []
+    for _ in range(runs):
+        port = _free_port()
+        started = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+                                 "--log-level", "warning"], cwd=BACKEND_DIR, env=env)
+        try:
+            while True:
+                if proc.poll() is not None:
+                    raise RuntimeError("uvicorn exited during startup")
+                try:
+                    if httpx.get(f"http://127.0.0.1:{port}/users/1/", timeout=1).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+            times.append(time.perf_counter() - started)
+        finally:
+            proc.terminate()
+            proc.wait(timeout=10)
+    return {"ready": summarize(times)}
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="量測 API 冷啟動時間")
+    parser.add_argument("--runs", type=int, default=10, help="量測輪數 (每輪一個新行程)")
+    parser.add_argument("--uvicorn", action="store_true", help="另外量測 uvicorn 啟動到可回應的時間")
+    parser.add_argument("--target-ms", type=float, default=None,
+                        help="import + startup 中位數的上限 (毫秒)，超過時結束狀態為 1")
+    parser.add_argument("--output", default=None, help="結果 JSON 檔")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        os.environ["DATABASE_URL"] = url  # 在本行程匯入 app.settings 之前設定
+        seed_database(url, users=10, days=30, seed=1)
+        env = {**os.environ, **{k: os.environ.get(k, v) for k, v in BENCH_ENV.items()}, "DATABASE_URL": url}
+        results = {"commit": _git_commit(), "python": sys.version.split()[0], "runs": args.runs,
+                   "inprocess": run_inprocess(env, args.runs)}
+        if args.uvicorn:
+            results["uvicorn"] = run_uvicorn(env, args.runs)
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.target_ms is not None:
+        ready = results["inprocess"]["ready"]["median_ms"]
+        if ready > args.target_ms:
+            print(f"FAIL: median import + startup {ready} ms exceeds target {args.target_ms} ms", file=sys.stderr)
+            sys.exit(1)
+        print(f"OK: median import + startup {ready} ms <= target {args.target_ms} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
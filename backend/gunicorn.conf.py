@@ -0,0 +1,27 @@
+"""
+gunicorn 設定 (Linux)，在 backend 目錄下執行：
+    pip install gunicorn uvicorn-worker
+    gunicorn -c gunicorn.conf.py app.main:app
+master 行程不匯入 app (避免 fork 時共用資料庫連線與背景執行緒)，只在啟動時以子行程執行一次 migration；
+worker 關閉 AUTO_MIGRATE。HOST / PORT / WEB_CONCURRENCY 與 python -m app.serve 相同。
+"""
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+bind = f"{os.getenv('HOST', '127.0.0.1')}:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn_worker.UvicornWorker"
+chdir = BACKEND_DIR
+preload_app = False
+# 背景 LLM worker 最多要 jobs.POP_TIMEOUT 才會發現要結束
+graceful_timeout = 30
+
+
+def on_starting(server):
+    subprocess.run([sys.executable, "-m", "app.migrations"], cwd=BACKEND_DIR, check=True)
+    os.environ["AUTO_MIGRATE"] = "false"
+    # 以 -w 指定 worker 數時也讓 worker 知道有其他行程 (決定是否發送快取失效通知)
+    os.environ["WEB_CONCURRENCY"] = str(server.cfg.workers)
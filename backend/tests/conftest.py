@@ -0,0 +1,84 @@
+"""
+測試共用設定：匯入 app 之前先把資料庫指向暫存的 SQLite 檔，並改用假 LLM 後端 (不需網路與 API 金鑰)。
+在 backend 目錄下執行：
+    pip install -r requirements-dev.txt
+    python -m pytest -q
+"""
+import os
+import shutil
+import tempfile
+
+import pytest
+
+WORKDIR = tempfile.mkdtemp(prefix="dailydiet-tests-")
+
+# 必須在匯入 app.settings 之前設定 (settings 只在匯入時讀取環境變數；backend/.env 不覆寫這裡的值)
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(WORKDIR, 'test.db')}",
+    "LLM_BACKEND": "fake",
+    "FAKE_LLM_LATENCY_MS": "0",
+    "FAKE_LLM_FAILURE_RATE": "0",
+    "LLM_RATE_LIMIT_PER_MIN": "0",
+    "LLM_BACKOFF_BASE_SECONDS": "0.01",
+    "LLM_BACKOFF_MAX_SECONDS": "0.05",
+    "COORDINATION_BACKEND": "database",
+    "COORDINATION_POLL_SECONDS": "0.1",
+    "USER_CACHE_REDIS_URL": "",
+    "WEB_CONCURRENCY": "1",
+})
+
+from app import crud, feedback_cache, migrations, models_db, schemas, services, user_cache  # noqa: E402
+from app.database import SessionLocal, engine  # noqa: E402
+
+USER = {"height_cm": 170, "weight_kg": 70, "age": 30, "gender": "male", "goal": "maintain"}
+RECORD = {"calories_consumed": 2000, "protein_g": 100.0, "fat_g": 60.0, "carbs_g": 250.0, "calories_burned_exercise": 200}
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _schema():
+    migrations.upgrade(engine)
+    yield
+    engine.dispose()
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+@pytest.fixture(autouse=True)
+def _clean_state():
+    """每個測試都從空資料庫、空快取與新的 LLM client 開始"""
+    with engine.begin() as conn:
+        for table in reversed(models_db.Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+    feedback_cache._memory.clear()
+    user_cache._store.clear()
+    services._llm = None
+    yield
+
+@pytest.fixture(scope="module")
+def client():
+    """經過 lifespan (背景 LLM worker、協調層) 的 TestClient，同一模組內共用"""
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    with TestClient(app) as c:
+        yield c
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@pytest.fixture
+def fake_model():
+    """目前 LLM client 使用的 FakeGeminiModel (可用 fail_next 注入失敗、以 calls 計算呼叫次數)"""
+    return services.get_llm().model
+
+
+def create_user(db, **overrides) -> models_db.User:
+    return crud.create_user(db, schemas.UserCreate(**{**USER, **overrides}))
+
+def create_record(db, user_id: int, record_date, **overrides) -> models_db.DailyRecord:
+    return crud.get_or_create_daily_record(
+        db, user_id, schemas.DailyRecordCreate(record_date=record_date, **{**RECORD, **overrides}))
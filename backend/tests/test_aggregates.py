@@ -0,0 +1,20 @@
+"""週／月彙總與趨勢查詢"""
+from datetime import date, timedelta
+
+from conftest import create_record, create_user
+
+from app import aggregates, models_db, services
+
+
+def test_trend_end_defaults_to_today(db):
+    user = create_user(db)
+    today = date.today()
+    create_record(db, user.id, today - timedelta(days=60))
+    create_record(db, user.id, today + timedelta(days=60))  # 預先填寫的未來日期
+    profile = services.get_user_profile(db, user.id)
+
+    trend = aggregates.get_trend(db, profile, models_db.PeriodEnum.month)
+    assert [b.period_start for b in trend.buckets] == [aggregates.bucket_start(models_db.PeriodEnum.month, today - timedelta(days=60))]
+
+    trend = aggregates.get_trend(db, profile, models_db.PeriodEnum.month, end=today + timedelta(days=90))
+    assert len(trend.buckets) == 2
@@ -0,0 +1,38 @@
+"""批次匯入：未提供的選填欄位不覆寫既有紀錄"""
+from conftest import RECORD, USER
+
+from app import models_db
+
+CSV_HEADER = "record_date,calories_consumed,protein_g,fat_g,carbs_g"
+
+
+def import_csv(client, user_id: int, body: str):
+    response = client.post(f"/users/{user_id}/daily_records/import/", content=body,
+                           headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def stored(db, user_id: int) -> dict[str, tuple[int, int | None]]:
+    R = models_db.DailyRecord
+    rows = db.query(R.record_date, R.calories_consumed, R.calories_burned_exercise).filter(R.user_id == user_id)
+    return {d.isoformat(): (kcal, burned) for d, kcal, burned in rows}
+
+def test_reimport_without_exercise_column_keeps_stored_value(client, db):
+    uid = client.post("/users/", json=USER).json()["id"]
+    client.post(f"/users/{uid}/daily_records/",
+                json={**RECORD, "record_date": "2025-03-01", "calories_burned_exercise": 500}).raise_for_status()
+
+    result = import_csv(client, uid, f"{CSV_HEADER}\n2025-03-01,1800,90,50,200\n2025-03-02,2100,100,60,250\n")
+    assert result["upserted"] == 2 and result["error_count"] == 0
+    assert stored(db, uid) == {"2025-03-01": (1800, 500), "2025-03-02": (2100, 0)}
+
+def test_empty_optional_value_is_not_written_but_given_value_is(client, db):
+    uid = client.post("/users/", json=USER).json()["id"]
+    for day in ("2025-03-01", "2025-03-02"):
+        client.post(f"/users/{uid}/daily_records/",
+                    json={**RECORD, "record_date": day, "calories_burned_exercise": 500}).raise_for_status()
+
+    # 同一批內欄位組合不同的列 (空值視為未提供)
+    body = f"{CSV_HEADER},calories_burned_exercise\n2025-03-01,1800,90,50,200,\n2025-03-02,1900,90,50,200,300\n"
+    assert import_csv(client, uid, body)["upserted"] == 2
+    assert stored(db, uid) == {"2025-03-01": (1800, 500), "2025-03-02": (1900, 300)}
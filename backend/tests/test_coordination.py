@@ -0,0 +1,111 @@
+"""跨行程協調：只有單一行程時不發送通知；多行程時由背景執行緒批次寫入，不在呼叫端做 I/O；租約在產生期間續約。以及 Redis 後端的租約、通知與工作佇列"""
+import threading
+import time
+
+import pytest
+from sqlalchemy import event
+
+from app import coordination, models_db, singleflight
+from app.database import engine
+
+
+@pytest.fixture
+def statements_on_this_thread():
+    statements = []
+    caller = threading.get_ident()
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        if threading.get_ident() == caller and not statement.startswith("PRAGMA"):
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+def events(db) -> list[tuple[str, str]]:
+    E = models_db.CoordinationEvent
+    return [tuple(row) for row in db.query(E.channel, E.key).order_by(E.id)]
+
+
+def test_single_process_does_not_publish(db, statements_on_this_thread):
+    assert not coordination.multi_process()
+    coordination.publish("user_profile", ["1"])
+    coordination.flush()
+    assert statements_on_this_thread == []
+    assert events(db) == []
+
+def test_publish_is_written_in_the_background(db, statements_on_this_thread, monkeypatch):
+    monkeypatch.setattr(coordination, "WEB_CONCURRENCY", 2)
+    coordination.publish("user_profile", ["1", "2"])
+    coordination.publish("user_profile", ["2", "3"])
+    coordination.publish("other", ["*"])
+    assert statements_on_this_thread == []
+
+    coordination.flush()
+    assert set(events(db)) == {("other", "*"), ("user_profile", "1"), ("user_profile", "2"), ("user_profile", "3")}
+
+def test_failed_lease_release_keeps_the_result(monkeypatch):
+    def release_lease(key, owner):
+        raise ConnectionError("connection closed")
+
+    monkeypatch.setattr(coordination.backend(), "release_lease", release_lease)
+    assert singleflight.do("feedback:test", lambda: "done", check=lambda: None) == "done"
+
+def test_lease_is_renewed_while_generating(monkeypatch):
+    monkeypatch.setattr(singleflight, "LLM_LEASE_TTL_SECONDS", 1)
+    leases = coordination.backend()
+
+    def slow_generate():
+        time.sleep(1.5)  # 超過 TTL
+        return leases.acquire_lease("feedback:slow", "other-process", 1)
+
+    assert singleflight.do("feedback:slow", slow_generate, check=lambda: None) is False
+    assert leases.acquire_lease("feedback:slow", "other-process", 1)  # 完成後釋放
+
+def test_only_the_owner_renews_a_lease():
+    leases = coordination.backend()
+    assert leases.acquire_lease("feedback:renew", "a", ttl=60)
+    assert leases.renew_lease("feedback:renew", "a", ttl=60)
+    assert not leases.renew_lease("feedback:renew", "b", ttl=60)
+
+
+@pytest.fixture
+def redis_backends(monkeypatch):
+    """共用同一個 fakeredis server 的兩個 RedisBackend，代表兩個行程"""
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # 釋放租約用的 Lua script
+    import redis
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, "from_url", lambda url, **kwargs: fakeredis.FakeRedis(server=server))
+    return coordination.RedisBackend("redis://test"), coordination.RedisBackend("redis://test")
+
+def test_redis_lease_is_exclusive_and_renewed_or_released_only_by_owner(redis_backends):
+    a, b = redis_backends
+    assert a.acquire_lease("feedback:1", "a", ttl=60)
+    assert not b.acquire_lease("feedback:1", "b", ttl=60)
+    b.release_lease("feedback:1", "b")  # 不是持有者：不影響
+    assert not b.acquire_lease("feedback:1", "b", ttl=60)
+    assert a.renew_lease("feedback:1", "a", ttl=120) and not b.renew_lease("feedback:1", "b", ttl=120)
+    assert a._client.ttl("dailydiet:lease:feedback:1") > 60
+    a.release_lease("feedback:1", "a")
+    assert b.acquire_lease("feedback:1", "b", ttl=60)
+
+def test_redis_events_reach_other_processes_only(redis_backends, monkeypatch):
+    a, b = redis_backends
+    assert b.receive(0.01) == []  # 從目前的位置開始讀
+    owner = coordination.OWNER
+    monkeypatch.setattr(coordination, "OWNER", "other-process")
+    a.publish("user_profile", ["1", "2"])
+    monkeypatch.setattr(coordination, "OWNER", owner)
+    assert b.receive(0.01) == [("user_profile", "1"), ("user_profile", "2")]
+    a.publish("user_profile", ["3"])  # 本行程送出的通知不回送給自己
+    assert b.receive(0.01) == []
+
+def test_redis_job_queue_is_shared(redis_backends):
+    a, b = redis_backends
+    a.push_job(7)
+    a.push_job(8)
+    assert b.job_queue_depth() == 2
+    assert [b.pop_job(1), a.pop_job(1)] == [7, 8]
+    assert a.job_queue_depth() == 0
@@ -0,0 +1,62 @@
+"""crud 寫入路徑：完整性錯誤的處理、食物紀錄增減與當日紀錄"""
+from datetime import date
+
+import pytest
+from conftest import RECORD, create_record, create_user
+from sqlalchemy.exc import IntegrityError
+
+from app import crud, jobs, models_db, schemas
+
+DAY = date(2025, 5, 1)
+RICE = schemas.FoodItem(id=1, name="白飯", serving_g=200, calories=183, protein_g=3.1, fat_g=0.3, carbs_g=41.0)
+
+
+def test_upsert_for_missing_user_returns_none(db):
+    assert crud.get_or_create_daily_record(db, 999, schemas.DailyRecordCreate(record_date=DAY, **RECORD)) is None
+
+def test_other_integrity_errors_are_not_reported_as_missing_user(db):
+    user = create_user(db)
+    # 繞過 pydantic 驗證，讓 NOT NULL 限制擋下寫入
+    invalid = schemas.DailyRecordCreate.model_construct(record_date=DAY, **{**RECORD, "calories_consumed": None})
+    with pytest.raises(IntegrityError):
+        crud.get_or_create_daily_record(db, user.id, invalid)
+    assert crud.get_daily_record_by_date(db, user.id, DAY) is None
+
+
+def add_rice(db, user_id: int, grams: float = 200) -> models_db.MealEntry:
+    entry = schemas.MealEntryCreate(record_date=DAY, meal="lunch", food_id=RICE.id, grams=grams)
+    return crud.add_meal_entry(db, user_id, entry, RICE)
+
+def aggregates_of(db, user_id: int) -> list[models_db.NutritionAggregate]:
+    return db.query(models_db.NutritionAggregate).filter(models_db.NutritionAggregate.user_id == user_id).all()
+
+def test_deleting_last_meal_entry_removes_the_emptied_record(db):
+    user = create_user(db)
+    first, second = add_rice(db, user.id), add_rice(db, user.id, 150)
+    assert len(aggregates_of(db, user.id)) == 2  # 週與月
+
+    assert crud.delete_meal_entry(db, user.id, first.id)
+    assert crud.get_daily_record_by_date(db, user.id, DAY) is not None
+    assert crud.delete_meal_entry(db, user.id, second.id)
+    db.expire_all()
+    assert crud.get_daily_record_by_date(db, user.id, DAY) is None
+    assert aggregates_of(db, user.id) == []
+    assert crud.get_filled_dates(db, user.id) == []
+
+def test_record_with_manual_values_is_kept(db):
+    user = create_user(db)
+    create_record(db, user.id, DAY, calories_consumed=0, protein_g=0, fat_g=0, carbs_g=0,
+                  calories_burned_exercise=300)
+    entry = add_rice(db, user.id)
+    assert crud.delete_meal_entry(db, user.id, entry.id)
+    db.expire_all()
+    record = crud.get_daily_record_by_date(db, user.id, DAY)
+    assert record is not None and record.calories_burned_exercise == 300
+    assert [a.days for a in aggregates_of(db, user.id)] == [1, 1]
+
+def test_emptied_record_with_feedback_job_is_removed(db):
+    user = create_user(db)
+    entry = add_rice(db, user.id)
+    jobs.enqueue_feedback_job(db, crud.get_daily_record_by_date(db, user.id, DAY))
+    assert crud.delete_meal_entry(db, user.id, entry.id)
+    assert db.query(models_db.LLMJob).count() == 0
@@ -0,0 +1,154 @@
+"""背景 LLM 工作：搶工作只會成功一次、遺留工作重新排入、失敗時不寫入錯誤內容、排入時撞上剛結束的工作"""
+import threading
+from datetime import date, datetime, timedelta
+
+import pytest
+from conftest import create_record, create_user
+from sqlalchemy import update
+
+from app import coordination, jobs, models_db, services
+from app.database import SessionLocal
+
+DAY = date(2025, 5, 1)
+
+
+def drain_queue() -> list[int]:
+    queue, job_ids = coordination.backend(), []
+    while (job_id := queue.pop_job(0)) is not None:
+        job_ids.append(job_id)
+    return job_ids
+
+def add_job(db, record, status=models_db.JobStatusEnum.pending, age=timedelta(0)) -> int:
+    updated = datetime.utcnow() - age
+    job = models_db.LLMJob(user_id=record.user_id, record_id=record.id, status=status,
+                           created_at=updated, updated_at=updated)
+    db.add(job)
+    db.commit()
+    return job.id
+
+def job_status(job_id: int) -> models_db.JobStatusEnum:
+    db = SessionLocal()
+    try:
+        return jobs.get_job(db, job_id).status
+    finally:
+        db.close()
+
+
+def test_claim_succeeds_only_once(db):
+    record = create_record(db, create_user(db).id, DAY)
+    job_id = add_job(db, record)
+    results = []
+
+    def claim():
+        session = SessionLocal()
+        try:
+            results.append(jobs._claim(session, job_id))
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=claim) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results.count(True) == 1
+    assert job_status(job_id) == models_db.JobStatusEnum.running
+
+def test_requeue_at_startup_pushes_every_pending_job(db):
+    user = create_user(db)
+    pending = add_job(db, create_record(db, user.id, DAY))
+    done = add_job(db, create_record(db, user.id, DAY + timedelta(days=1)), status=models_db.JobStatusEnum.done)
+    drain_queue()
+    assert jobs._requeue(stale_pending=False) == 1
+    assert drain_queue() == [pending]
+    assert job_status(done) == models_db.JobStatusEnum.done
+
+def test_sweep_requeues_only_stale_jobs(db):
+    user = create_user(db)
+    fresh = add_job(db, create_record(db, user.id, DAY))
+    stale_pending = add_job(db, create_record(db, user.id, DAY + timedelta(days=1)), age=timedelta(minutes=2))
+    stale_running = add_job(db, create_record(db, user.id, DAY + timedelta(days=2)),
+                            status=models_db.JobStatusEnum.running, age=timedelta(minutes=10))
+    busy = add_job(db, create_record(db, user.id, DAY + timedelta(days=3)),
+                   status=models_db.JobStatusEnum.running, age=timedelta(seconds=10))
+    drain_queue()
+
+    assert jobs._requeue(stale_pending=True) == 2
+    assert sorted(drain_queue()) == sorted([stale_pending, stale_running])
+    assert job_status(stale_running) == models_db.JobStatusEnum.pending
+    assert job_status(busy) == models_db.JobStatusEnum.running
+    assert job_status(fresh) == models_db.JobStatusEnum.pending
+
+def test_requeued_job_runs_once(db, fake_model):
+    record = create_record(db, create_user(db).id, DAY)
+    job_id = add_job(db, record, status=models_db.JobStatusEnum.running, age=timedelta(minutes=10))
+    drain_queue()
+    jobs._requeue(stale_pending=True)
+    for queued in drain_queue() * 2:  # 重複排入無妨
+        jobs.run_feedback_job(queued)
+    assert job_status(job_id) == models_db.JobStatusEnum.done
+    assert fake_model.calls == 1
+    db.refresh(record)
+    assert record.llm_feedback and record.llm_feedback_key
+
+def test_failed_llm_call_marks_job_failed_without_storing_feedback(db, fake_model):
+    record = create_record(db, create_user(db).id, DAY)
+    job_id = add_job(db, record)
+    fake_model.fail_next(1, "invalid")
+    jobs.run_feedback_job(job_id)
+    db.expire_all()
+    job = jobs.get_job(db, job_id)
+    assert job.status == models_db.JobStatusEnum.failed and job.error
+    assert db.get(models_db.DailyRecord, record.id).llm_feedback is None
+    assert db.query(models_db.LLMFeedbackCache).count() == 0
+
+
+def finish_before_lookup(db, monkeypatch, job_id: int, save=None):
+    """模擬另一個 worker 在 INSERT ... ON CONFLICT DO NOTHING 與查詢進行中工作之間完成了擋下插入的工作"""
+    query = db.query
+
+    def racing_query(*args, **kwargs):
+        if not args or args[0] is not models_db.LLMJob.record_id:
+            return query(*args, **kwargs)
+        monkeypatch.setattr(db, "query", query)
+        db.execute(update(models_db.LLMJob).where(models_db.LLMJob.id == job_id)
+                   .values(status=models_db.JobStatusEnum.done if save else models_db.JobStatusEnum.failed))
+        if save:
+            save()
+        return query(*args, **kwargs)
+
+    monkeypatch.setattr(db, "query", racing_query)
+
+@pytest.fixture
+def summary_with_active_job(db):
+    user = create_user(db)
+    record = create_record(db, user.id, DAY)
+    summary = services.build_daily_summary(user, record)
+    return record, summary, add_job(db, record)
+
+def test_job_finished_before_lookup_has_no_job_id(db, monkeypatch, summary_with_active_job):
+    record, _, job_id = summary_with_active_job
+    finish_before_lookup(db, monkeypatch, job_id)
+    assert jobs.enqueue_feedback_job(db, record) is None
+
+def test_summary_uses_feedback_of_job_finished_before_lookup(db, monkeypatch, summary_with_active_job):
+    record, summary, job_id = summary_with_active_job
+    key = services.feedback_cache_key(summary)
+    finish_before_lookup(db, monkeypatch, job_id,
+                         save=lambda: services.save_llm_feedback(db, record.id, record.user_id, key, "keep going"))
+    services.ensure_llm_feedback(db, record, summary)
+    assert (summary.llm_feedback_status, summary.llm_feedback, summary.llm_job_id) == ("ready", "keep going", None)
+
+def test_summary_reports_failed_job_finished_before_lookup(db, monkeypatch, summary_with_active_job):
+    record, summary, job_id = summary_with_active_job
+    finish_before_lookup(db, monkeypatch, job_id)
+    services.ensure_llm_feedback(db, record, summary)
+    assert (summary.llm_feedback_status, summary.llm_job_id) == ("failed", None)
+
+def test_range_summary_handles_job_finished_before_lookup(db, monkeypatch):
+    user = create_user(db)
+    record = create_record(db, user.id, DAY)
+    job_id = add_job(db, record)
+    finish_before_lookup(db, monkeypatch, job_id)
+    result = services.build_summary_range(db, services.get_user_profile(db, user.id), [record], DAY, DAY)
+    assert [(p.llm_feedback_status, p.llm_job_id) for p in result.days] == [("failed", None)]
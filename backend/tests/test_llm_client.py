@@ -0,0 +1,149 @@
+"""LLMClient 的速率限制、重試退避與斷路器，以 FakeGeminiModel 注入各種上游失敗"""
+import time
+
+import pytest
+
+from app.llm_client import CircuitBreaker, CircuitOpenError, LLMClient, LLMError, LLMTimeoutError, TokenBucket
+from app.llm_fake import FakeGeminiModel
+
+
+def make_client(model=None, breaker=None, **kwargs) -> tuple[LLMClient, list[float]]:
+    """回傳 client 與實際採用的退避秒數 (測試用很短的退避，並記錄每次的值)"""
+    options = {"rate_per_min": 0, "max_retries": 3, "backoff_base": 0.01, "backoff_max": 0.05,
+               "timeout": 0.05, "acquire_timeout": 1.0, **kwargs}
+    client = LLMClient(model or FakeGeminiModel(), breaker=breaker or CircuitBreaker(10, 30), **options)
+    delays = []
+    backoff = client._backoff
+
+    def recording_backoff(attempt):
+        delay = backoff(attempt)
+        delays.append(delay)
+        return delay
+
+    client._backoff = recording_backoff
+    return client, delays
+
+
+# --- 重試 ---
+@pytest.mark.parametrize("mode", ["unavailable", "rate_limit", "timeout"])
+def test_transient_failures_are_retried(mode):
+    client, delays = make_client()
+    client.model.fail_next(2, mode)
+    assert client.generate("prompt")
+    assert client.model.calls == 3
+    assert len(delays) == 2
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+def test_backoff_is_full_jitter_within_exponential_cap():
+    client, _ = make_client(backoff_base=0.1, backoff_max=0.5)
+    for attempt in range(5):
+        cap = min(0.5, 0.1 * 2 ** attempt)
+        samples = [client._backoff(attempt) for _ in range(200)]
+        assert all(0 <= s <= cap for s in samples)
+        # full jitter：取值分散在 [0, cap]，不是固定等待 cap
+        assert len(set(samples)) > 100
+        assert min(samples) < cap / 4 and max(samples) > cap * 3 / 4
+
+def test_retries_exhausted_raise_llm_error():
+    client, delays = make_client(max_retries=2)
+    client.model.fail_next(5, "unavailable")
+    with pytest.raises(LLMError):
+        client.generate("prompt")
+    assert client.model.calls == 3
+    assert len(delays) == 2
+
+def test_timeout_is_reported_as_llm_timeout_error():
+    client, _ = make_client(max_retries=0)
+    client.model.fail_next(1, "timeout")
+    with pytest.raises(LLMTimeoutError):
+        client.generate("prompt")
+
+@pytest.mark.parametrize("mode", ["invalid", "empty"])
+def test_upstream_rejections_are_not_retried_or_counted(mode):
+    client, delays = make_client(breaker=CircuitBreaker(1, 30))
+    client.model.fail_next(1, mode)
+    with pytest.raises(LLMError):
+        client.generate("prompt")
+    assert client.model.calls == 1
+    assert delays == []
+    # 上游有回應的錯誤不代表上游故障
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+def test_stream_is_not_retried_after_partial_output():
+    client, delays = make_client()
+    client.model.fail_next(1, "interrupted")
+    with pytest.raises(LLMError):
+        list(client.generate_stream("prompt"))
+    assert client.model.calls == 1
+    assert delays == []
+
+def test_stream_retries_before_first_chunk():
+    client, delays = make_client()
+    client.model.fail_next(1, "unavailable")
+    assert "".join(client.generate_stream("prompt")) == client.model.reply
+    assert client.model.calls == 2
+    assert len(delays) == 1
+
+
+# --- 斷路器 ---
+def test_breaker_opens_after_consecutive_failures_and_fails_fast():
+    client, _ = make_client(breaker=CircuitBreaker(2, reset_timeout=30), max_retries=0)
+    client.model.fail_next(2, "unavailable")
+    for _ in range(2):
+        with pytest.raises(LLMError):
+            client.generate("prompt")
+    assert client.breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        client.generate("prompt")
+    assert client.model.calls == 2  # 打開期間不呼叫上游
+
+def test_breaker_half_open_probe_closes_on_success():
+    client, _ = make_client(breaker=CircuitBreaker(1, reset_timeout=0.05), max_retries=0)
+    client.model.fail_next(1, "unavailable")
+    with pytest.raises(LLMError):
+        client.generate("prompt")
+    assert client.breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.06)
+    assert client.breaker.state == CircuitBreaker.HALF_OPEN
+    assert client.generate("prompt")
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+def test_breaker_half_open_probe_failure_reopens():
+    client, _ = make_client(breaker=CircuitBreaker(1, reset_timeout=0.05), max_retries=0)
+    client.model.fail_next(2, "unavailable")
+    with pytest.raises(LLMError):
+        client.generate("prompt")
+    time.sleep(0.06)
+    with pytest.raises(LLMError):
+        client.generate("prompt")
+    assert client.breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        client.generate("prompt")
+
+def test_breaker_half_open_admits_a_single_probe():
+    breaker = CircuitBreaker(1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()  # 試探請求進行中
+    breaker.release()
+    assert breaker.allow()
+
+
+# --- 速率限制 ---
+def test_token_bucket_allows_burst_then_waits_for_refill():
+    bucket = TokenBucket(rate=20, capacity=2)
+    assert bucket.acquire(timeout=0)
+    assert bucket.acquire(timeout=0)
+    assert not bucket.acquire(timeout=0)
+    started = time.monotonic()
+    assert bucket.acquire(timeout=1)
+    assert 0.02 <= time.monotonic() - started < 0.5
+
+def test_rate_limiter_timeout_is_unavailable_without_calling_upstream():
+    client, _ = make_client(rate_per_min=60, burst=1, acquire_timeout=0.01)
+    assert client.generate("prompt")
+    with pytest.raises(LLMError):
+        client.generate("prompt")
+    assert client.model.calls == 1
@@ -0,0 +1,28 @@
+"""migrations.upgrade 的一次性資料修正"""
+from datetime import date
+
+from conftest import create_record, create_user
+
+from app import feedback_cache, migrations, models_db
+from app.database import engine
+
+
+def test_legacy_error_feedback_is_purged_once(db):
+    record = create_record(db, create_user(db).id, date(2025, 5, 1))
+    error = feedback_cache.LEGACY_ERROR_PREFIXES[0] + "，請稍後再試"
+    record.llm_feedback, record.llm_feedback_key = error, "k" * 64
+    db.add(models_db.LLMFeedbackCache(key="k" * 64, feedback=error))
+    db.commit()
+
+    migrations.upgrade(engine)
+    db.expire_all()
+    assert db.get(models_db.DailyRecord, record.id).llm_feedback is None
+    assert db.query(models_db.LLMFeedbackCache).count() == 0
+    assert db.get(models_db.DataMigration, "purge_legacy_error_feedback") is not None
+
+    # 已記錄執行過：之後的 upgrade (例如每次部署) 不再掃描
+    record.llm_feedback = error
+    db.commit()
+    migrations.upgrade(engine)
+    db.expire_all()
+    assert db.get(models_db.DailyRecord, record.id).llm_feedback == error
@@ -0,0 +1,143 @@
+"""
+兩個獨立的 API 行程 (各一個 uvicorn worker) 共用同一個 SQLite 檔，分別以 database 與 redis 協調後端
+(redis 以 fakeredis 的 TCP server 代替，未安裝 fakeredis / lupa 時略過)：
+    一個行程的使用者資料更新，另一個行程的快取要在通知輪詢週期內失效；
+    兩個行程同時請求同一天的總結與 SSE 串流，每筆紀錄只能有一次 LLM 呼叫。
+"""
+import os
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+from conftest import RECORD, USER
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+POLL_SECONDS = 0.1
+_OK_CALLS = re.compile(r'^llm_requests_total\{outcome="ok"\} (\S+)$', re.M)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(env: dict, log_path: str) -> tuple[subprocess.Popen, str]:
+    # uvicorn 的 --workers 預設取 WEB_CONCURRENCY，明確指定每個行程只有一個 worker
+    port = free_port()
+    with open(log_path, "w") as log:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--workers", "1",
+             "--log-level", "warning", "--no-access-log"],
+            cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            if httpx.get(f"{base_url}/metrics", timeout=5).status_code == 200:
+                return server, base_url
+        except httpx.TransportError:
+            pass
+        if server.poll() is not None or time.monotonic() > deadline:
+            server.kill()
+            with open(log_path) as log:
+                pytest.fail(f"server did not start:\n{log.read()}")
+        time.sleep(0.1)
+
+def stop_server(server: subprocess.Popen):
+    server.terminate()
+    try:
+        server.wait(15)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+def ok_llm_calls(base_url: str) -> int:
+    match = _OK_CALLS.search(httpx.get(f"{base_url}/metrics", timeout=10).text)
+    return int(float(match.group(1))) if match else 0
+
+
+@pytest.fixture(scope="module")
+def fake_redis_url():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # 釋放租約用的 Lua script
+    if not hasattr(fakeredis, "TcpFakeServer"):
+        pytest.skip("fakeredis without TcpFakeServer")
+    server = fakeredis.TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"redis://127.0.0.1:{server.server_address[1]}/0"
+    server.shutdown()
+
+@pytest.fixture(scope="module", params=["database", "redis"])
+def servers(request, tmp_path_factory):
+    workdir = tmp_path_factory.mktemp(f"multiprocess-{request.param}")
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{workdir / 'shared.db'}",
+        "AUTO_MIGRATE": "false",
+        "WEB_CONCURRENCY": "2",
+        "COORDINATION_BACKEND": request.param,
+        "COORDINATION_POLL_SECONDS": str(POLL_SECONDS),
+        "LLM_BACKEND": "fake",
+        "FAKE_LLM_LATENCY_MS": "300",
+        "FAKE_LLM_STREAM_CHUNK_MS": "20",
+        "USER_CACHE_REDIS_URL": "",
+    }
+    if request.param == "redis":
+        env["COORDINATION_REDIS_URL"] = request.getfixturevalue("fake_redis_url")
+    subprocess.run([sys.executable, "-m", "app.migrations"], cwd=BACKEND_DIR, env=env, check=True,
+                   capture_output=True)
+    started = []
+    try:
+        for name in ("a", "b"):
+            started.append(start_server(env, str(workdir / f"server-{name}.log")))
+        yield [base_url for _, base_url in started]
+    finally:
+        for server, _ in started:
+            stop_server(server)
+
+
+def test_profile_update_in_one_process_reaches_the_other(servers):
+    a, b = servers
+    uid = httpx.post(f"{a}/users/", json=USER).json()["id"]
+    for base_url in (a, a, b):
+        assert httpx.get(f"{base_url}/users/{uid}/").json()["weight_kg"] == USER["weight_kg"]
+    assert httpx.get(f"{a}/system/user_cache/").json()["hits"] >= 1  # a 確實由快取回應
+
+    httpx.put(f"{b}/users/{uid}/", json={**USER, "weight_kg": 72.5}).raise_for_status()
+    deadline = time.monotonic() + 5
+    while httpx.get(f"{a}/users/{uid}/").json()["weight_kg"] != 72.5:
+        assert time.monotonic() < deadline, "stale profile in the other process"
+        time.sleep(POLL_SECONDS)
+
+def test_one_llm_call_per_record_across_processes(servers):
+    a, b = servers
+    calls_before = sum(ok_llm_calls(base_url) for base_url in servers)
+    uid = httpx.post(f"{a}/users/", json=USER).json()["id"]
+    days = ["2025-06-01", "2025-06-02"]
+    for i, day in enumerate(days):
+        # 不同的攝取量，兩天的建議快取鍵不同
+        record = {**RECORD, "record_date": day, "calories_consumed": RECORD["calories_consumed"] + 100 * i}
+        httpx.post(f"{a}/users/{uid}/daily_records/", json=record).raise_for_status()
+
+    requests = [(base_url, f"/users/{uid}/daily_summary/{day}/{suffix}")
+                for day in days for base_url in (a, b) for suffix in ("", "", "", "stream/")]
+    with ThreadPoolExecutor(max_workers=len(requests)) as pool:
+        responses = list(pool.map(lambda req: httpx.get(req[0] + req[1], timeout=30), requests))
+    assert all(r.status_code == 200 for r in responses)
+    assert all("event: done" in r.text for r in responses if r.headers["content-type"].startswith("text/event-stream"))
+
+    deadline = time.monotonic() + 20
+    for day in days:
+        for base_url in (a, b):
+            while httpx.get(f"{base_url}/users/{uid}/daily_summary/{day}/").json()["llm_feedback_status"] != "ready":
+                assert time.monotonic() < deadline, f"feedback for {day} never became ready"
+                time.sleep(0.1)
+    assert sum(ok_llm_calls(base_url) for base_url in servers) - calls_before == len(days)
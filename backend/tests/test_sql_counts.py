@@ -0,0 +1,122 @@
+"""
+熱門端點每個請求發出的 SQL 語句數上限 (以 before_cursor_execute 計算，不含 PRAGMA 與背景執行緒)，
+避免重構時不小心退回 N+1 查詢或多餘的 SELECT／refresh。數字變少時請一併調低上限。
+同步模式下另開一個 DB_ASYNC_MODE=true 的 pytest 行程，以相同上限檢查 AsyncSession 的路徑。
+"""
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import pytest
+from conftest import RECORD, USER
+from sqlalchemy import event
+
+from app import database, models_db
+
+DAY = date(2025, 5, 1)
+# 背景 LLM worker 與協調層的輪詢不屬於請求本身
+_BACKGROUND_THREADS = ("llm-worker-", "llm-stream", "coordination-")
+
+
+@contextmanager
+def count_statements():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        if statement.startswith("PRAGMA") or threading.current_thread().name.startswith(_BACKGROUND_THREADS):
+            return
+        statements.append(statement)
+
+    engines = [database.engine] + ([database.async_engine.sync_engine] if database.async_engine is not None else [])
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+def assert_at_most(statements: list[str], limit: int):
+    assert len(statements) <= limit, "\n".join(s[:90] for s in statements)
+
+def wait_for_job(client, job_id: int):
+    deadline = time.monotonic() + 10
+    while client.get(f"/jobs/{job_id}/").json()["status"] in ("pending", "running"):
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+@pytest.fixture
+def user_id(client) -> int:
+    uid = client.post("/users/", json=USER).json()["id"]
+    start = DAY - timedelta(days=29)
+    for i in range(30):
+        day = (start + timedelta(days=i)).isoformat()
+        client.post(f"/users/{uid}/daily_records/", json={**RECORD, "record_date": day}).raise_for_status()
+    return uid
+
+
+def test_update_user(client, user_id):
+    with count_statements() as statements:
+        client.put(f"/users/{user_id}/", json={**USER, "weight_kg": 71}).raise_for_status()
+    # 單一 UPDATE ... RETURNING (單一 worker 不發送快取失效通知，多 worker 時也由背景執行緒寫入)
+    assert_at_most(statements, 1)
+
+def test_daily_record_upsert(client, user_id):
+    with count_statements() as statements:
+        r = client.post(f"/users/{user_id}/daily_records/", json={**RECORD, "record_date": DAY.isoformat(),
+                                                                  "calories_consumed": 2200})
+    assert r.status_code == 200
+    # upsert + 週／月彙總 + TDEE 重新擬合 + 資料版本
+    assert_at_most(statements, 8)
+
+def test_daily_summary(client, user_id):
+    url = f"/users/{user_id}/daily_summary/{DAY.isoformat()}/"
+    with count_statements() as statements:
+        pending = client.get(url).json()
+    # 使用者與紀錄 (JOIN) + 建議快取查詢 + 排入工作
+    assert_at_most(statements, 3)
+
+    wait_for_job(client, pending["llm_job_id"])
+    with count_statements() as statements:
+        assert client.get(url).json()["llm_feedback_status"] == "ready"
+    # 建議已寫回紀錄：只剩單一 JOIN 查詢
+    assert_at_most(statements, 1)
+
+def wait_for_jobs(db):
+    deadline = time.monotonic() + 10
+    while db.query(models_db.LLMJob).filter(models_db.LLMJob.status.in_(["pending", "running"])).count():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+def test_daily_summaries_range(client, user_id, db):
+    url = f"/users/{user_id}/daily_summaries/"
+    params = {"start": (DAY - timedelta(days=29)).isoformat(), "end": DAY.isoformat()}
+    with count_statements() as statements:
+        r = client.get(url, params=params)
+    assert len(r.json()["days"]) == 30
+    # 使用者資料 + 範圍查詢 + 建議快取批次查詢 + 一次排入 30 個工作
+    assert_at_most(statements, 4)
+
+    wait_for_jobs(db)
+    with count_statements() as statements:
+        r = client.get(url, params=params)
+    assert all(day["llm_feedback_status"] == "ready" for day in r.json()["days"])
+    # 建議都已寫回：30 天的紀錄以單一範圍查詢取得，使用者資料來自快取
+    assert_at_most(statements, 1)
+
+
+@pytest.mark.skipif(database.DB_ASYNC_MODE, reason="already running with DB_ASYNC_MODE=true")
+def test_counts_in_async_mode():
+    # DB_ASYNC_MODE 在匯入時決定 engine 與 session 類型，無法在同一個行程內切換
+    result = subprocess.run(
+        [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", __file__],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env={**os.environ, "DB_ASYNC_MODE": "true"}, capture_output=True, text=True, timeout=300,
+    )
+    assert result.returncode == 0, result.stdout[-4000:] + result.stderr[-2000:]
+    assert "4 passed, 1 skipped" in result.stdout
@@ -0,0 +1,92 @@
+"""SSE 串流：同一天的並行串流只呼叫一次 LLM，用戶端中斷連線不影響建議寫入"""
+import asyncio
+import json
+import threading
+import time
+from datetime import date
+
+from conftest import create_record, create_user
+
+from app import models_db, services, streaming
+
+DAY = date(2025, 5, 1)
+
+
+def parse_events(body: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        name, data = block.split("\n", 1)
+        events.append((name.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+def wait_for_feedback(db, record_id: int) -> str:
+    deadline = time.monotonic() + 10
+    while True:
+        db.expire_all()
+        feedback = db.get(models_db.DailyRecord, record_id).llm_feedback
+        if feedback or time.monotonic() > deadline:
+            return feedback
+        time.sleep(0.02)
+
+
+def test_concurrent_streams_share_one_llm_call(client, db, fake_model):
+    fake_model.stream_chunk_ms = 20  # 讓串流持續一段時間，四條連線確實重疊
+    record = create_record(db, create_user(db).id, DAY)
+    url = f"/users/{record.user_id}/daily_summary/{DAY.isoformat()}/stream/"
+    barrier = threading.Barrier(4)
+    bodies = []
+
+    def stream():
+        barrier.wait()
+        r = client.get(url)
+        assert r.status_code == 200
+        bodies.append(r.text)
+
+    threads = [threading.Thread(target=stream) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert fake_model.calls == 1
+    expected = fake_model.reply.replace("\n", "<br>")
+    for body in bodies:
+        events = parse_events(body)
+        assert events[0][0] == "summary"
+        assert "".join(data["text"] for name, data in events if name == "feedback") == expected
+        assert events[-1] == ("done", {"llm_feedback": expected, "llm_feedback_status": "ready",
+                                       "etag": events[-1][1]["etag"]})
+    assert len({parse_events(body)[-1][1]["etag"] for body in bodies}) == 1
+    assert wait_for_feedback(db, record.id) == expected
+
+    # 寫入後的請求直接回傳已備妥的建議
+    events = parse_events(client.get(url).text)
+    assert [name for name, _ in events] == ["summary", "done"]
+    assert fake_model.calls == 1
+
+def test_disconnect_does_not_cancel_generation(db, fake_model):
+    fake_model.stream_chunk_ms = 20
+    record = create_record(db, create_user(db).id, DAY)
+    summary = services.build_daily_summary(record.owner, record)
+    key = services.prepare_feedback_stream(db, record, summary)
+    assert key is not None
+
+    async def read_then_disconnect():
+        events = streaming.daily_summary_events(summary, key)
+        assert (await anext(events)).startswith("event: summary")
+        assert (await anext(events)).startswith("event: feedback")
+        await events.aclose()
+
+    asyncio.run(read_then_disconnect())
+    assert wait_for_feedback(db, record.id) == fake_model.reply.replace("\n", "<br>")
+    assert db.get(models_db.LLMFeedbackCache, key) is not None
+    assert fake_model.calls == 1
+
+def test_llm_failure_is_broadcast_without_saving(client, db, fake_model):
+    fake_model.fail_next(1, "invalid")
+    record = create_record(db, create_user(db).id, DAY)
+    events = parse_events(client.get(f"/users/{record.user_id}/daily_summary/{DAY.isoformat()}/stream/").text)
+    assert events[-1][0] == "error"
+    assert events[-1][1]["llm_feedback_status"] == "failed"
+    db.expire_all()
+    assert db.get(models_db.DailyRecord, record.id).llm_feedback is None
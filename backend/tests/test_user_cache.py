@@ -0,0 +1,88 @@
+"""使用者資料快取：計數與失效的執行緒安全，以及 Redis 呼叫不佔用 event loop"""
+import asyncio
+import threading
+
+import pytest
+from conftest import USER
+from sqlalchemy.util.concurrency import greenlet_spawn
+
+from app import schemas, user_cache
+from app.database import run_blocking
+
+
+def profile(user_id: int = 1) -> schemas.UserProfile:
+    return schemas.UserProfile(user=schemas.User(id=user_id, **USER), bmr=1600.0, tdee=2200.0,
+                               recommended_daily_calories=2200.0)
+
+
+def test_counters_are_consistent_under_concurrency():
+    before = user_cache.stats()
+    threads, per_thread = 8, 500
+
+    def lookups():
+        for i in range(per_thread):
+            user_cache.get_or_load(i % 20 + 1, lambda: profile(i % 20 + 1))
+
+    workers = [threading.Thread(target=lookups) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    after = user_cache.stats()
+    assert (after["hits"] + after["misses"]) - (before["hits"] + before["misses"]) == threads * per_thread
+
+def test_invalidation_during_load_is_not_cached():
+    def loader():
+        user_cache.invalidate(1)  # 例如另一個請求在載入期間更新了使用者
+        return profile()
+
+    assert user_cache.get_or_load(1, loader) is not None
+    assert user_cache._store.get(1) is None
+
+def test_run_blocking_leaves_the_event_loop_inside_run_db_greenlet():
+    async def main():
+        loop_thread = threading.get_ident()
+        inside = await greenlet_spawn(run_blocking, threading.get_ident)
+        return loop_thread, inside
+
+    loop_thread, inside = asyncio.run(main())
+    assert inside != loop_thread
+    # 不在 greenlet 中 (threadpool、背景執行緒) 時直接呼叫
+    assert run_blocking(threading.get_ident) == threading.get_ident()
+
+
+@pytest.fixture
+def redis_store(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    import redis
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, "from_url", lambda url, **kwargs: fakeredis.FakeRedis(server=server))
+    return user_cache.RedisStore("redis://test", ttl=60)
+
+def test_redis_store_round_trip(redis_store):
+    redis_store.set(1, profile())
+    assert redis_store.get(1) == profile()
+    redis_store.delete(1)
+    assert redis_store.get(1) is None
+    redis_store.set(1, profile())
+    redis_store.set(2, profile(2))
+    redis_store.clear()
+    assert redis_store.get(1) is None and redis_store.get(2) is None
+
+def test_redis_store_calls_run_off_the_event_loop(redis_store, monkeypatch):
+    threads = []
+    get = redis_store._client.get
+
+    def recording_get(*args, **kwargs):
+        threads.append(threading.get_ident())
+        return get(*args, **kwargs)
+
+    monkeypatch.setattr(redis_store._client, "get", recording_get)
+
+    async def main():
+        await greenlet_spawn(redis_store.get, 1)  # 與 run_db 的 run_sync 相同的執行環境
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(main())
+    assert threads and threads[0] != loop_thread
@@ -37,7 +37,9 @@ const app = createApp({
       bmr:                        null,
       recommended_daily_calories: null,
       calorie_balance:            null,
-      llm_feedback:               null
+      llm_feedback:               null,
+      llm_feedback_status:        null,
+      llm_job_id:                 null
     });
 
     /* -------------------------------------------------------
@@ -52,6 +54,31 @@ const app = createApp({
     const selectedUserId = ref(null); 
     const showProfileForm = ref(true);
 
+    /* -------------------------------------------------------
+       C2. 可重新驗證的 GET 快取 (ETag / If-None-Match)
+           伺服器資料未變時回 304，直接沿用上次解析好的 JSON
+    ------------------------------------------------------- */
+    const httpCache = new Map();     // url → { etag, data }
+
+    async function cachedGetJson (url) {
+      const hit = httpCache.get(url);
+      const r = await fetch(url, {
+        cache: 'no-store',             // 由這裡自行管理快取，避免與瀏覽器快取重複
+        headers: hit ? { 'If-None-Match': hit.etag } : {}
+      });
+      if (r.status === 304 && hit) return hit.data;
+      if (!r.ok) {
+        const err = new Error(await r.text());
+        err.status = r.status;
+        throw err;
+      }
+      const data = await r.json();
+      const etag = r.headers.get('ETag');
+      if (etag) httpCache.set(url, { etag, data });
+      else      httpCache.delete(url);
+      return data;
+    }
+
     /* -------------------------------------------------------
        D. 📅 v-calendar
     ------------------------------------------------------- */
@@ -61,9 +88,7 @@ const app = createApp({
     async function loadFilledDates () {
       if (!userId.value) return;
       try {
-        const r = await fetch(`${API_BASE}/users/${userId.value}/daily_records/dates/`);
-        if (!r.ok) throw new Error(await r.text());
-        filledDates.value = await r.json();
+        filledDates.value = await cachedGetJson(`${API_BASE}/users/${userId.value}/daily_records/dates/`);
 
         calendarAttrs.value = [{
             key: 'done',
@@ -80,6 +105,7 @@ const app = createApp({
 
     function onDayClick ({ id }) {          // id = YYYY-MM-DD
       dailyRecordForm.record_date = id;
+      loadMealEntries(id);
 
       if (filledDates.value.includes(id)) {
         fetchDailySummary(id);
@@ -87,7 +113,8 @@ const app = createApp({
       } else {
         resetFormFor(id);
         Object.assign(dailySummary, { bmr:null, recommended_daily_calories:null,
-                                      calorie_balance:null, llm_feedback:null });
+                                      calorie_balance:null, llm_feedback:null,
+                                      llm_feedback_status:null, llm_job_id:null });
       }
     }
 
@@ -104,13 +131,11 @@ const app = createApp({
 
     async function fetchDailyRecord (dateStr) {
         try {
-            const r = await fetch(`${API_BASE}/users/${userId.value}/daily_records/${dateStr}`);
-            if (!r.ok) {
-                console.warn('單日紀錄不存在');
-                return;
-            }
-            Object.assign(dailyRecordForm, await r.json());
-        } catch (e) { console.error('fetchDailyRecord', e); }
+            Object.assign(dailyRecordForm, await cachedGetJson(`${API_BASE}/users/${userId.value}/daily_records/${dateStr}/`));
+        } catch (e) {
+            if (e.status === 404) console.warn('單日紀錄不存在');
+            else console.error('fetchDailyRecord', e);
+        }
     }
 
     /* -------------------------------------------------------
@@ -143,7 +168,8 @@ const app = createApp({
             });
             Object.assign(dailySummary, {
                 bmr:null, recommended_daily_calories:null,
-                calorie_balance:null, llm_feedback:null
+                calorie_balance:null, llm_feedback:null,
+                llm_feedback_status:null, llm_job_id:null
             });
             calendarAttrs.value = [];
         } else {
@@ -237,21 +263,144 @@ const app = createApp({
       }
     }
 
+    /* 依 text/event-stream 格式逐一解析事件，交給 onEvent(event, data) */
+    async function readEventStream (body, onEvent) {
+      const reader  = body.pipeThrough(new TextDecoderStream()).getReader();
+      let buffer = '';
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) return;
+        buffer += value;
+        let sep;
+        while ((sep = buffer.indexOf('\n\n')) >= 0) {
+          const block = buffer.slice(0, sep);
+          buffer = buffer.slice(sep + 2);
+          let event = 'message', data = '';
+          for (const line of block.split('\n')) {
+            if (line.startsWith('event:'))     event = line.slice(6).trim();
+            else if (line.startsWith('data:')) data += line.slice(5).trim();
+          }
+          onEvent(event, data ? JSON.parse(data) : null);
+        }
+      }
+    }
+
+    let summaryStream = null;        // 進行中的串流，切換日期時中斷
+
     async function fetchDailySummary (dateStr) {
       if (!userId.value) return;
+      summaryStream?.abort();
+      const controller = summaryStream = new AbortController();
+      const url = `${API_BASE}/users/${userId.value}/daily_summary/${dateStr}/stream/`;
+      const hit = httpCache.get(url);
       isLoadingSummary.value = true;
       try {
-        const r = await fetch(`${API_BASE}/users/${userId.value}/daily_summary/${dateStr}/`);
+        const r = await fetch(url, {
+          cache: 'no-store',
+          signal: controller.signal,
+          headers: hit ? { 'If-None-Match': hit.etag } : {}
+        });
+        if (r.status === 304 && hit) {
+          Object.assign(dailySummary, hit.data);
+          return;
+        }
         if (!r.ok) throw new Error(await r.text());
-        Object.assign(dailySummary, await r.json());
+
+        // 先顯示數值總結，建議片段隨到隨接上
+        let summary = null;
+        await readEventStream(r.body, (event, data) => {
+          if (event === 'summary') {
+            summary = data;
+            Object.assign(dailySummary, data, { llm_feedback: data.llm_feedback ?? '' });
+            isLoadingSummary.value = false;
+          } else if (event === 'feedback') {
+            dailySummary.llm_feedback += data.text;
+          } else if (event === 'done') {
+            Object.assign(dailySummary, data);
+            if (data.etag) httpCache.set(url, { etag: data.etag, data: { ...summary, ...data } });
+            else           httpCache.delete(url);
+          } else if (event === 'error') {
+            Object.assign(dailySummary, { llm_feedback: null, llm_feedback_status: 'failed' });
+            showMessage('AI 建議產生失敗，請稍後再試', 'error');
+          }
+        });
       } catch (e) {
+        if (e.name === 'AbortError') return;   // 使用者已切換日期
         console.error(e);
         showMessage(`分析失敗: ${e.message}`, 'error');
       } finally {
-        isLoadingSummary.value = false;
+        if (summaryStream === controller) {
+          summaryStream = null;
+          isLoadingSummary.value = false;
+        }
       }
     }
 
+    /* -------------------------------------------------------
+       G2. 食物紀錄 (搜尋食物 → 輸入份量 → 累加進當日總量)
+    ------------------------------------------------------- */
+    const foodQuery   = ref('');
+    const foodResults = ref([]);
+    const mealEntries = ref([]);
+    const mealForm    = reactive({ meal: 'lunch', food: null, grams: null });
+    let foodSearchTimer = null;
+
+    function onFoodInput () {
+      mealForm.food = null;
+      clearTimeout(foodSearchTimer);
+      const q = foodQuery.value.trim();
+      if (!q) { foodResults.value = []; return; }
+      foodSearchTimer = setTimeout(async () => {
+        const r = await fetch(`${API_BASE}/foods/search/?q=${encodeURIComponent(q)}&limit=8`);
+        if (r.ok && foodQuery.value.trim() === q) foodResults.value = await r.json();
+      }, 150);
+    }
+
+    function pickFood (food) {
+      mealForm.food   = food;
+      mealForm.grams  = food.serving_g;
+      foodQuery.value = food.name;
+      foodResults.value = [];
+    }
+
+    async function loadMealEntries (dateStr) {
+      if (!userId.value) return;
+      const r = await fetch(`${API_BASE}/users/${userId.value}/meal_entries/${dateStr}/`);
+      mealEntries.value = r.ok ? await r.json() : [];
+    }
+
+    // 食物紀錄改變了當日總量 → 重新載入紀錄、總結與日曆
+    async function refreshAfterMealChange (dateStr) {
+      await Promise.all([loadMealEntries(dateStr), fetchDailyRecord(dateStr), loadFilledDates()]);
+      fetchDailySummary(dateStr);
+    }
+
+    async function addMealEntry () {
+      if (!mealForm.food || !mealForm.grams) { showMessage('請先選擇食物並輸入份量', 'error'); return; }
+      const dateStr = dailyRecordForm.record_date;
+      try {
+        const r = await fetch(`${API_BASE}/users/${userId.value}/meal_entries/`, {
+          method:'POST',
+          headers:{'Content-Type':'application/json'},
+          body: JSON.stringify({ record_date: dateStr, meal: mealForm.meal,
+                                 food_id: mealForm.food.id, grams: mealForm.grams })
+        });
+        if (!r.ok) throw new Error(await r.text());
+        Object.assign(mealForm, { food: null, grams: null });
+        foodQuery.value = '';
+        await refreshAfterMealChange(dateStr);
+      } catch (e) {
+        console.error(e);
+        showMessage(`新增食物失敗: ${e.message}`, 'error');
+      }
+    }
+
+    async function deleteMealEntry (entry) {
+      const r = await fetch(`${API_BASE}/users/${userId.value}/meal_entries/${entry.id}/`, { method:'DELETE' });
+      if (!r.ok) { showMessage('刪除失敗', 'error'); return; }
+      await refreshAfterMealChange(entry.record_date);
+    }
+
     /* -------------------------------------------------------
        H. 首次載入
     ------------------------------------------------------- */
@@ -276,6 +425,9 @@ const app = createApp({
       isLoadingUser, isLoadingRecord, isLoadingSummary,
       // 日曆
       calendarAttrs, onDayClick,
+      // 食物紀錄
+      foodQuery, foodResults, mealEntries, mealForm,
+      onFoodInput, pickFood, addMealEntry, deleteMealEntry,
       // 方法
       onUserSelect, saveUserProfile, submitDailyRecord, toggleProfileForm
     };